@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Conda prefix build time with the tests' fake conda, sleeping to stand in for
+# conda's startup and index load, counting heavy conda invocations.
+#
+# "before" replays the commands builds used to run (an empty create, an
+# install into it and an env export). "after" is setup_conda_prefix now.
+#
+# usage: bench_conda_build.py [STARTUP_SECONDS]
+import os, sys, time, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pythonrunscript.pythonrunscript import Log, run_with_logging, setup_conda_prefix
+from tests.fake_conda import FakeConda
+
+def before(proj, prefix, specs_f):
+    for (cmd, name) in ((["conda", "create", "--quiet", "--yes", "--prefix", prefix], "create"),
+                        (["conda", "install", "--quiet", "--yes", "--file", specs_f, "--prefix", prefix], "install"),
+                        (["conda", "env", "export", "--quiet", "--prefix", prefix], "export"),
+                        (["conda", "run", "-p", prefix, "--no-capture-output", "true"], "run")):
+        assert run_with_logging(cmd, proj, f"{name}.out", f"{name}.err", Log.SILENT)
+
+def after(proj, prefix, specs_f):
+    assert setup_conda_prefix(proj, prefix, "", "zlib\n", "", Log.SILENT)
+
+def main():
+    startup = sys.argv[1] if len(sys.argv) > 1 else "1.0"
+    with tempfile.TemporaryDirectory() as d:
+        path = os.environ["PATH"]
+        for build in (before, after):
+            conda = FakeConda(os.path.join(d, f"{build.__name__}-conda"))
+            os.environ.update(conda.environ(path), FAKE_CONDA_STARTUP=startup, PYTHONRUNSCRIPT_CONDA_BACKEND="conda")
+            proj = os.path.join(d, build.__name__)
+            os.makedirs(proj)
+            specs_f = os.path.join(proj, "conda_install_specs.txt")
+            with open(specs_f, "w") as f:
+                f.write("zlib\n")
+            t0 = time.perf_counter()
+            build(proj, os.path.join(proj, "condaenv"), specs_f)
+            elapsed = time.perf_counter() - t0
+            calls = [argv[0] for argv in conda.calls()]
+            print(f"{build.__name__:<6}: {elapsed:5.2f}s, {len(calls)} conda invocations ({' '.join(calls)})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Launch latency and peak RSS of running a script in a conda prefix
+# via `conda run` versus exec'ing its python with the captured activation.
+#
+# usage: bench_conda_launch.py [CONDA_PREFIX]
+# Without a prefix, one is created offline from the local conda package cache.
+import os, sys, time, tempfile, subprocess, statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pythonrunscript.pythonrunscript import capture_conda_activation, conda_activated_environ
+
+# runs cmd in a fresh process and reports the peak RSS of its descendants in KiB
+measure = """
+import resource, subprocess, sys
+subprocess.run(sys.argv[1:], env={env!r}, check=True, stdout=subprocess.DEVNULL)
+print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+"""
+
+def bench(cmd, env, n):
+    times, rss = [], []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", measure.format(env=env)] + cmd,
+                             capture_output=True, text=True, check=True).stdout
+        times.append(time.perf_counter() - t0)
+        rss.append(int(out))
+    return (statistics.median(times), max(rss))
+
+def main():
+    n = 10
+    with tempfile.TemporaryDirectory() as d:
+        if len(sys.argv) > 1:
+            prefix = sys.argv[1]
+        else:
+            prefix = os.path.join(d, "condaenv")
+            subprocess.run(["conda", "create", "--offline", "--quiet", "--yes", "--prefix", prefix, "python"],
+                           check=True, stdout=subprocess.DEVNULL)
+        assert capture_conda_activation(d, prefix)
+        python = os.path.join(prefix, "bin", "python3")
+        script = os.path.join(d, "script.py")
+        with open(script, "w") as f:
+            f.write("import sys\n")
+        conda_run = ["conda", "run", "-p", prefix, "--no-capture-output", python, script]
+        (t_run, rss_run) = bench(conda_run, dict(os.environ), n)
+        (t_exec, rss_exec) = bench([python, script], conda_activated_environ(d), n)
+        print(f"conda run      : {t_run*1e3:8.1f} ms  peak RSS {rss_run/1024:6.1f} MiB")
+        print(f"captured execve: {t_exec*1e3:8.1f} ms  peak RSS {rss_exec/1024:6.1f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Time to a ready env after a small edit to a script's dependencies, with
+# and without deriving it from the env built before the edit.
+#
+# Installs heavy dummy wheels from a local directory, so it runs offline.
+import os, sys, time, tempfile
+
+repo = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo)
+from pythonrunscript.pythonrunscript import ProjectPip, ensure_project
+from tests.dummy_wheels import make_wheel
+
+before = ["heavy-a", "heavy-b", "heavy-c"]
+edits = {"add a package": before + ["light"], "bump a version": ["heavy-a", "heavy-b", "heavy-c==2.0"]}
+
+def build(wheels, name, reqs) -> float:
+    text = f"--no-index\n--find-links {wheels}\n" + "\n".join(reqs) + "\n"
+    proj = ProjectPip("script.py", name.ljust(32, "0"), text, "", "", False)
+    t0 = time.perf_counter()
+    assert ensure_project(proj)
+    return time.perf_counter() - t0
+
+def main():
+    os.environ["PYTHONRUNSCRIPT_NO_WHEELHOUSE"] = "1"
+    with tempfile.TemporaryDirectory() as d:
+        wheels = os.path.join(d, "wheels")
+        for name in before:
+            make_wheel(wheels, name, "1.0", payload_bytes=50 << 20)
+        make_wheel(wheels, "heavy-c", "2.0", payload_bytes=50 << 20)
+        make_wheel(wheels, "light", "1.0")
+        for (i, (edit, reqs)) in enumerate(edits.items()):
+            for derive in (False, True):
+                os.environ["XDG_CACHE_HOME"] = os.path.join(d, f"cache-{i}-{derive}")
+                os.environ["PYTHONRUNSCRIPT_NO_DERIVE"] = "0" if derive else "1"
+                build(wheels, "a", before)
+                t = build(wheels, "b", reqs)
+                print(f"{edit:<15} derive={'on ' if derive else 'off'}: ready in {t:5.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Measures the warm launch path with and without the launch index.
+#
+# - "parse" is what every launch did before: Project.make_project()
+# - "index" is a launch index hit: one stat, one small read, one exists()
+# - "e2e" runs the whole CLI on a no-deps script in a subprocess
+#
+# Runs offline against a throwaway XDG_CACHE_HOME.
+import os, sys, time, tempfile, subprocess, statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pythonrunscript.pythonrunscript import Project, lookup_launch_index, record_launch_index
+
+header = """\
+#!/usr/bin/env pythonrunscript
+# /// pythonrunscript-requirements-txt
+# tqdm==4.66.4
+# rich
+# ///
+"""
+
+def bench(f, n):
+    ts = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        f()
+        ts.append(time.perf_counter() - t0)
+    return statistics.median(ts)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as d:
+        os.environ["XDG_CACHE_HOME"] = os.path.join(d, "cache")
+        script = os.path.join(d, "script.py")
+        with open(script, "w") as f:
+            f.write(header + "x = 1\n" * 20000)
+        proj = Project.make_project(script, False, False)
+        os.makedirs(proj.project_path)
+        proj.publish()
+        record_launch_index(proj)
+        assert lookup_launch_index(script, False) is not None
+
+        parse = bench(lambda: Project.make_project(script, False, False), n)
+        index = bench(lambda: lookup_launch_index(script, False), n)
+        print(f"parse  (before): {parse*1e6:9.1f} us")
+        print(f"index  (after) : {index*1e6:9.1f} us   ({parse/index:.1f}x)")
+
+        plain = os.path.join(d, "plain.py")
+        with open(plain, "w") as f:
+            f.write("x = 1\n" * 20000)
+        cmd = [sys.executable, "-m", "pythonrunscript", plain]
+        env = dict(os.environ, PYTHONPATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        run = lambda e: subprocess.run(cmd, env=e, check=True)
+        run(env)
+        e2e_off = bench(lambda: run(dict(env, PYTHONRUNSCRIPT_NO_LAUNCH_INDEX="1")), max(n // 10, 5))
+        e2e_on = bench(lambda: run(env), max(n // 10, 5))
+        print(f"e2e    (before): {e2e_off*1e3:9.1f} ms")
+        print(f"e2e    (after) : {e2e_on*1e3:9.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Disk use and env creation time with and without the package store.
+#
+# Builds several venvs which install overlapping sets of heavy dummy
+# wheels from a local directory, so it runs offline.
+import os, sys, time, tempfile
+
+repo = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo)
+from pythonrunscript.pythonrunscript import Log, create_venv
+from tests.dummy_wheels import make_wheel
+
+combos = [["heavy-a", "heavy-b"], ["heavy-a", "heavy-c"], ["heavy-a", "heavy-b", "heavy-c"],
+          ["heavy-b"], ["heavy-a", "heavy-b", "light"]]
+
+def disk_use(path) -> int:
+    "bytes allocated under path, counting each hardlinked inode once"
+    seen, total = set(), 0
+    for (d, _, fs) in os.walk(path):
+        for f in fs:
+            st = os.lstat(os.path.join(d, f))
+            if st.st_ino not in seen:
+                seen.add(st.st_ino)
+                total += st.st_blocks * 512
+    return total
+
+def run(d, wheels, store:bool):
+    os.environ["XDG_CACHE_HOME"] = os.path.join(d, f"cache-{store}")
+    os.environ["PYTHONRUNSCRIPT_PACKAGE_STORE"] = "1" if store else "0"
+    times = []
+    for (i, combo) in enumerate(combos):
+        proj = os.path.join(os.environ["XDG_CACHE_HOME"], "pythonrunscript", str(i))
+        reqs = f"--no-index\n--find-links {wheels}\n" + "\n".join(combo) + "\n"
+        t0 = time.perf_counter()
+        assert create_venv(proj, os.path.join(proj, "venv"), reqs, Log.SILENT)
+        times.append(time.perf_counter() - t0)
+    return (disk_use(os.environ["XDG_CACHE_HOME"]), times)
+
+def main():
+    with tempfile.TemporaryDirectory() as d:
+        wheels = os.path.join(d, "wheels")
+        for name in ("heavy-a", "heavy-b", "heavy-c"):
+            make_wheel(wheels, name, "1.0", payload_bytes=50 << 20)
+        make_wheel(wheels, "light", "1.0")
+        for store in (False, True):
+            (used, times) = run(d, wheels, store)
+            print(f"store={'on ' if store else 'off'}: {len(combos)} envs use {used/2**20:7.1f} MiB, "
+                  f"build times " + " ".join(f"{t:5.2f}s" for t in times))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Throughput of dependency parsing on large generated scripts.
+#
+# Compares the streaming scanner against the previous approach: read the
+# whole file, then one multiline regex search per delimiter pair.
+import os, re, sys, time, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pythonrunscript.pythonrunscript import block_type_delimiters, scan_dependency_blocks
+
+header = """\
+#!/usr/bin/env pythonrunscript
+# /// pythonrunscript-requirements-txt
+# tqdm==4.66.4
+# ///
+"""
+
+def regex_blocks(script):
+    text = open(script).read()
+    found = {}
+    for (_, pairs) in block_type_delimiters:
+        for (beg, end) in pairs:
+            pattern = rf"(?m:^{re.escape(beg)}$\s(?P<content>(^#(| .*)$\s)+?)^{re.escape(end)}$(?:\s)?)"
+            if (m := re.compile(pattern).search(text)):
+                found[(beg, end)] = m.group('content')
+    return found
+
+def bench(f, script, n=5):
+    best = float('inf')
+    for _ in range(n):
+        t0 = time.perf_counter()
+        f(script)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    fills = {
+        "code body":    "x = 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'\n",
+        "comment body": "# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx\n",
+    }
+    uncapped = lambda script: scan_dependency_blocks(script, max_bytes=1 << 62)
+    with tempfile.TemporaryDirectory() as d:
+        p = os.path.join(d, "script.py")
+        for mb in (1, 8, 32):
+            for (name, fill) in fills.items():
+                with open(p, "w") as f:
+                    f.write(header + fill * (mb * (1 << 20) // len(fill)))
+                size = os.path.getsize(p) / (1 << 20)
+                t_re = bench(regex_blocks, p)
+                t_scan = bench(scan_dependency_blocks, p)
+                t_full = bench(uncapped, p)
+                print(f"{size:5.1f} MB {name:12}: regex {t_re*1e3:8.2f} ms ({size/t_re:6.1f} MB/s)  "
+                      f"scanner {t_scan*1e3:8.2f} ms  uncapped scanner {t_full*1e3:8.2f} ms ({size/t_full:6.1f} MB/s)")
+
+if __name__ == "__main__":
+    main()
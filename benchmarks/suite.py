@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Runs the benchmark suite offline, writes its results as JSON, and compares
+# them against a stored baseline.
+#
+# - build.<kind>: the first launch of an examples/ script, which builds its env
+# - launch.<kind>.cold: a launch which finds the env built, but has to parse
+#   the script because it has no launch index entry
+# - launch.<kind>.warm: a launch index hit
+# - launch.nodeps.<cold|warm>.in_process: the same, running the script in
+#   pythonrunscript's interpreter, with PYTHONRUNSCRIPT_IN_PROCESS=1
+# - launch.<kind>.launcher: running a launcher from --install-launcher
+# - parse.<body>.<size>: parse_dependencies() throughput on generated scripts
+#
+# pip installs come from a local wheelhouse holding a dummy tqdm. conda is a
+# stub which makes a plain venv, so conda builds and launches time
+# pythonrunscript's own work around conda, and count how often it calls conda.
+#
+# usage: suite.py [--quick] [-o RESULTS] [--baseline FILE] [--save-baseline] [--threshold FRACTION]
+#
+# Baselines depend on the machine, so each machine records its own, by
+# default in benchmarks/baseline.json, which git ignores. Exits 1 if a result
+# is worse than its baseline by more than the threshold.
+import os, sys, time, json, shutil, argparse, platform, tempfile, subprocess, statistics
+
+repo = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo)
+from pythonrunscript.pythonrunscript import parse_dependencies
+from tests.dummy_wheels import make_wheel
+from tests.fake_conda import FakeConda
+
+RESULTS_VERSION = 1
+pythonrunscript = [sys.executable, os.path.join(repo, "pythonrunscript", "pythonrunscript.py")]
+examples = {
+    "pip": os.path.join(repo, "examples", "example-requirements.py"),
+    "conda": os.path.join(repo, "examples", "example-requirements2.py"),
+}
+
+tqdm_source = "def tqdm(iterable, *args, **kwargs):\n    return iterable\n"
+
+header = """\
+#!/usr/bin/env pythonrunscript
+# /// pythonrunscript-requirements-txt
+# tqdm==4.66.4
+# ///
+"""
+bodies = {
+    "code": "x = 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'\n",
+    "comments": "# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx\n",
+}
+sizes = {"1K": 1 << 10, "64K": 64 << 10, "1M": 1 << 20, "8M": 8 << 20, "50M": 50 << 20}
+
+def result(value, unit, better="lower") -> dict:
+    return dict(value=value, unit=unit, better=better)
+
+def median_time(f, n) -> float:
+    ts = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        f()
+        ts.append(time.perf_counter() - t0)
+    return statistics.median(ts)
+
+def bench_parse(d, quick) -> dict:
+    results = {}
+    script = os.path.join(d, "generated.py")
+    for (body, fill) in bodies.items():
+        for (label, size) in sizes.items():
+            if quick and size > (8 << 20):
+                continue
+            with open(script, "w") as f:
+                f.write(header + fill * max(1, (size - len(header)) // len(fill)))
+            mb = os.path.getsize(script) / (1 << 20)
+            # small scripts parse in microseconds, so take the best of enough runs to last about a second
+            first = median_time(lambda: parse_dependencies(script), 1)
+            reps = min(2000, max(3, int((0.2 if quick else 1.0) / max(first, 1e-6))))
+            best = min([first] + [median_time(lambda: parse_dependencies(script), 1) for _ in range(reps)])
+            results[f"parse.{body}.{label}"] = result(mb / best, "MB/s", "higher")
+    return results
+
+def bench_launches(d, quick) -> dict:
+    "Builds and launches each kind of script in a throwaway cache, with offline, fake backends"
+    n = 3 if quick else 10
+    conda = FakeConda(os.path.join(d, "fake-conda"))
+    env = dict(os.environ, **conda.environ(os.environ["PATH"]), PYTHONPATH=repo,
+               XDG_CACHE_HOME=os.path.join(d, "cache"), PYTHONRUNSCRIPT_OFFLINE="1", PYTHONRUNSCRIPT_NO_DERIVE="1", PYTHONRUNSCRIPT_CONDA_BACKEND="conda")
+    env.setdefault("PYTHONRUNSCRIPT_PIP_BACKEND", "pip")
+    for var in ("PYTHONRUNSCRIPT_NO_LAUNCH_INDEX", "PYTHONRUNSCRIPT_CACHE_PATH", "PYTHONRUNSCRIPT_PROFILE", "PYTHONRUNSCRIPT_IN_PROCESS"):
+        env.pop(var, None)
+    make_wheel(os.path.join(env["XDG_CACHE_HOME"], "pythonrunscript", "wheelhouse"), "tqdm", "4.66.4", source=tqdm_source)
+    nodeps = os.path.join(d, "nodeps.py")
+    with open(nodeps, "w") as f:
+        f.write("print('hello')\n")
+    launch_index = os.path.join(env["XDG_CACHE_HOME"], "pythonrunscript", "launch-index")
+    def launch(script, **extra):
+        subprocess.run(pythonrunscript + [script], env=dict(env, **extra), check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    def cold_launch(script, **extra):
+        shutil.rmtree(launch_index, ignore_errors=True)
+        launch(script, **extra)
+
+    results = {}
+    for (kind, script) in [("nodeps", nodeps)] + list(examples.items()):
+        if kind != "nodeps":
+            t0 = time.perf_counter()
+            launch(script)
+            results[f"build.{kind}"] = result(time.perf_counter() - t0, "s")
+        results[f"launch.{kind}.cold"] = result(median_time(lambda: cold_launch(script), n), "s")
+        launch(script)
+        results[f"launch.{kind}.warm"] = result(median_time(lambda: launch(script), n), "s")
+        launcher = os.path.join(d, f"{kind}-launcher")
+        subprocess.run(pythonrunscript + ["--install-launcher", script, launcher], env=env, check=True, stdout=subprocess.DEVNULL)
+        results[f"launch.{kind}.launcher"] = result(median_time(lambda: subprocess.run([launcher], env=env, check=True,
+                                                                                      stdout=subprocess.DEVNULL), n), "s")
+        if kind == "nodeps":
+            in_process = dict(PYTHONRUNSCRIPT_IN_PROCESS="1")
+            results[f"launch.{kind}.cold.in_process"] = result(median_time(lambda: cold_launch(script, **in_process), n), "s")
+            launch(script, **in_process)
+            results[f"launch.{kind}.warm.in_process"] = result(median_time(lambda: launch(script, **in_process), n), "s")
+    results["build.conda.invocations"] = result(len(conda.calls()), "calls")
+    return results
+
+def machine() -> dict:
+    return dict(platform=f"{sys.platform}-{platform.machine()}", python=platform.python_version(), cpus=os.cpu_count())
+
+def compare(results:dict, baseline:dict, threshold:float, quick:bool) -> list[str]:
+    "Prints results beside the baseline. Returns the names of those which regressed"
+    if baseline.get("machine") != machine():
+        print("## The baseline was recorded on a different machine, so differences may not mean much")
+    if baseline.get("quick") != quick:
+        print("## Only one of the baseline and this run used --quick, so differences may not mean much")
+    regressed = []
+    print(f"\n{'BENCHMARK':28}  {'BASELINE':>12}  {'NOW':>12}  CHANGE")
+    for (name, now) in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or not base["value"]:
+            print(f"{name:28}  {'-':>12}  {now['value']:>12.4g}  {now['unit']}")
+            continue
+        change = now["value"] / base["value"] - 1
+        worse = change if now["better"] == "lower" else -change
+        flag = "  REGRESSED" if worse > threshold else ""
+        if flag:
+            regressed.append(name)
+        print(f"{name:28}  {base['value']:>12.4g}  {now['value']:>12.4g}  {change:+7.1%} {now['unit']}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs pythonrunscript's benchmarks and compares them against a baseline")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions, and no scripts over 8 MB")
+    parser.add_argument("-o", "--output", default="benchmark-results.json", help="where to write the results")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="also writes the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="fraction by which a result may be worse than its baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        results = bench_parse(d, args.quick)
+        results.update(bench_launches(d, args.quick))
+    report = dict(version=RESULTS_VERSION, created=time.time(), machine=machine(), quick=args.quick, results=results)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"## Wrote {args.output}")
+
+    regressed = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("version") == RESULTS_VERSION:
+            regressed = compare(results, baseline, args.threshold, args.quick)
+    else:
+        print(f"## No baseline at {args.baseline}. Run with --save-baseline to record one")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"## Saved the results as the baseline {args.baseline}")
+    if regressed:
+        print(f"## {len(regressed)} benchmarks regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,101 @@
 #!/usr/bin/env python3
 # python>=3.9.6
-import sys, re, os, subprocess, hashlib, logging, platform, argparse, tempfile, shutil, uuid, textwrap, shlex
+from __future__ import annotations
+import sys, os
 from abc import ABC
-from enum import Enum
-from typing import NoReturn, Union
 
-logging.basicConfig(level=logging.WARNING)
-Log = Enum('Log', ['SILENT','ERRORS','VERBOSE'])
+# Only sys and os are imported eagerly, so that a warm launch (script
+# unchanged, environment cached) can exec without paying for the rest.
+class LazyModule:
+    "Stands in for a module and imports it on first attribute access"
+    def __init__(self, name:str, setup=None):
+        self._name = name
+        self._setup = setup
+    def __getattr__(self, attr:str):
+        module = __import__(self._name)
+        if self._setup:
+            self._setup(module)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+re         = LazyModule('re')
+subprocess = LazyModule('subprocess')
+hashlib    = LazyModule('hashlib')
+logging    = LazyModule('logging', setup=lambda m: m.basicConfig(level=m.WARNING))
+platform   = LazyModule('platform')
+argparse   = LazyModule('argparse')
+tempfile   = LazyModule('tempfile')
+shutil     = LazyModule('shutil')
+uuid       = LazyModule('uuid')
+errno      = LazyModule('errno')
+textwrap   = LazyModule('textwrap')
+shlex      = LazyModule('shlex')
+json       = LazyModule('json')
+glob       = LazyModule('glob')
+csv        = LazyModule('csv')
+configparser = LazyModule('configparser')
+fcntl      = LazyModule('fcntl')
+time       = LazyModule('time')
+sqlite3    = LazyModule('sqlite3')
+selectors  = LazyModule('selectors')
+gzip       = LazyModule('gzip')
+tarfile    = LazyModule('tarfile')
+io         = LazyModule('io')
+atexit     = LazyModule('atexit')
+signal     = LazyModule('signal')
+contextlib = LazyModule('contextlib')
+concurrent = LazyModule('concurrent', setup=lambda m: __import__('concurrent.futures'))
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import NoReturn, Union
+
+class Log:
+    "Verbosity of a build step's output"
+    SILENT  = 'SILENT'
+    ERRORS  = 'ERRORS'
+    VERBOSE = 'VERBOSE'
 
 version_str = "0.2.0 (2024-10-07)"
 
 def main():
+    if os.environ.get("PYTHONRUNSCRIPT_PROFILE", "").lower() not in ("", "0", "false", "no"):
+        start_profile(os.environ["PYTHONRUNSCRIPT_PROFILE"])
+    if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        warm_launch(sys.argv[1], sys.argv[2:])
+    cold_main()
+
+def warm_launch(script:str, args:list[str]) -> None:
+    "Execs script at once if the launch index has it. Returns on a miss"
+    with phase("lookup_launch_index"):
+        proj = lookup_launch_index(script, False)
+    if proj:
+        refresh_launcher(proj)
+        proj.run(args)
+
+def cold_main():
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
     parser.description='Runs a script, installing its dependencies in a cached, isolated environment'
     parser.add_argument('--dry-run',    action='store_true', help='report what pythonrunscript would do, without writing any files')
     parser.add_argument('--version',    action='store_true', help='prints current version')
     parser.add_argument('--verbose',    action='store_true', help='comments on actions and prints all outputs and errors')
-    parser.add_argument('--show-cache', action='store_true', help='print the cache directory of script environments')
-    parser.add_argument('--clean-cache', action='store_true', help='purges all pythonrunscript environments')
+    parser.add_argument('--profile',    action='store_true', help='writes a Chrome trace of how long each stage took to the cache, or to $PYTHONRUNSCRIPT_PROFILE')
+    parser.add_argument('--show-cache', action='store_true', help='print the cache directory and a table of its script environments')
+    parser.add_argument('--json',       action='store_true', help='with --show-cache or --prepare, print the table as JSON')
+    parser.add_argument('--clean-cache', action='store_true', help='purges all pythonrunscript environments, or only those of the given hashes or scripts')
+    parser.add_argument('--older-than', help='with --clean-cache, purges only environments unused for this long, like 30d or 12h')
+    parser.add_argument('--gc',         action='store_true', help='evicts least recently used environments until the cache is within its budget, and empties the trash')
+    parser.add_argument('--empty-trash', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--prepare',    action='store_true', help='builds the environments of every script under the given paths, without running them')
+    parser.add_argument('--offline',    action='store_true', help='installs pip packages only from the wheelhouse in the cache, never from the network')
+    parser.add_argument('--in-process', action='store_true', help='runs scripts without dependencies in this interpreter, instead of starting another')
+    parser.add_argument('--seed-wheelhouse', action='store_true', help='adds the wheels needed by the given requirements files to the wheelhouse')
+    parser.add_argument('--export-env', action='store_true', help='packs the environment of the given script into an archive, building it if needed')
+    parser.add_argument('-o', '--output', help='with --export-env, the archive to write, ending in .tar, .tar.gz or .tar.zst')
+    parser.add_argument('--install-launcher', action='store_true', help='writes a sh launcher which runs the given script in its environment directly, into ~/.local/bin or the path given after the script')
+    parser.add_argument('--import-env', action='store_true', help='unpacks the given archives made by --export-env into the cache')
+    parser.add_argument('--pip-backend', choices=['auto'] + [b.name for b in PIP_BACKENDS], help='builds venvs with this tool, instead of the fastest one installed')
+    parser.add_argument('--conda-backend', choices=['auto'] + [b.name for b in CONDA_BACKENDS], help='builds conda prefixes with this tool, instead of the fastest one installed')
     parser.add_argument('script', nargs='?', default=None, help='path to the script to run')
     parser.add_argument('arguments', nargs=argparse.REMAINDER, help='optional arguments to be passed to that script')
     parser.epilog='''    pythonrunscript runs Python scripts, installing their dependencies.
@@ -25,7 +103,8 @@ def main():
     That is, it will automatically install all dependencies in a cached, isolated
     environment dedicated to your script, and run it in that environment.
 
-    To do this it looks in your script for a comment declaring dependencies
+    To do this it looks in the comments at the top of your script, before the
+    first line of code, for a comment declaring dependencies
     using the inline metadata syntax defined in PEP723. This syntax uses a "type"
     tag to indicate the type of dependency meatadata.
 
@@ -64,6 +143,17 @@ def main():
     Python without corrupting the system. It also works on Linux. Untested on Windows.
     '''
     args = parser.parse_args()
+    # through the environment, so --prepare's workers see these too
+    if args.offline:
+        set_cli_setting("PYTHONRUNSCRIPT_OFFLINE", "1")
+    if args.in_process:
+        set_cli_setting("PYTHONRUNSCRIPT_IN_PROCESS", "1")
+    if args.pip_backend:
+        set_cli_setting("PYTHONRUNSCRIPT_PIP_BACKEND", args.pip_backend)
+    if args.conda_backend:
+        set_cli_setting("PYTHONRUNSCRIPT_CONDA_BACKEND", args.conda_backend)
+    if args.profile and profiler is None:
+        start_profile("1")
 
     if sys.version_info < (3,9,6):
         print(f"I am being interpreted by Python version:\n{sys.version}")  # pyright: ignore
@@ -72,20 +162,36 @@ def main():
     elif args.version:
         print(f"pythonrunscript {version_str}")
         exit(0)
-    elif are_dependencies_missing():
-        print(f"I am being run on the platform {platform.system()} and")
-        print("I cannot find the required external commands bash and tee, so")
-        print("I probably will not work. Aborting.")
-        exit(1)
     elif args.show_cache:
-        print_base_dirs()
+        if args.json:
+            print(json.dumps(catalog_entries(), indent=2))
+        else:
+            print_base_dirs()
+            print_catalog(catalog_entries())
         exit(0)
     elif args.clean_cache:
-        pseudo_erase_dir(cache_base())
+        try:
+            older_than = parse_age(args.older_than) if args.older_than else None
+        except ValueError:
+            print(f"Error: could not parse --older-than {args.older_than}, which should be like 30d or 12h")
+            exit(1)
+        exit(0 if clean_cache([args.script] + args.arguments if args.script else [], older_than) else 1)
+    elif args.gc:
+        collect_garbage(verbose=True)
+        empty_trash(verbose=True)
+        exit(0)
+    elif args.empty_trash:
+        empty_trash(verbose=args.verbose)
         exit(0)
     elif args.script is None:
-        print(f"Error: pythonrunscript  must be called with either the path to a script, --show-cache, --clean-cache, or --help.")
+        print(f"Error: pythonrunscript  must be called with either the path to a script, --show-cache, --clean-cache, --gc, --prepare, --seed-wheelhouse, --import-env, or --help.")
         exit(1)
+    elif args.import_env:
+        exit(0 if all([import_environment(path, args.verbose) for path in [args.script] + args.arguments]) else 1)
+    elif args.seed_wheelhouse:
+        exit(0 if seed_wheelhouse([args.script] + args.arguments, args.verbose) else 1)
+    elif args.prepare:
+        exit(0 if prepare_scripts([args.script] + args.arguments, args.verbose, args.json) else 1)
     else:
         script = args.script
         
@@ -98,32 +204,60 @@ def main():
 
     if args.verbose:
         logging.info("Running in verbose")
-        
-    proj = Project.make_project(script,args.verbose,args.dry_run)
-    
+
+    with phase("lookup_launch_index"):
+        proj = None if args.dry_run or args.export_env or args.install_launcher else lookup_launch_index(script, args.verbose)
+    if proj:
+        logging.info(f"Launch index hit for {script}: {proj.project_path}")
+        if args.verbose:
+            print(f"## Found a launch index entry for this script. Skipping parsing")
+        refresh_launcher(proj)
+        proj.run(args.arguments)
+
+    with phase("make_project"):
+        proj = Project.make_project(script,args.verbose,args.dry_run)
+
     if args.dry_run:
         perform_dry_run(proj)
         exit(0)
 
+    if args.export_env:
+        if isinstance(proj, ProjectNoDeps):
+            print(f"## {script} has no dependencies, so it has no environment to export",file=sys.stderr)
+            exit(1)
+        if not proj.exists() and not ensure_project(proj):
+            exit(1)
+        exit(0 if export_environment(proj, args.output or f"{proj.dep_hash}.tar.gz") else 1)
+
+    if args.install_launcher:
+        if len(args.arguments) > 1:
+            print(f"Error: --install-launcher takes a script and at most one destination")
+            exit(1)
+        if not proj.exists() and not ensure_project(proj):
+            exit(1)
+        exit(0 if install_launcher(proj, args.arguments[0] if args.arguments else None) else 1)
+
     if isinstance(proj, ProjectNoDeps):
         logging.info("No pip block and no conda block detected. Running directly")
         if args.verbose:
             print("## No dependencies needed. Running the script directly")
+        record_launch_index(proj)
+        refresh_launcher(proj)
         proj.run(args.arguments)
     elif not proj.exists():
         logging.info("Needs an environment but none exists. Creating it")
-        creation_success = proj.create()
-        if not creation_success:
-            trashed_env = pseudo_erase_dir(proj.project_path)
-            print(f"## Creating a managed environment failed. Moved the broken environment to {trashed_env}",file=sys.stderr)
-            exit(1)
+        with phase("ensure_project"):
+            if not ensure_project(proj):
+                exit(1)
     else:
         logging.info(f"Found pre-existing project dir: {proj.project_path}")
         if args.verbose:
             print(f"## Found pre-existing project dir: {proj.project_path}")
     # assert: proj exists
+    record_launch_index(proj)
     if args.verbose:
         print("## Running the script using the project directory environment")
+    refresh_launcher(proj)
     proj.run(args.arguments)
 
 def perform_dry_run(proj):
@@ -141,97 +275,213 @@ def perform_dry_run(proj):
             print(f"## I found an environment.yml dependency block, so I'd use that.")
             print(f"## To install conda dependencies, I'd execute this conda environment creation command:\n")
             install_env_f = os.path.join(proj.project_path,'environment.yml')
-            print(f"\t{make_conda_install_yml_command(proj.project_path,install_env_f)}\n")
+            print(f"\t{shlex.join(make_conda_install_yml_command(proj.project_path,install_env_f))}\n")
         elif proj.conda_specs:
             print(f"## I found a conda_install_specs.txt block, so I'd use that.")
-            print(f"## To install conda dependencies, I'd execute this conda install command:")
+            print(f"## To install conda dependencies, I'd execute this conda environment creation command:")
             install_spec_f = os.path.join(proj.project_path,'conda_install_specs.txt')
-            print(f"{make_conda_install_spec_command(proj.project_path, install_spec_f)}\n")
+            print(f"{shlex.join(make_conda_create_spec_command(proj.project_path, install_spec_f))}\n")
         if proj.pip_requirements:
+            if isinstance(proj, ProjectPip):
+                print(f"## I'd create the venv with the Python running me:\n{sys.executable}\n")
             print(f"## To install pip dependencies, I'd execute the following pip command:")
             print(f"python3 -m pip install -r {os.path.join(proj.envdir,'requirements.txt')}\n")
-            print_python3_path()
+        if precompile_enabled():
+            print(f"## Then I'd byte-compile its site-packages with:\n{shlex.join([proj.interpreter, '-m', 'compileall', '-q', '-j', '0'])} <site-packages>\n")
     print(f"## At this point, this project directory would exist:\n{proj.project_path}\n")
     print(f"## I'd run using this env dir:\n{proj.envdir}\n")
     return
 
+# (block type, [(begin line, end line), ...]) in priority order.
+# A block type takes the first pair that matches, and the 'script' block
+# is applied first so explicit blocks override it.
+block_type_delimiters = [
+    ('script', [("# /// script", "# ///")]),
+    ('requirements.txt', [("# /// pythonrunscript-requirements-txt", "# ///"),
+                          ("# ```requirements.txt", "# ```")]),
+    ('conda_install_specs.txt', [("# /// pythonrunscript-conda-install-specs-txt", "# ///"),
+                                 ("# ```conda_install_specs.txt", "# ```")]),
+    ('environment.yml', [("# /// pythonrunscript-environment-yml", "# ///"),
+                         ("# ```environment.yml", "# ```")]),
+]
+
+def parse_max_bytes() -> int:
+    "Byte cap on how much of a script is scanned for dependency blocks"
+    try:
+        return int(os.environ.get("PYTHONRUNSCRIPT_PARSE_MAX_BYTES", 1 << 20))
+    except ValueError:
+        return 1 << 20
+
+def scan_dependency_blocks(script, max_bytes=None) -> dict[tuple[str,str],str]:
+    """
+    Single pass over the leading comments of script.
+
+    Returns {(begin, end): raw content} for the first complete block of each
+    delimiter pair. A block is a begin line, one or more comment lines ("#" or
+    "# ..."), then an end line. Scanning stops at the first line which is
+    neither blank nor a comment, or after max_bytes.
+    """
+    if max_bytes is None:
+        max_bytes = parse_max_bytes()
+    pairs = [pair for (_, ps) in block_type_delimiters for pair in ps]
+    begins = {beg for (beg, _) in pairs}
+    # per pair: lines of the open candidate block, or None when no block is open
+    open_blocks:dict[tuple[str,str],Union[list[str],None]] = {pair: None for pair in pairs}
+    found:dict[tuple[str,str],str] = {}
+    nbytes = 0
+    with open(script, 'r', errors='replace') as f:
+        for line in f:
+            nbytes += len(line)
+            if nbytes > max_bytes:
+                logging.info(f"Stopped scanning {script} after {max_bytes} bytes")
+                break
+            text = line[:-1] if line.endswith('\n') else line
+            if not text.startswith('#'):
+                if text.strip():
+                    break
+                for pair in open_blocks:
+                    open_blocks[pair] = None
+                continue
+            if text not in begins and all(b is None for b in open_blocks.values()):
+                continue
+            is_comment = (text == '#' or text.startswith('# '))
+            for pair in pairs:
+                if pair in found:
+                    continue
+                lines = open_blocks[pair]
+                if lines is None:
+                    if text == pair[0] and line.endswith('\n'):
+                        open_blocks[pair] = []
+                elif text == pair[1] and lines:
+                    found[pair] = ''.join(lines)
+                    open_blocks[pair] = None
+                elif is_comment and line.endswith('\n'):
+                    lines.append(line)
+                else:
+                    open_blocks[pair] = None
+            if len(found) == len(pairs):
+                break
+    return found
+
 def parse_dependencies(script, verbose=False) -> tuple[str,str,str,str]:
     "Parses script and returns any conda or pip dep blocks"
-    LT = Enum('LT', [ 
-        'BEG_SCRIPT_YML',
-        'BEG_CONDA_SPEC_YML','BEG_CONDA_ENV_YML','BEG_PIP_YML','END_YML',
-        'BEG_CONDA_SPEC','BEG_CONDA_ENV','BEG_PIP','END',
-        'TEXT'])
-    
-    p = {
-        LT.BEG_SCRIPT_YML     : r"^# /// script$",
-        LT.BEG_CONDA_SPEC_YML : r"^# /// pythonrunscript-conda-install-specs-txt$",
-        LT.BEG_CONDA_ENV_YML  : r"^# /// pythonrunscript-environment-yml$",
-        LT.BEG_PIP_YML        : r"^# /// pythonrunscript-requirements-txt$",
-        LT.END_YML            : r"^# ///$",
-        LT.BEG_CONDA_SPEC     : r"^# ```conda_install_specs.txt$",
-        LT.BEG_CONDA_ENV      : r"^# ```environment.yml$",
-        LT.BEG_PIP            : r"^# ```requirements.txt$",
-        LT.END                : r"^# ```$",
-        LT.TEXT               : r"^#(| .*)$",
-    }
-
-    boxed_pip_block = ['']
-    boxed_conda_spec_block = ['']
-    boxed_conda_env_block = ['']
-
-    block_type_content_delimiters = [
-        ('script',[], [(LT.BEG_SCRIPT_YML,LT.END_YML)]),
-        ('requirements.txt', boxed_pip_block, [(LT.BEG_PIP_YML,LT.END_YML),
-                                               (LT.BEG_PIP,LT.END),]),
-        ('conda_install_specs.txt', boxed_conda_spec_block, [(LT.BEG_CONDA_SPEC_YML,LT.END_YML),
-                                                             (LT.BEG_CONDA_SPEC,LT.END),]),
-        ('environment.yml', boxed_conda_env_block, [(LT.BEG_CONDA_ENV_YML,LT.END_YML),
-                                                    (LT.BEG_CONDA_ENV,LT.END),]),
-    ]
-
-    def make_block_pattern(begend:tuple[LT,LT]) -> str:
-        (beg,end) = begend
-        return rf"(?m:{p[beg]}\s(?P<content>({p[LT.TEXT]}\s)+?){p[end]}(?:\s)?)"
-
-    def extract_content(match):
+    def extract_content(content):
         return ''.join(
             line[2:] if line.startswith('# ') else line[1:]
-            for line in match.group('content').splitlines(keepends=True)
+            for line in content.splitlines(keepends=True)
         )
 
-    # collect all comment lines starting with "# " or equalling "#"
-    # transforming to strip # prefix
-    comments = open(script,'r').read()
     if verbose:
         print(f"## Parsing this script for dependencies:\n{script}")
         print()
-    
-    for (block_type, boxed_content, begend_pairs) in block_type_content_delimiters:
-        for begend in begend_pairs:
-            block_pattern = make_block_pattern(begend)
-            match = re.compile(block_pattern).search(comments)
-            if match:
-                if verbose:
-                    print(f"### Extracted this {block_type} comment block:\n")
-                    s = '\n'.join([(line[2:] if len(line)>1 else "")
-                                   for line in match.group('content').split('\n')])
-                    print(textwrap.indent(s,'\t'))
-                    print()
-                if block_type == 'script':
-                    (pip_env, conda_env) = parse_script_toml(extract_content(match))
-                    boxed_pip_block[0] = pip_env
-                    boxed_conda_spec_block[0] = conda_env
-                    break
-                else:
-                    boxed_content[0] = extract_content(match)
-                break
-    
+    with phase("scan_dependency_blocks"):
+        found = scan_dependency_blocks(script)
+
+    blocks = {'requirements.txt': '', 'conda_install_specs.txt': '', 'environment.yml': ''}
+    for (block_type, pairs) in block_type_delimiters:
+        content = next((found[pair] for pair in pairs if pair in found), None)
+        if content is None:
+            continue
+        if verbose:
+            print(f"### Extracted this {block_type} comment block:\n")
+            s = '\n'.join([(line[2:] if len(line)>1 else "")
+                           for line in content.split('\n')])
+            print(textwrap.indent(s,'\t'))
+            print()
+        if block_type == 'script':
+            (pip_env, conda_env) = parse_script_toml(extract_content(content))
+            blocks['requirements.txt'] = pip_env
+            blocks['conda_install_specs.txt'] = conda_env
+        else:
+            blocks[block_type] = extract_content(content)
+
+    return (dep_hash(blocks['requirements.txt'], blocks['environment.yml'], blocks['conda_install_specs.txt']),
+            blocks['requirements.txt'], blocks['environment.yml'], blocks['conda_install_specs.txt'])
+
+#
+# dependency hashing
+#
+
+# An environment is keyed by a hash of the canonical form of its dep blocks,
+# so blocks which differ only in order, spacing, comments or name spelling
+# share it, plus the tags of what it was built for. Environments keyed by
+# the older hash of the raw blocks are still used until they are evicted.
+
+DEP_HASH_VERSION = "2"
+
+def strip_comment(line:str) -> str:
+    return re.sub(r'(^|\s)#.*$', '', line).strip()
+
+def canonical_pip_requirement(line:str) -> str:
+    "PEP 503 name, sorted extras and specifiers, without spaces, or line itself if it names no package"
+    m = re.match(r'([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[([^\]]*)\])?\s*([<>=!~][^;@]*?)?\s*(?:;\s*(.*))?$', line)
+    if not m or '://' in line:
+        return line
+    (name, extras, specifiers, marker) = m.groups()
+    specifiers = specifiers or ''
+    out = canonical_name(name)
+    if extras:
+        out += '[' + ','.join(sorted({canonical_name(e.strip()) for e in extras.split(',') if e.strip()})) + ']'
+    out += ','.join(sorted({re.sub(r'\s+', '', s) for s in specifiers.split(',') if s.strip()}))
+    if marker:
+        out += ';' + ' '.join(marker.split())
+    return out
+
+def canonical_pip_requirements(text:str) -> list[str]:
+    lines = {strip_comment(line) for line in text.splitlines()} - {''}
+    return sorted({' '.join(line.split()) if line.startswith('-') else canonical_pip_requirement(line)
+                   for line in lines})
+
+def canonical_conda_specs(text:str) -> list[str]:
+    # conda names are case-insensitive, but unlike pip's, - and _ differ
+    return sorted({' '.join(strip_comment(line).lower().split()) for line in text.splitlines()} - {''})
+
+def canonical_environment_yml(text:str) -> list[str]:
+    # order matters in environment.yml, for channel priority
+    return [line.rstrip() for line in text.splitlines()
+            if line.strip() and not line.lstrip().startswith('#')]
+
+def environment_tags(pip_only:bool) -> list[str]:
+    "What a built environment is specific to. A venv is also specific to the Python building it"
+    tags = [f"{sys.platform}-{os.uname().machine}"]
+    if pip_only:
+        tags.append(sys.implementation.cache_tag or sys.implementation.name)
+    return tags
+
+def dep_hash(pip_requirements:str, conda_envyml:str, conda_specs:str) -> str:
+    canonical = json.dumps(dict(version=DEP_HASH_VERSION,
+                                pip=canonical_pip_requirements(pip_requirements),
+                                envyml=canonical_environment_yml(conda_envyml),
+                                conda=canonical_conda_specs(conda_specs),
+                                tags=environment_tags(not (conda_envyml or conda_specs))),
+                           sort_keys=True)
+    return hashlib.md5(canonical.encode('utf-8')).hexdigest()
+
+def legacy_dep_hash(pip_requirements:str, conda_envyml:str, conda_specs:str) -> str:
+    "The hash of the raw dep blocks, which keyed environments before DEP_HASH_VERSION 2"
     hash = hashlib.md5()
-    hash.update(boxed_pip_block[0].encode('utf-8'))
-    hash.update(boxed_conda_env_block[0].encode('utf-8'))
-    hash.update(boxed_conda_spec_block[0].encode('utf-8'))
-    return (hash.hexdigest(), boxed_pip_block[0], boxed_conda_env_block[0], boxed_conda_spec_block[0])
+    hash.update(pip_requirements.encode('utf-8'))
+    hash.update(conda_envyml.encode('utf-8'))
+    hash.update(conda_specs.encode('utf-8'))
+    return hash.hexdigest()
+
+def usable_legacy_environment(project_path:str, pip_only:bool) -> bool:
+    """
+    True if project_path is a complete environment keyed by the legacy hash,
+    which was built for the interpreter and platform in use now.
+    """
+    manifest = read_manifest(project_path)
+    if manifest is None:
+        return os.path.isdir(project_path) and legacy_build_completed(project_path)
+    if manifest.get("platform") != environment_tags(False)[0]:
+        return False
+    if pip_only:
+        # legacy venvs were built by the first python3 in PATH, so check what it links to
+        interpreter = manifest.get("interpreter", "")
+        cp = subprocess.run([interpreter, "-c", "import sys; print(sys.implementation.cache_tag)"],
+                            capture_output=True, text=True) if os.path.exists(interpreter) else None
+        return cp is not None and cp.stdout.strip() == sys.implementation.cache_tag
+    return True
 
 def tomlconfig_to_pip_conda(toml_config) -> tuple[str,str]:
     "From a TOML dict, to (pip reqs, conda python spec)"
@@ -265,9 +515,15 @@ def parse_script_toml(toml_str) -> tuple[str,str]:
     return tomlconfig_to_pip_conda(config)    
 
 class Project(ABC):
+    kind = ""
     @staticmethod
     def make_project(script:str, verbose:bool, dry_run:bool):
         (dep_hash, pip_requirements, conda_envyml, conda_specs ) = parse_dependencies(script,verbose or dry_run)
+        if (conda_envyml or conda_specs or pip_requirements) and not os.path.exists(find_project_path(dep_hash)):
+            legacy = legacy_dep_hash(pip_requirements, conda_envyml, conda_specs)
+            if usable_legacy_environment(os.path.join(cache_base(), legacy), not (conda_envyml or conda_specs)):
+                logging.info(f"using the environment {legacy}, keyed by the legacy dependency hash")
+                dep_hash = legacy
         if conda_envyml or conda_specs:
             logging.info("dep block implies script will need conda for an environment.yml or conda_specs installation")
             return ProjectConda(script, dep_hash, pip_requirements, conda_specs, conda_envyml, verbose)
@@ -286,11 +542,20 @@ class Project(ABC):
         self.conda_specs = conda_specs
         self.conda_envyml = conda_envyml
         self.verbose = verbose
+        # recorded in the manifest, like which backends built the environment
+        self.build_details:dict = {}
+        self._project_path:Union[str,None] = None
 
     @property
     def project_path(self):
-        "path to the project dir"
-        return os.path.join( cache_base(), self.dep_hash )
+        "path to the project dir, in a shared cache if one has the env built"
+        if self._project_path is None:
+            self._project_path = find_project_path(self.dep_hash, self.verbose)
+        return self._project_path
+    @property
+    def shared(self) -> bool:
+        "True if the env is in a read-only shared cache"
+        return os.path.dirname(self.project_path) != cache_base()
     @property
     def envdir(self) -> str:
         "for pip projects, the venv dir. for conda, the prefix dir"
@@ -298,156 +563,1149 @@ class Project(ABC):
     @property
     def interpreter(self) -> str:
         return os.path.join( self.envdir, 'bin','python3')
+    @property
+    def manifest_path(self) -> str:
+        "stamp written only once the environment is completely built"
+        return os.path.join( self.project_path, MANIFEST_NAME )
     def exists(self) -> bool:
-        return False
+        return os.path.exists( self.manifest_path )
     def create(self) -> bool:
         "False if creation failed, maybe leaving self.project_path in a non-runnable state"
         return True
+    def publish(self, **details) -> None:
+        "Marks the environment as complete by writing its manifest"
+        write_manifest(self.project_path, dict(
+            dep_hash=self.dep_hash, kind=self.kind, script=os.path.abspath(self.script),
+            envdir=self.envdir, interpreter=self.interpreter,
+            created=time.time(), python=sys.version.split()[0],
+            platform=f"{sys.platform}-{os.uname().machine}",
+            **self.build_details, **details))
+    def mark_in_use(self) -> None:
+        """
+        Records this launch as the env's last use, and holds a shared lock on it
+        which the exec'd script inherits, so GC will not evict a running env.
+        Envs in a shared cache are left untouched, as users never evict them.
+        """
+        if self.shared:
+            return
+        try:
+            fd = os.open(os.path.join(self.project_path, IN_USE_NAME), os.O_RDONLY | os.O_CREAT, 0o644)
+        except OSError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            os.set_inheritable(fd, True)
+            os.utime(fd)
+        except OSError:
+            pass
+        catalog_record_launch(self)
     def run(self, args) -> NoReturn:
+        self.mark_in_use()
         run_script(self.interpreter,self.script,args)
 
+def ensure_project(proj:Project) -> bool:
+    """
+    Creates proj's environment unless it exists. False if that failed.
+
+    Holds proj's build lock, so concurrent launches wait for one build. A
+    project dir without a manifest is left over from an interrupted build,
+    so it is trashed before building again.
+    """
+    try:
+        with BuildLock(proj.dep_hash, proj.project_path):
+            if proj.exists():
+                logging.info(f"Another process built {proj.project_path} while we waited")
+                if proj.verbose:
+                    print(f"## Another process built the environment while we waited: {proj.project_path}")
+                return True
+            if os.path.exists(proj.project_path):
+                if legacy_build_completed(proj.project_path):
+                    logging.info(f"Adopting {proj.project_path}, built before manifests existed")
+                    proj.publish(adopted=True)
+                    return True
+                trashed_env = pseudo_erase_dir(proj.project_path)
+                print(f"## Found an incomplete environment from an interrupted build. Moved it to {trashed_env}",file=sys.stderr)
+            start = time.monotonic()
+            if not proj.create():
+                if os.path.exists(proj.project_path):
+                    trashed_env = pseudo_erase_dir(proj.project_path)
+                    print(f"## Creating a managed environment failed. Moved the broken environment to {trashed_env}",file=sys.stderr)
+                else:
+                    print(f"## Creating a managed environment failed.",file=sys.stderr)
+                schedule_trash_disposal()
+                return False
+            if precompile_enabled():
+                precompile_environment(proj)
+            build_seconds = round(time.monotonic() - start, 3)
+            proj.publish(build_seconds=build_seconds)
+            catalog_record_build(proj, build_seconds)
+    except TimeoutError as e:
+        print(f"## {e}",file=sys.stderr)
+        return False
+    sweep_incomplete_projects()
+    if cache_budget() != (None, None):
+        collect_garbage(verbose=proj.verbose, keep={proj.dep_hash})
+    schedule_trash_disposal()
+    return True
+
 def log_level_for_verbose(v:bool) -> Log:
     return Log.VERBOSE if v else Log.ERRORS
 
 class ProjectPip(Project):
+    kind = "pip"
     @property
     def envdir(self): return os.path.join( self.project_path, 'venv' )
-    def exists(self): return os.path.exists( self.project_path )
     def create(self):
+        pip = pip_backend()
+        self.build_details["backends"] = {"pip": pip.name}
+        if derive_project(self, derive_venv):
+            return True
         return create_venv(self.project_path, self.envdir,
                            self.pip_requirements,
-                           log_level_for_verbose(self.verbose))
+                           log_level_for_verbose(self.verbose),
+                           pip)
 
 
 class ProjectConda(Project):
+    kind = "conda"
     @property
     def envdir(self): return os.path.join( self.project_path, 'condaenv' )
-    def exists(self): return os.path.exists( self.project_path )
     def create(self):
+        conda = conda_backend()
+        self.build_details["backends"] = {"conda": conda.name}
+        if self.pip_requirements:
+            self.build_details["backends"]["pip"] = pip_backend().name
+        if conda.can_clone and derive_project(self, derive_conda_prefix):
+            return True
         return setup_conda_prefix(self.project_path, self.envdir,
                                   self.conda_envyml,
                                   self.conda_specs,
                                   self.pip_requirements,
-                                  log_level_for_verbose(self.verbose))
+                                  log_level_for_verbose(self.verbose),
+                                  conda=conda)
     def run(self, args) -> NoReturn:
-        conda_run_script(self.interpreter,self.script,args,self.envdir)
+        self.mark_in_use()
+        conda = None
+        if "PYTHONRUNSCRIPT_CONDA_RUN" not in os.environ:
+            env = conda_activated_environ(self.project_path)
+            if env is None:
+                conda = built_with_conda_backend(self.project_path)
+                if not self.shared and capture_conda_activation(self.project_path, self.envdir, conda):
+                    env = conda_activated_environ(self.project_path)
+            if env is not None:
+                run_script(self.interpreter,self.script,args,env)
+        conda_run_script(self.interpreter,self.script,args,self.envdir,
+                         conda or built_with_conda_backend(self.project_path))
 
 class ProjectNoDeps(Project):
+    kind = "nodeps"
     def exists(self): return True
+    def mark_in_use(self): pass
     def create(self): return True
+    def run(self, args) -> NoReturn:
+        if in_process_enabled():
+            run_script_in_process(self.script, args)
+        run_script(self.interpreter, self.script, args)
     @property
     def interpreter(self):
         return sys.executable
 
-def run_with_logging(command:Union[str,list],proj_dir,out_f,err_f,verbosity):
+#
+# build step output
+#
+
+def log_max_bytes() -> int:
+    "Size at which a build step's log is rotated, from PYTHONRUNSCRIPT_LOG_MAX_BYTES"
+    return parse_size(os.environ.get("PYTHONRUNSCRIPT_LOG_MAX_BYTES", "10M"))
+
+class LogWriter:
+    """
+    Appends to a log file, rotating it to a gzipped .1.gz when it grows past
+    max_bytes, so repeated builds in one project dir don't grow it forever.
+    """
+    def __init__(self, path:str, max_bytes:int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.f = open(path, 'ab')
+        self.size = self.f.tell()
+    def write(self, data:bytes) -> None:
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.f.write(data)
+        self.size += len(data)
+    def rotate(self) -> None:
+        self.f.close()
+        with open(self.path, 'rb') as src, gzip.open(self.path + '.1.gz.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(self.path + '.1.gz.tmp', self.path + '.1.gz')
+        self.f = open(self.path, 'wb')
+        self.size = 0
+    def close(self) -> None:
+        self.f.close()
+
+def pump_output(proc, sinks:dict) -> None:
+    "Copies each of proc's pipes to its sinks as output arrives, until both close"
+    with selectors.DefaultSelector() as sel:
+        for pipe in sinks:
+            sel.register(pipe, selectors.EVENT_READ)
+        while sel.get_map():
+            for key, _ in sel.select():
+                data = os.read(key.fd, 65536)
+                if not data:
+                    sel.unregister(key.fileobj)
+                    continue
+                for sink in sinks[key.fileobj]:
+                    sink(data)
+
+def console_sink(stream):
+    "A sink writing to stream right away, so output interleaves as the step emits it"
+    buffer = getattr(stream, 'buffer', None)
+    def write(data:bytes) -> None:
+        if buffer is None:
+            stream.write(data.decode(errors='replace'))
+            stream.flush()
+        else:
+            buffer.write(data)
+            buffer.flush()
+    return write
+
+def run_with_logging(command:list[str],proj_dir,out_f,err_f,verbosity):
     '''
     Runs command. Logs and maybe streams stdout and stderr.
 
     verbosity=Log.SILENT: log out and err. Report errors later
+    verbosity=Log.ERRORS: log out and err. Stream err.
     verbosity=Log.VERBOSE: log and stream out and err.
     '''
     log_dir = os.path.join(proj_dir,"logs")
     os.makedirs(log_dir,exist_ok=True)
-    out_f = os.path.join(log_dir, os.path.basename(out_f))
-    err_f = os.path.join(log_dir, os.path.basename(err_f))
-    if isinstance(command,list):
-        command = shlex.join(command)
-    if verbosity == Log.SILENT:
-        command += f' 2>> "{err_f}"'
-        command += f' 1>> "{out_f}"'
-    elif verbosity == Log.ERRORS:
-        command += f' 2> >(tee -a "{err_f}")'
-        command += f' 1>> {out_f}'
-    elif verbosity == Log.VERBOSE:
-        command += f' 2> >(tee -a "{err_f}")'
-        command += f' 1> >(tee -a "{out_f}")'
-    else:
-        assert True, "unreachable"
-
-    cp = subprocess.run(command,
-                        shell=True,
-                        executable=shutil.which('bash'))
-    did_succeed = (cp.returncode == 0)
+    out_log = LogWriter(os.path.join(log_dir, os.path.basename(out_f)), log_max_bytes())
+    err_log = LogWriter(os.path.join(log_dir, os.path.basename(err_f)), log_max_bytes())
+    err_tail = bytearray()
+    def keep_tail(data:bytes) -> None:
+        err_tail.extend(data)
+        del err_tail[:-65536]
+    out_sinks = [out_log.write]
+    err_sinks = [err_log.write, keep_tail]
+    if verbosity in (Log.ERRORS, Log.VERBOSE):
+        err_sinks.append(console_sink(sys.stderr))
+    if verbosity == Log.VERBOSE:
+        out_sinks.append(console_sink(sys.stdout))
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    command_str = shlex.join(command)
+    try:
+        with phase(os.path.splitext(os.path.basename(out_f))[0], command=command_str):
+            try:
+                proc = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as e:
+                err_log.write(f"{e}\n".encode())
+                keep_tail(f"{e}\n".encode())
+                returncode = 127
+            else:
+                with proc:
+                    try:
+                        pump_output(proc, {proc.stdout: out_sinks, proc.stderr: err_sinks})
+                    except BaseException:
+                        proc.kill()
+                        raise
+                returncode = proc.returncode
+    finally:
+        out_log.close()
+        err_log.close()
+    did_succeed = (returncode == 0)
 
     if (verbosity, did_succeed)   == (Log.VERBOSE,True):
-        print(f"## This command completed successfully:\n\t{command}")
+        print(f"## This command completed successfully:\n\t{command_str}")
     elif (verbosity, did_succeed) == (Log.VERBOSE,False):
-        print(f"## This command failed:\n\t{command}\n", file=sys.stderr)
+        print(f"## This command failed:\n\t{command_str}\n", file=sys.stderr)
         print(f"## Standard error output was printed above\n", file=sys.stderr)
         print(f"## Logs may be found in:\n\t{proj_dir}/logs", file=sys.stderr)
     elif (verbosity, did_succeed) == (Log.ERRORS,True):
         pass
     elif (verbosity, did_succeed) == (Log.ERRORS,False):
-        print(f"## Error encountered trying to run this command:\n\t{command}", file=sys.stderr)
+        print(f"## Error encountered trying to run this command:\n\t{command_str}", file=sys.stderr)
         print(f"## Logs may be found in:\n\t{proj_dir}/logs\n", file=sys.stderr)
         print(f"## This is the contents of the stderr:\n")
-        with open(err_f,"r") as f:
-            print(f.read())
+        print(err_tail.decode(errors='replace'))
     else:
         pass
 
     return did_succeed
 
     
-def create_conda_prefix(proj_dir,condaprefix_dir:str,log_level:Log):
-    success = run_with_logging(f'conda create --quiet --yes --prefix "{condaprefix_dir}"',
-                               proj_dir,
-                               "conda_create.out","conda_create.err",
-                               log_level)
-    if success:
-        return True
-    else:
-        print("## Errors trying to create conda prefix directory",file=sys.stderr)
-        return False
+#
+# installer backends
+#
+
+# Build steps get their commands from a backend: pip or uv for venvs and pip
+# installs, and conda, mamba or micromamba for conda prefixes. The fastest
+# one installed is used, unless PYTHONRUNSCRIPT_PIP_BACKEND or
+# PYTHONRUNSCRIPT_CONDA_BACKEND names another.
 
+class PipBackend:
+    "Creates venvs with the venv module and installs with pip"
+    name = "pip"
+    def available(self) -> bool:
+        return True
+    def create_venv_command(self, venv_dir) -> list[str]:
+        return [sys.executable, "-m", "venv", venv_dir]
+    def install_command(self, interpreter, sources, reqs_path) -> list[str]:
+        return [interpreter, "-m", "pip", "install", *sources, "-r", reqs_path]
+
+class UvBackend(PipBackend):
+    "Creates venvs and installs with uv. Venvs still get pip, for the steps only pip can do"
+    name = "uv"
+    def available(self) -> bool:
+        return shutil.which("uv") is not None
+    def create_venv_command(self, venv_dir) -> list[str]:
+        return ["uv", "venv", "--quiet", "--seed", "--python", sys.executable, venv_dir]
+    def install_command(self, interpreter, sources, reqs_path) -> list[str]:
+        return ["uv", "pip", "install", "--python", interpreter, *sources, "-r", reqs_path]
+
+class CondaBackend:
+    "Builds conda prefixes with the conda CLI"
+    name = "conda"
+    can_clone = True
+    def available(self) -> bool:
+        return shutil.which(self.name) is not None
+    def create_spec_command(self, prefix, install_spec_file) -> list[str]:
+        "Creates prefix and installs the specs, with one solve"
+        return [self.name, "create", "--quiet", "--yes", "--file", install_spec_file, "--prefix", prefix]
+    def clone_command(self, src, prefix) -> list[str]:
+        return [self.name, "create", "--quiet", "--yes", "--clone", src, "--prefix", prefix]
+    def install_yml_command(self, prefix, env_yml_file) -> list[str]:
+        return [self.name, "env", "create", "--quiet", "--yes", "--file", env_yml_file, "--prefix", prefix]
+    def install_spec_command(self, prefix, install_spec_file) -> list[str]:
+        return [self.name, "install", "--quiet", "--yes", "--file", install_spec_file, "--prefix", prefix]
+    def run_command(self, prefix) -> list[str]:
+        "Prefix of a command running the rest of its args in prefix, activated"
+        return [self.name, "run", "-p", prefix, "--no-capture-output"]
+
+class MambaBackend(CondaBackend):
+    "Solves and installs with mamba, which takes conda's arguments"
+    name = "mamba"
+    def run_command(self, prefix) -> list[str]:
+        # mamba 1 is a front end which leaves `run` to conda
+        if shutil.which("conda"):
+            return CondaBackend.run_command(self, prefix)
+        return [self.name, "run", "--prefix", prefix]
+
+class MicromambaBackend(CondaBackend):
+    "Builds conda prefixes with micromamba, which needs no base conda install"
+    name = "micromamba"
+    can_clone = False
+    def install_yml_command(self, prefix, env_yml_file) -> list[str]:
+        return [self.name, "create", "--quiet", "--yes", "--file", env_yml_file, "--prefix", prefix]
+    def run_command(self, prefix) -> list[str]:
+        return [self.name, "run", "--prefix", prefix]
+
+# fastest first
+PIP_BACKENDS = [UvBackend(), PipBackend()]
+CONDA_BACKENDS = [MicromambaBackend(), MambaBackend(), CondaBackend()]
+
+def backend_named(backends:list, name:str):
+    return next(b for b in backends if b.name == name)
+
+def choose_backend(backends:list, env_var:str):
+    "The backend named by env_var if it is installed, or else the fastest one installed"
+    wanted = os.environ.get(env_var, "auto")
+    if wanted != "auto":
+        found = [b for b in backends if b.name == wanted]
+        if found and found[0].available():
+            return found[0]
+        print(f"## {env_var} names {wanted}, which is {'not installed' if found else 'unknown'}. Using the default",file=sys.stderr)
+    return next((b for b in backends if b.available()), backends[-1])
+
+def pip_backend() -> PipBackend:
+    return choose_backend(PIP_BACKENDS, "PYTHONRUNSCRIPT_PIP_BACKEND")
+
+def conda_backend() -> CondaBackend:
+    return choose_backend(CONDA_BACKENDS, "PYTHONRUNSCRIPT_CONDA_BACKEND")
+
+def built_with_conda_backend(project_path) -> CondaBackend:
+    "The conda backend which built project_path, if it is still installed"
+    name = ((read_manifest(project_path) or {}).get("backends") or {}).get("conda")
+    found = [b for b in CONDA_BACKENDS if b.name == name and b.available()]
+    return found[0] if found else conda_backend()
 
 def pseudo_erase_dir(path):
-    "Pseudo-erases a project dir by moving it to the temporary dir"
+    """
+    Pseudo-erases a project dir by renaming it into the trash, which is on the
+    cache's filesystem so this never copies. See empty_trash() for deletion.
+    """
     logging.info(f"Moving {path} to {trash_base()}")
-    dst = os.path.join( trash_base(), os.path.basename(path), str(uuid.uuid4()) )
-    return shutil.move(path, dst )
-
-
-def install_pip_requirements(proj_dir, pip_requirements, interpreter, log_level:Log) -> bool:
+    os.makedirs(trash_base(), exist_ok=True)
+    dst = os.path.join( trash_base(), f"{os.path.basename(path)}-{uuid.uuid4()}" )
+    try:
+        os.rename(path, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        return shutil.move(path, dst)
+    return dst
+
+
+def install_pip_requirements(proj_dir, pip_requirements, interpreter, log_level:Log,
+                             pip:Union[PipBackend,None]=None) -> bool:
+    pip = pip or pip_backend()
     reqs_path = os.path.join(proj_dir,'requirements.txt')
     with open(reqs_path, 'w') as f:
         f.write(pip_requirements)
 
-    success = run_with_logging([interpreter, "-m", "pip", "install", "-r", reqs_path],
+    sources = pip_source_args()
+    store_keys:dict[str,str] = {}
+    linked:list[str] = []
+    site_packages = site_packages_dir(interpreter)
+    if package_store_enabled() and site_packages:
+        store_keys = resolve_pip_wheels(proj_dir, reqs_path, interpreter, sources)
+        with phase("link_from_package_store"):
+            linked = link_from_package_store(store_keys.values(), site_packages, interpreter)
+        logging.info(f"linked {len(linked)} of {len(store_keys)} distributions from the package store")
+
+    success = run_with_logging(pip.install_command(interpreter, sources, reqs_path),
                                proj_dir,
                                "pip_install.out","pip_install.err",
                                log_level)
     if success:
-        with open(os.path.join(proj_dir,"piplist.txt"),"w") as f:
-            subprocess.run(shlex.join([interpreter, "-m", "pip", "list"]),
-                           stdout=f, stderr=f,
-                           shell=True,executable=shutil.which('bash'))
+        if store_keys and site_packages:
+            with phase("ingest_into_package_store"):
+                ingest_into_package_store(store_keys, site_packages, set(linked))
+        if wheelhouse_enabled() and not offline_mode():
+            with phase("fill_wheelhouse"):
+                fill_wheelhouse(proj_dir, reqs_path, interpreter, Log.SILENT)
+        with open(os.path.join(proj_dir,"piplist.txt"),"w") as f, phase("pip_list"):
+            subprocess.run([interpreter, "-m", "pip", "list"], stdout=f, stderr=f)
         return True
     else:
         print("## Errors trying to install pip requirements",file=sys.stderr)
         return False
 
 
-def make_conda_install_yml_command(condaprefix_dir, env_yml_file) -> str:
-    return f'conda env create --quiet --yes --file "{env_yml_file}" --prefix "{condaprefix_dir}"'
+#
+# deriving environments
+#
+
+# A new environment whose requirements extend a cached one's, like after
+# adding a package or bumping a version, is cloned from it and then only
+# the difference is installed. Anything unusual falls back to a clean build.
 
-def make_conda_install_spec_command(condaprefix_dir, install_spec_file) -> str:
-    return f'conda install --quiet --yes --file "{install_spec_file}" --prefix "{condaprefix_dir}"'
+def derive_enabled() -> bool:
+    return os.environ.get("PYTHONRUNSCRIPT_NO_DERIVE", "") in ("", "0")
+
+def requirement_lines(text:str) -> tuple[Union[dict[str,str],None], frozenset]:
+    """
+    ({canonical name: line}, option lines) of a pip requirements or conda
+    specs text. The names are None if a line names no package, like a URL.
+    """
+    names:dict[str,str] = {}
+    options = set()
+    for line in text.splitlines():
+        line = line.split(' #')[0].strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('-'):
+            options.add(line)
+            continue
+        m = re.match(r'(?:[\w.-]+::)?([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*($|[<>=!~;,\s].*)', line)
+        if not m or '://' in line or '@' in line:
+            return None, frozenset(options)
+        names[canonical_name(m.group(1))] = line
+    return names, frozenset(options)
+
+def read_text(path:str) -> str:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def closest_environment(proj:Project) -> Union[str,None]:
+    """
+    The cached project dir of proj's kind whose requirements are the largest
+    subset, by package name, of proj's, or None if there is none worth cloning.
+    """
+    if proj.conda_envyml:
+        return None
+    new_pip, new_pip_options = requirement_lines(proj.pip_requirements)
+    new_specs, new_spec_options = requirement_lines(proj.conda_specs)
+    if new_pip is None or new_specs is None:
+        return None
+    base_python = os.path.realpath(sys.executable)
+    best, best_score = None, (0, 0.0)
+    for name in os.listdir(cache_base()) if os.path.isdir(cache_base()) else []:
+        path = os.path.join(cache_base(), name)
+        if not is_project_dir_name(name) or name == proj.dep_hash:
+            continue
+        manifest = read_manifest(path)
+        if not manifest or manifest.get("kind") != proj.kind or not os.path.isdir(manifest.get("envdir", "")):
+            continue
+        if proj.kind == "pip" and os.path.realpath(manifest.get("interpreter", "")) != base_python:
+            continue
+        if proj.kind == "conda" and os.path.exists(os.path.join(path, "environment.yml")):
+            continue
+        old_pip, old_pip_options = requirement_lines(read_text(os.path.join(path, "requirements.txt")))
+        old_specs, old_spec_options = requirement_lines(read_text(os.path.join(path, "conda_install_specs.txt")))
+        if (old_pip is None or old_specs is None
+                or (old_pip_options, old_spec_options) != (new_pip_options, new_spec_options)
+                or not old_pip.keys() <= new_pip.keys() or not old_specs.keys() <= new_specs.keys()):
+            continue
+        score = (len(old_pip) + len(old_specs), manifest.get("created", 0))
+        if score > best_score:
+            best, best_score = path, score
+    return best
+
+def clone_venv(src:str, dst:str) -> None:
+    """
+    Copies the venv src to dst, hardlinking files, and rewriting the paths
+    to src in its scripts, config and symlinks.
+    """
+    old, new = src.encode(), dst.encode()
+    for (dirpath, dirnames, filenames) in os.walk(src):
+        out_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(out_dir, exist_ok=True)
+        for name in dirnames + filenames:
+            path, out = os.path.join(dirpath, name), os.path.join(out_dir, name)
+            if os.path.islink(path):
+                target = os.readlink(path)
+                os.symlink(new.decode() + target[len(src):] if target.startswith(src + os.sep) else target, out)
+                if name in dirnames:
+                    dirnames.remove(name)
+            elif name in filenames:
+                if os.path.basename(dirpath) == "bin" or name == "pyvenv.cfg" or name.endswith(".pth"):
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                    if old in content:
+                        with open(out, 'wb') as f:
+                            f.write(content.replace(old, new))
+                        shutil.copymode(path, out)
+                        continue
+                link_or_copy(path, out)
+
+# Run by a venv's interpreter with its top-level requirements as arguments.
+# Prints the installed distributions which nothing requires.
+UNREQUIRED_DISTRIBUTIONS_PY = '''
+import sys, importlib.metadata as md
+from pip._vendor.packaging.requirements import Requirement
+from pip._vendor.packaging.utils import canonicalize_name
+dists = {canonicalize_name(d.metadata["Name"]): d for d in md.distributions()}
+keep = {"pip", "setuptools", "wheel"}
+todo = [(Requirement(line), ("",)) for line in sys.argv[1:]]
+seen = set()
+while todo:
+    req, extras = todo.pop()
+    name = canonicalize_name(req.name)
+    if req.marker and not any(req.marker.evaluate({"extra": e}) for e in extras):
+        continue
+    if (name, frozenset(req.extras)) in seen:
+        continue
+    seen.add((name, frozenset(req.extras)))
+    if name not in dists:
+        sys.exit(f"{name} is required but not installed")
+    keep.add(name)
+    todo.extend((Requirement(r), ("",) + tuple(req.extras)) for r in dists[name].requires or [])
+print("\\n".join(sorted(set(dists) - keep)))
+'''
+
+def derive_venv(proj:Project, src_path:str) -> bool:
+    "Builds proj's venv from a clone of the venv in the project dir src_path"
+    log_level = log_level_for_verbose(proj.verbose)
+    os.makedirs(proj.project_path)
+    with phase("clone_venv"):
+        clone_venv(os.path.join(src_path, "venv"), proj.envdir)
+    if not install_pip_requirements(proj.project_path, proj.pip_requirements, proj.interpreter, log_level,
+                                    backend_named(PIP_BACKENDS, proj.build_details["backends"]["pip"])):
+        return False
+    names, _ = requirement_lines(proj.pip_requirements)
+    cp = subprocess.run([proj.interpreter, "-c", UNREQUIRED_DISTRIBUTIONS_PY, *(names or {}).values()],
+                        capture_output=True, text=True)
+    if cp.returncode != 0:
+        logging.info(f"could not list unrequired distributions: {cp.stderr}")
+        return False
+    if (unrequired := cp.stdout.split()):
+        if not run_with_logging([proj.interpreter, "-m", "pip", "uninstall", "--yes", *unrequired],
+                                proj.project_path,
+                                "pip_uninstall.out","pip_uninstall.err",
+                                log_level):
+            return False
+    return run_with_logging([proj.interpreter, "-m", "pip", "check"],
+                            proj.project_path,
+                            "pip_check.out","pip_check.err",
+                            Log.SILENT)
+
+def derive_conda_prefix(proj:Project, src_path:str) -> bool:
+    "Builds proj's conda prefix from a clone of the one in the project dir src_path"
+    os.makedirs(proj.project_path)
+    return setup_conda_prefix(proj.project_path, proj.envdir,
+                              proj.conda_envyml,
+                              proj.conda_specs,
+                              proj.pip_requirements,
+                              log_level_for_verbose(proj.verbose),
+                              clone_from=os.path.join(src_path, "condaenv"),
+                              conda=backend_named(CONDA_BACKENDS, proj.build_details["backends"]["conda"]))
+
+def derive_project(proj:Project, derive) -> bool:
+    """
+    Tries to build proj by deriving it from the closest cached environment.
+    If that fails, leaves no project dir behind, for a clean build.
+    """
+    if not derive_enabled() or not (src_path := closest_environment(proj)):
+        return False
+    logging.info(f"deriving {proj.project_path} from {src_path}")
+    if proj.verbose:
+        print(f"## Deriving the environment from the similar cached environment {src_path}")
+    # a shared lock, as when running it, so GC cannot evict the source meanwhile
+    try:
+        fd = os.open(os.path.join(src_path, IN_USE_NAME), os.O_RDONLY | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+    except OSError:
+        return False
+    try:
+        with phase("derive", source=src_path):
+            derived = os.path.exists(os.path.join(src_path, MANIFEST_NAME)) and derive(proj, src_path)
+    except OSError as e:
+        logging.info(f"deriving failed: {e}")
+        derived = False
+    finally:
+        os.close(fd)
+    if derived:
+        proj.build_details["derived_from"] = os.path.basename(src_path)
+        return True
+    if os.path.exists(proj.project_path):
+        trashed = pseudo_erase_dir(proj.project_path)
+        logging.info(f"deriving failed, so building from scratch. Moved the attempt to {trashed}")
+    if proj.verbose:
+        print("## Could not derive the environment, so building it from scratch")
+    return False
+
+
+#
+# environment archives
+#
+
+# An archive holds a project dir under its dep hash, after a JSON member
+# describing it. Environments hardcode their absolute path, so importing
+# one into a cache at another path rewrites it in scripts, configs and
+# conda's prefix placeholders, as conda does when installing a package.
+
+ARCHIVE_MANIFEST_NAME = "pythonrunscript-archive.json"
+ARCHIVE_VERSION = 1
+
+def open_archive_stream(path:str, mode:str):
+    """
+    (tarfile, zstd process or None) streaming the archive at path. mode is r
+    or w. Compression is by suffix: .tar.gz, .tgz, .tar.zst, else none.
+    """
+    if path.endswith('.zst'):
+        if not shutil.which('zstd'):
+            raise OSError("the zstd command is needed for .zst archives")
+        if mode == 'w':
+            proc = subprocess.Popen(["zstd", "-q", "-c", "-o", path, "-f"], stdin=subprocess.PIPE)
+            return tarfile.open(fileobj=proc.stdin, mode='w|'), proc
+        proc = subprocess.Popen(["zstd", "-q", "-d", "-c", path], stdout=subprocess.PIPE)
+        return tarfile.open(fileobj=proc.stdout, mode='r|'), proc
+    if mode == 'w':
+        return tarfile.open(path, 'w|gz' if path.endswith(('.gz', '.tgz')) else 'w|'), None
+    return tarfile.open(path, 'r|*'), None
+
+def close_archive_stream(tar, proc) -> bool:
+    "False if the compressor failed"
+    tar.close()
+    if proc is None:
+        return True
+    for pipe in (proc.stdin, proc.stdout):
+        if pipe:
+            pipe.close()
+    return proc.wait() == 0
+
+def export_environment(proj:Project, output:str) -> bool:
+    "Streams proj's project dir into the archive output"
+    manifest = read_manifest(proj.project_path) or {}
+    header = json.dumps(dict(version=ARCHIVE_VERSION, dep_hash=proj.dep_hash, kind=proj.kind,
+                             project_path=proj.project_path, platform=environment_tags(False)[0],
+                             python=manifest.get("python"), cache_tag=sys.implementation.cache_tag,
+                             exported=time.time()), indent=2).encode()
+    def skip_transient(info):
+        name = os.path.basename(info.name)
+        return None if name == IN_USE_NAME or name.endswith('.tmp') else info
+    try:
+        tar, proc = open_archive_stream(output, 'w')
+        info = tarfile.TarInfo(ARCHIVE_MANIFEST_NAME)
+        info.size, info.mtime = len(header), int(time.time())
+        tar.addfile(info, io.BytesIO(header))
+        with phase("export_environment"):
+            tar.add(proj.project_path, arcname=proj.dep_hash, filter=skip_transient)
+        ok = close_archive_stream(tar, proc)
+    except OSError as e:
+        print(f"## Could not export the environment: {e}",file=sys.stderr)
+        return False
+    if ok:
+        print(f"## Exported the environment {proj.dep_hash} to {output}")
+    return ok
+
+def archive_compatible(header:dict) -> Union[str,None]:
+    "Why an environment described by header cannot run here, or None if it can"
+    if header.get("version") != ARCHIVE_VERSION or not is_project_dir_name(str(header.get("dep_hash"))):
+        return "it is not an environment archive this version of pythonrunscript can read"
+    if header.get("platform") != environment_tags(False)[0]:
+        return f"it was built for {header.get('platform')}, but this is {environment_tags(False)[0]}"
+    if header.get("kind") == "pip" and header.get("cache_tag") != sys.implementation.cache_tag:
+        return f"its venv was built by {header.get('cache_tag')}, but this is {sys.implementation.cache_tag}"
+    return None
+
+def replace_prefix_in_file(path:str, old:bytes, new:bytes, binary:bool=False) -> None:
+    """
+    Rewrites old to new in the file at path. In binary files, as conda does,
+    each C string holding old is padded with NULs to keep its length.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    if old not in content:
+        return
+    if binary:
+        if len(new) > len(old):
+            raise ValueError(f"{path} has the old prefix compiled in, and the new one is longer; "
+                             f"import into a cache path no longer than {old.decode()}")
+        def pad(m):
+            string = m.group()
+            return string.replace(old, new) + b'\0' * ((len(old) - len(new)) * string.count(old))
+        content = re.sub(re.escape(old) + rb'[^\0]*', pad, content)
+    else:
+        content = content.replace(old, new)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+
+def relocate_project(root:str, old:str, new:str) -> None:
+    """
+    Rewrites the project path old to new in the project dir unpacked at root:
+    in symlinks, scripts in bin dirs, venv configs, .pth files, conda prefix
+    placeholders and pythonrunscript's own records.
+    """
+    (old_b, new_b) = (old.encode(), new.encode())
+    binary:set[str] = set()
+    for record in glob.glob(os.path.join(root, 'condaenv', 'conda-meta', '*.json')):
+        with open(record) as f:
+            paths = json.load(f).get('paths_data', {}).get('paths', [])
+        for p in paths:
+            if p.get('prefix_placeholder'):
+                path = os.path.join(root, 'condaenv', p['_path'])
+                if p.get('file_mode') == 'binary':
+                    binary.add(path)
+                elif os.path.isfile(path) and not os.path.islink(path):
+                    replace_prefix_in_file(path, old_b, new_b)
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                target = os.readlink(path)
+                if target == old or target.startswith(old + os.sep):
+                    os.remove(path)
+                    os.symlink(new + target[len(old):], path)
+            elif name in filenames and (path in binary or os.path.basename(dirpath) == 'bin'
+                                        or name in ('pyvenv.cfg', 'activation.env', 'exported-environment.yml')
+                                        or name.endswith('.pth')):
+                replace_prefix_in_file(path, old_b, new_b, binary=path in binary)
+    manifest = read_manifest(root)
+    if manifest is not None:
+        for key in ("envdir", "interpreter"):
+            if isinstance(manifest.get(key), str) and manifest[key].startswith(old):
+                manifest[key] = new + manifest[key][len(old):]
+        manifest["imported"] = time.time()
+        write_manifest(root, manifest)
+
+def archive_member_allowed(member, dep_hash:str, symlinks:set[str]) -> bool:
+    """
+    True if member may be unpacked: a file, dir or link inside dep_hash/,
+    which neither is nor points through an earlier symlink member, so nothing
+    is written or hardlinked through a link. Symlinks may be absolute, as venvs
+    link to their base Python, but relative ones must stay inside dep_hash/.
+    Adds symlinks to symlinks.
+    """
+    def under_symlink(path:str) -> bool:
+        parts = os.path.normpath(path).split('/')
+        return any('/'.join(parts[:i]) in symlinks for i in range(1, len(parts) + 1))
+    parts = member.name.split('/')
+    if parts[0] != dep_hash or '..' in parts or under_symlink(member.name):
+        return False
+    name = os.path.normpath(member.name)
+    if member.issym():
+        target = os.path.normpath(os.path.join(os.path.dirname(name), member.linkname))
+        if not (os.path.isabs(member.linkname) or target == dep_hash or target.startswith(dep_hash + '/')):
+            return False
+        symlinks.add(name)
+        return True
+    if member.islnk():
+        link_parts = member.linkname.split('/')
+        return link_parts[0] == dep_hash and '..' not in link_parts and not under_symlink(member.linkname)
+    return member.isreg() or member.isdir()
+
+def import_environment(archive:str, verbose:bool) -> bool:
+    "Unpacks an archive made by --export-env into the cache. False if it failed or was refused"
+    os.makedirs(cache_base(), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".import-", dir=cache_base())
+    proc = None
+    try:
+        tar, proc = open_archive_stream(archive, 'r')
+        header, dep_hash = None, ""
+        symlinks:set[str] = set()
+        for member in tar:
+            if header is None:
+                if member.name != ARCHIVE_MANIFEST_NAME:
+                    print(f"## {archive} is not an environment archive",file=sys.stderr)
+                    return False
+                header = json.load(tar.extractfile(member))
+                if (why := archive_compatible(header)):
+                    print(f"## Refusing to import {archive}, since {why}",file=sys.stderr)
+                    return False
+                dep_hash = header["dep_hash"]
+                continue
+            if not archive_member_allowed(member, dep_hash, symlinks):
+                print(f"## Refusing to import {archive}, which has the unexpected member {member.name}",file=sys.stderr)
+                return False
+            if hasattr(tarfile, 'tar_filter'):
+                tar.extract(member, staging, filter='tar')
+            else:
+                tar.extract(member, staging)
+        if not close_archive_stream(tar, proc) or header is None:
+            print(f"## Could not read all of {archive}",file=sys.stderr)
+            return False
+        unpacked = os.path.join(staging, dep_hash)
+        final = os.path.join(cache_base(), dep_hash)
+        with phase("relocate_project"):
+            relocate_project(unpacked, header["project_path"], final)
+        manifest = read_manifest(unpacked)
+        if manifest is None or subprocess.run([manifest["interpreter"].replace(final, unpacked, 1), "-c", "pass"]).returncode != 0:
+            print(f"## Refusing to import {archive}, whose environment does not run here",file=sys.stderr)
+            return False
+        with BuildLock(dep_hash, final):
+            if os.path.exists(os.path.join(final, MANIFEST_NAME)):
+                print(f"## The environment {dep_hash} from {archive} is already in the cache")
+                return True
+            if os.path.exists(final):
+                pseudo_erase_dir(final)
+                schedule_trash_disposal()
+            os.rename(unpacked, final)
+        print(f"## Imported the environment {dep_hash} from {archive}")
+        if verbose:
+            print(f"## It is at {final}")
+        return True
+    except (OSError, ValueError, KeyError, tarfile.TarError, TimeoutError) as e:
+        print(f"## Could not import {archive}: {e}",file=sys.stderr)
+        return False
+    finally:
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+#
+# wheelhouse
+#
+
+# Wheels for everything a successful build installed are kept in one
+# directory, so rebuilds can install from it, and offline builds only from it.
+
+WHEELHOUSE_NAME = "wheelhouse"
+
+def wheelhouse_dir() -> str:
+    return os.path.join(cache_base(), WHEELHOUSE_NAME)
+
+def wheelhouse_enabled() -> bool:
+    return os.environ.get("PYTHONRUNSCRIPT_NO_WHEELHOUSE", "") in ("", "0")
+
+def offline_mode() -> bool:
+    return os.environ.get("PYTHONRUNSCRIPT_OFFLINE", "") not in ("", "0")
+
+def pip_source_args() -> list[str]:
+    "pip options adding the wheelhouse as a source, or making it the only one when offline"
+    if offline_mode():
+        return ["--no-index", "--find-links", wheelhouse_dir()]
+    elif wheelhouse_enabled() and os.path.isdir(wheelhouse_dir()):
+        return ["--find-links", wheelhouse_dir()]
+    else:
+        return []
+
+def fill_wheelhouse(proj_dir, reqs_path, interpreter, log_level:Log) -> bool:
+    "Adds wheels for reqs_path and its dependencies to the wheelhouse"
+    os.makedirs(wheelhouse_dir(), exist_ok=True)
+    # pip writes into a private dir, and finished wheels are renamed in, so
+    # concurrent installs never see a partial wheel
+    staging = tempfile.mkdtemp(prefix=".fill-", dir=wheelhouse_dir())
+    try:
+        success = run_with_logging([interpreter, "-m", "pip", "wheel", "--quiet", *pip_source_args(),
+                                    "--wheel-dir", staging, "-r", reqs_path],
+                                   proj_dir,
+                                   "pip_wheel.out","pip_wheel.err",
+                                   log_level)
+        added = 0
+        for name in os.listdir(staging):
+            if name.endswith('.whl') and not os.path.exists(os.path.join(wheelhouse_dir(), name)):
+                os.replace(os.path.join(staging, name), os.path.join(wheelhouse_dir(), name))
+                added += 1
+        logging.info(f"added {added} wheels to the wheelhouse")
+        return success
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def seed_wheelhouse(requirements_files:list[str], verbose:bool) -> bool:
+    "Fills the wheelhouse from requirements files. False if any failed"
+    all_ok = True
+    with tempfile.TemporaryDirectory() as log_dir:
+        for reqs_path in requirements_files:
+            if not os.path.isfile(reqs_path):
+                print(f"## Did not find the requirements file {reqs_path}",file=sys.stderr)
+                all_ok = False
+                continue
+            before = set(os.listdir(wheelhouse_dir())) if os.path.isdir(wheelhouse_dir()) else set()
+            ok = fill_wheelhouse(log_dir, os.path.abspath(reqs_path), sys.executable, log_level_for_verbose(verbose))
+            added = len(set(os.listdir(wheelhouse_dir())) - before)
+            print(f"## {'Added' if ok else 'Failed after adding'} {added} wheels for {reqs_path} to {wheelhouse_dir()}")
+            all_ok = all_ok and ok
+    return all_ok
+
+
+#
+# package store
+#
+
+# The store holds installed distributions, one dir per name-version-wheel tag,
+# laid out relative to site-packages. Environments get hardlinks to its files,
+# so removing an env or a store entry never affects anything else. Builds
+# hold a shared store lock while linking, and pruning an exclusive one, so no
+# entry is removed while it is being linked from.
+
+def package_store_enabled() -> bool:
+    return os.environ.get("PYTHONRUNSCRIPT_PACKAGE_STORE", "") not in ("", "0")
+
+def store_base() -> str:
+    return os.path.join(cache_base(), "store")
+
+class StoreLock:
+    "flock on locks/store.lock: shared while linking from the store, exclusive while pruning it"
+    def __init__(self, exclusive:bool):
+        self.exclusive = exclusive
+        self.fd = -1
+    def __enter__(self) -> StoreLock:
+        os.makedirs(locks_base(), exist_ok=True)
+        self.fd = os.open(os.path.join(locks_base(), "store.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+    def __exit__(self, *exc) -> None:
+        os.close(self.fd)
+        self.fd = -1
+
+def canonical_name(name:str) -> str:
+    "PEP 503 normalized project name"
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def site_packages_dir(interpreter) -> Union[str,None]:
+    "site-packages of the venv or conda prefix containing interpreter"
+    prefix = os.path.dirname(os.path.dirname(interpreter))
+    found = glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages'))
+    return found[0] if len(found) == 1 else None
+
+def resolve_pip_wheels(proj_dir, reqs_path, interpreter, sources=()) -> dict[str,str]:
+    "{canonical name: store key} for each index wheel pip would install for reqs_path"
+    report_path = os.path.join(proj_dir, 'pip_report.json')
+    success = run_with_logging([interpreter, "-m", "pip", "install", "--dry-run", "--ignore-installed", *sources,
+                                "--quiet", "--report", report_path, "-r", reqs_path],
+                               proj_dir,
+                               "pip_resolve.out","pip_resolve.err",
+                               Log.SILENT)
+    if not success:
+        logging.info("pip could not resolve a report, so not using the package store")
+        return {}
+    with open(report_path) as f:
+        report = json.load(f)
+    keys = {}
+    for item in report.get('install', []):
+        url = item.get('download_info', {}).get('url', '')
+        if item.get('is_direct') or not url.endswith('.whl'):
+            continue
+        wheel_name = os.path.basename(url)
+        tag = '-'.join(wheel_name[:-len('.whl')].split('-')[-3:])
+        name = canonical_name(item['metadata']['name'])
+        keys[name] = f"{name}-{item['metadata']['version']}-{tag}"
+    return keys
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def store_entry_files(entry) -> list[str]:
+    return [os.path.relpath(os.path.join(d, f), entry)
+            for (d, _, fs) in os.walk(entry) for f in fs]
+
+def link_from_package_store(keys, site_packages, interpreter) -> list[str]:
+    """
+    Hardlinks stored distributions into site_packages. Returns the keys linked.
+    A distribution which cannot be linked is undone, and left for pip to install.
+    """
+    linked = []
+    with StoreLock(exclusive=False):
+        for key in keys:
+            entry = os.path.join(store_base(), key)
+            if not os.path.isdir(entry):
+                continue
+            files = store_entry_files(entry)
+            if any(os.path.lexists(os.path.join(site_packages, f)) for f in files):
+                logging.info(f"not linking {key}, which conflicts with files already installed")
+                continue
+            done = []
+            try:
+                for f in files:
+                    dst = os.path.join(site_packages, f)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    link_or_copy(os.path.join(entry, f), dst)
+                    done.append(dst)
+                for dist_info in glob.glob(os.path.join(entry, '*.dist-info')):
+                    write_entry_point_scripts(dist_info, os.path.dirname(interpreter), interpreter)
+            except OSError as e:
+                logging.info(f"could not link {key}, so pip will install it: {e}")
+                for dst in done:
+                    os.remove(dst)
+                continue
+            linked.append(key)
+    return linked
+
+def entry_point_scripts(dist_info) -> dict[str,str]:
+    "{script name: 'module:attr'} for a distribution's console and gui scripts"
+    cp = configparser.ConfigParser(delimiters=('=',))
+    cp.optionxform = str
+    cp.read(os.path.join(dist_info, 'entry_points.txt'))
+    return {name: value.split('[')[0].strip()
+            for section in ('console_scripts', 'gui_scripts') if cp.has_section(section)
+            for (name, value) in cp.items(section)}
+
+def write_entry_point_scripts(dist_info, bin_dir, interpreter):
+    "Writes the launcher scripts pip would have generated for dist_info"
+    for (name, target) in entry_point_scripts(dist_info).items():
+        (module, _, attr) = target.partition(':')
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(f"#!{interpreter}\n"
+                    "# -*- coding: utf-8 -*-\n"
+                    "import re\n"
+                    "import sys\n"
+                    f"from {module} import {attr.split('.')[0]}\n"
+                    "if __name__ == '__main__':\n"
+                    "    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])\n"
+                    f"    sys.exit({attr}())\n")
+        os.chmod(path, 0o755)
+
+def ingest_into_package_store(keys:dict[str,str], site_packages, skip:set[str]):
+    """
+    Adds newly installed distributions to the store, as hardlinks to the env's files.
+
+    Only distributions whose files all live in site-packages, apart from
+    entry point scripts, can be stored.
+    """
+    for dist_info in glob.glob(os.path.join(site_packages, '*.dist-info')):
+        (name, _, version) = os.path.basename(dist_info)[:-len('.dist-info')].rpartition('-')
+        key = keys.get(canonical_name(name))
+        if key is None or key in skip or not key.startswith(f"{canonical_name(name)}-{version}-"):
+            continue
+        entry = os.path.join(store_base(), key)
+        if os.path.exists(entry):
+            continue
+        scripts = entry_point_scripts(dist_info)
+        try:
+            with open(os.path.join(dist_info, 'RECORD'), newline='') as f:
+                paths = [os.path.normpath(row[0]) for row in csv.reader(f) if row]
+        except OSError:
+            continue
+        outside = [p for p in paths if p.startswith('..')]
+        if any(os.path.basename(p) not in scripts for p in outside):
+            logging.info(f"not storing {key}, which installs files outside site-packages")
+            continue
+        files = [p for p in paths if not p.startswith('..') and os.path.basename(p) != 'REQUESTED']
+        tmp = os.path.join(store_base(), f".tmp-{key}-{os.getpid()}")
+        try:
+            for p in files:
+                dst = os.path.join(tmp, p)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                link_or_copy(os.path.join(site_packages, p), dst)
+            os.rename(tmp, entry)
+        except OSError as e:
+            logging.info(f"could not store {key}: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def make_conda_install_yml_command(condaprefix_dir, env_yml_file, conda:Union[CondaBackend,None]=None) -> list[str]:
+    return (conda or conda_backend()).install_yml_command(condaprefix_dir, env_yml_file)
+
+def make_conda_create_spec_command(condaprefix_dir, install_spec_file, conda:Union[CondaBackend,None]=None) -> list[str]:
+    return (conda or conda_backend()).create_spec_command(condaprefix_dir, install_spec_file)
+
+def export_conda_environment(condaprefix_dir) -> str:
+    """
+    An environment.yml pinning what is installed in condaprefix_dir, like
+    `conda env export` writes, but read from its conda-meta records in-process.
+    """
+    records = []
+    for path in glob.glob(os.path.join(condaprefix_dir, 'conda-meta', '*.json')):
+        try:
+            with open(path) as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            logging.info(f"skipping unreadable conda record {path}")
+    channels:list[str] = []
+    dependencies = []
+    for r in sorted(records, key=lambda r: r.get('name', '')):
+        if 'name' not in r:
+            continue
+        dependencies.append(f"{r['name']}={r.get('version', '')}={r.get('build', '')}")
+        channel = conda_channel_name(r.get('channel') or '', r.get('subdir') or '')
+        if channel and channel not in channels:
+            channels.append(channel)
+    return ''.join([f"name: {os.path.basename(condaprefix_dir)}\n",
+                    "channels:\n", *(f"  - {c}\n" for c in channels),
+                    "dependencies:\n", *(f"  - {d}\n" for d in dependencies),
+                    f"prefix: {condaprefix_dir}\n"])
+
+def conda_channel_name(channel:str, subdir:str) -> str:
+    "The short name of a channel URL from a conda-meta record, as conda shows it"
+    if subdir and channel.endswith('/' + subdir):
+        channel = channel[:-len(subdir) - 1]
+    if re.match(r'https?://repo\.anaconda\.com/pkgs/', channel):
+        return "defaults"
+    if m := re.match(r'https?://conda\.anaconda\.org/(.+)$', channel):
+        return m.group(1)
+    return channel
 
 def setup_conda_prefix(proj_dir:str, condaprefix_dir:str,
                        conda_envyml:str,
                        conda_specs:str,
                        pip_requirements,
-                       log_level:Log) -> bool:
+                       log_level:Log,
+                       clone_from:Union[str,None]=None,
+                       conda:Union[CondaBackend,None]=None) -> bool:
+    conda = conda or conda_backend()
+    os.makedirs(proj_dir, exist_ok=True)
+    if clone_from:
+        logging.info(f"cloning conda prefix {clone_from} to {condaprefix_dir}")
+        if not conda.can_clone or not run_with_logging(conda.clone_command(clone_from, condaprefix_dir),
+                                                       proj_dir,
+                                                       "conda_clone.out","conda_clone.err",
+                                                       log_level):
+            return False
+
+    # each of these creates the prefix as it installs, so conda solves once
     logging.info(f"creating conda prefix {condaprefix_dir}")
-    create_conda_prefix(proj_dir, condaprefix_dir, log_level)
-
     success = False
     if conda_envyml:
         install_env_f = os.path.join(proj_dir,'environment.yml')
         with open(install_env_f, 'w') as f:
             f.write(conda_envyml)
-        command_to_run = make_conda_install_yml_command(condaprefix_dir, install_env_f)
+        command_to_run = make_conda_install_yml_command(condaprefix_dir, install_env_f, conda)
         success = run_with_logging(command_to_run,
                                    proj_dir,
                                    "conda_env_create_f.out","conda_env_create_f.err",
@@ -456,7 +1714,10 @@ def setup_conda_prefix(proj_dir:str, condaprefix_dir:str,
         install_spec_f = os.path.join(proj_dir,'conda_install_specs.txt')
         with open(install_spec_f, 'w') as f:
             f.write(conda_specs)
-        command_to_run = make_conda_install_spec_command(condaprefix_dir, install_spec_f)
+        if clone_from:
+            command_to_run = conda.install_spec_command(condaprefix_dir, install_spec_f)
+        else:
+            command_to_run = make_conda_create_spec_command(condaprefix_dir, install_spec_f, conda)
         success = run_with_logging(command_to_run,
                                    proj_dir,
                                    "conda_install.out","conda_install.err",
@@ -464,66 +1725,227 @@ def setup_conda_prefix(proj_dir:str, condaprefix_dir:str,
     else:
         assert True, "unreachable. "
     if success:
-        with open(os.path.join(proj_dir,"exported-environment.yml"),"w") as f:
-            cmd = ["conda","env","export","--quiet", "--prefix",condaprefix_dir]
-            logging.info(f"exporting env with {cmd}")
-            subprocess.run(shlex.join(cmd),
-                           stdout=f, stderr=f,
-                           shell=True,executable=shutil.which('bash'))
+        with open(os.path.join(proj_dir,"exported-environment.yml"),"w") as f, phase("conda_env_export"):
+            f.write(export_conda_environment(condaprefix_dir))
     else:
         print("## Errors trying to install conda dependencies",file=sys.stderr)
         return False
 
     if pip_requirements:
         interpreter = os.path.join(condaprefix_dir, 'bin','python3')
-        return install_pip_requirements(proj_dir,pip_requirements,
+        if not install_pip_requirements(proj_dir,pip_requirements,
                                         interpreter,
-                                        log_level)
+                                        log_level):
+            return False
+    with phase("capture_conda_activation"):
+        captured = capture_conda_activation(proj_dir, condaprefix_dir, conda)
+    if not captured:
+        print(f"## Could not capture the conda activation. Runs will use `{conda.name} run`",file=sys.stderr)
+    return True
+
+
+# settings given on the command line go in the environment, with the values
+# they replaced, which are put back for the script
+cli_replaced_environ:dict[str,Union[str,None]] = {}
+
+def set_cli_setting(var:str, value:str) -> None:
+    "Sets var in the environment, for this process and its workers but not the script"
+    cli_replaced_environ.setdefault(var, os.environ.get(var))
+    os.environ[var] = value
+
+def restore_environ(env) -> None:
+    "Puts back in env the values which settings given on the command line replaced"
+    for (var, value) in cli_replaced_environ.items():
+        if value is None:
+            env.pop(var, None)
+        else:
+            env[var] = value
+
+def run_script(interpreter, script, args, env=None) -> NoReturn:
+    "Execs the script, in env if given, or else in the current environment"
+    # no logging here: this is on the warm launch path
+    if profiler is not None:
+        profiler.instant("exec", interpreter=interpreter)
+        profiler.write()
+    sys.stdout.flush()
+    if cli_replaced_environ:
+        env = dict(os.environ if env is None else env)
+        restore_environ(env)
+    if env is None:
+        os.execvp(interpreter, [interpreter,script] + args)
     else:
-        return True
-
+        os.execvpe(interpreter, [interpreter,script] + args, env)
 
-def run_script(interpreter, script, args) -> NoReturn:
-    logging.info(
-        f"running {script} using {interpreter} with args: {args}"
-    )
-    sys.stdout.flush()
-    logging.info(f'os.execvp({interpreter}, [{interpreter},{script}] + {args})')
-    os.execvp(interpreter, [interpreter,script] + args)
+def in_process_enabled() -> bool:
+    "True if PYTHONRUNSCRIPT_IN_PROCESS asks to run no-deps scripts in this interpreter"
+    return os.environ.get("PYTHONRUNSCRIPT_IN_PROCESS", "") not in ("", "0")
 
-def conda_run_script(interpreter, script, args, conda_env_dir) -> NoReturn:
+def run_script_in_process(script, args) -> NoReturn:
+    """
+    Runs script in this interpreter as `python3 script args` would, with the
+    same argv, sys.path[0], __main__, exit code and traceback, but without
+    starting a second interpreter.
+    """
+    if profiler is not None:
+        profiler.instant("run_in_process")
+        profiler.write()
+    if not isinstance(logging, LazyModule):
+        # so the script's logging.basicConfig() is not a no-op
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.setLevel(logging.WARNING)
+    restore_environ(os.environ)
+    path = os.path.abspath(script)
+    sys.argv = [script] + args
+    sys.path[0] = os.path.dirname(os.path.realpath(script))
+    # what runpy.run_path() does for a file, without importing runpy, whose
+    # imports cost more than starting another interpreter
+    main = type(sys)('__main__')
+    main.__file__ = path
+    main.__loader__ = sys.modules['_frozen_importlib_external'].SourceFileLoader('__main__', path)
+    main.__cached__ = None
+    sys.modules['__main__'] = main
+    try:
+        with open(path, 'rb') as f:
+            code = compile(f.read(), path, 'exec')
+        exec(code, main.__dict__)
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # python3 shows no frames above the script's own, so drop ours
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        sys.excepthook(type(e), e.with_traceback(tb), tb)
+        if isinstance(e, KeyboardInterrupt):
+            # like python3, die of SIGINT so the shell sees the interrupt
+            atexit._run_exitfuncs()
+            sys.stdout.flush()
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGINT)
+        sys.exit(1)
+    sys.exit(0)
+
+def conda_run_script(interpreter, script, args, conda_env_dir, conda:Union[CondaBackend,None]=None) -> NoReturn:
+    "Fallback for when no captured activation is available"
+    conda = conda or conda_backend()
     logging.info(
         f"using conda run to run {script} using {interpreter} with args: {args}"
     )
-    logging.info(f'os.execvp({interpreter}, [{interpreter},{script}] + {args})')
     # to workaround the conda bug https://github.com/conda/conda/issues/13639
-    should_use_wrapper = True
-    if should_use_wrapper:
-        workaround_path = os.path.join(conda_env_dir,'exec_script')
-        with open(workaround_path,'w') as f:
-            workaround_script = f"exec {interpreter} {script}"
-            for arg in args:
-                workaround_script += f" {arg}"
-            workaround_script += "\n"
-            logging.info(f'builiding script with contents: {workaround_script}')
-            logging.info(f'writing script to path: {workaround_path}')
-            f.write(workaround_script)
-        os.chmod(workaround_path, 0o755)
-        cmd = ["conda","run","-p", conda_env_dir, "--no-capture-output", workaround_path]
-    else:
-        cmd = ["conda","run","-p", conda_env_dir, "--no-capture-output", interpreter,script] + args
+    # conda must not see the script's args, so they go in a wrapper script.
+    # Each run gets its own wrapper, which deletes itself, so concurrent runs do not race.
+    (fd, workaround_path) = tempfile.mkstemp(prefix='exec_script-', dir=conda_env_dir)
+    with os.fdopen(fd,'w') as f:
+        workaround_script = f'#!/bin/sh\nrm -f "$0"\nexec {shlex.join([interpreter, script] + args)}\n'
+        logging.info(f'writing script with contents: {workaround_script} to path: {workaround_path}')
+        f.write(workaround_script)
+    os.chmod(workaround_path, 0o755)
+    cmd = conda.run_command(conda_env_dir) + [workaround_path]
     sys.stdout.flush()
+    restore_environ(os.environ)
     os.execvp(cmd[0],cmd)
 
+#
+# conda activation
+#
+
+# Activating a conda prefix (PATH, CONDA_PREFIX, activate.d scripts, ...) is
+# captured once with `conda run` and stored in the project dir as NUL-separated
+# records "OP\tKEY=VALUE", where OP is set, prepend or unset. Later runs apply
+# them and exec the prefix's python directly, with no conda process.
+ACTIVATION_VERSION = "1"
+ACTIVATION_MARKER = "--pythonrunscript-activated-environ--"
+ACTIVATION_IGNORED_KEYS = {'_', 'SHLVL', 'PWD', 'OLDPWD'}
+
+def activation_path(proj_dir) -> str:
+    return os.path.join(proj_dir, 'activation.env')
+
+def capture_conda_activation(proj_dir, condaprefix_dir, conda:Union[CondaBackend,None]=None) -> bool:
+    "Records the environment changes made by activating condaprefix_dir"
+    conda = conda or conda_backend()
+    interpreter = os.path.join(condaprefix_dir, 'bin', 'python3')
+    dump = ("import os, sys; sys.stdout.write(" + repr(ACTIVATION_MARKER + "\0")
+            + " + '\\0'.join(k + '=' + v for (k, v) in os.environ.items()))")
+    cmd = conda.run_command(condaprefix_dir) + [interpreter,"-c",dump]
+    logging.info(f"capturing conda activation with {cmd}")
+    try:
+        cp = subprocess.run(cmd, capture_output=True)
+    except OSError as e:
+        logging.info(f"could not run conda to capture activation: {e}")
+        return False
+    out = cp.stdout.decode('utf-8', 'surrogateescape')
+    if cp.returncode != 0 or ACTIVATION_MARKER not in out:
+        logging.info(f"capturing conda activation failed: {cp.stderr!r}")
+        return False
+    activated = dict(kv.split('=', 1) for kv in out.split(ACTIVATION_MARKER + "\0", 1)[1].split('\0') if '=' in kv)
+
+    records = [f"version\t{ACTIVATION_VERSION}"]
+    for (k, v) in activated.items():
+        base = os.environ.get(k)
+        if k in ACTIVATION_IGNORED_KEYS or v == base:
+            continue
+        elif base and v.endswith(base):
+            records.append(f"prepend\t{k}={v[:-len(base)]}")
+        else:
+            records.append(f"set\t{k}={v}")
+    for k in os.environ:
+        if k not in activated and k not in ACTIVATION_IGNORED_KEYS:
+            records.append(f"unset\t{k}=")
+
+    path = activation_path(proj_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8', errors='surrogateescape') as f:
+        f.write('\0'.join(records))
+    os.replace(tmp, path)
+    return True
+
+def read_activation(proj_dir) -> Union[list[tuple[str,str,str]],None]:
+    "The captured activation as (op, key, value) records, or None if there is none"
+    try:
+        with open(activation_path(proj_dir), 'r', encoding='utf-8', errors='surrogateescape') as f:
+            records = f.read().split('\0')
+    except OSError:
+        return None
+    if records[0] != f"version\t{ACTIVATION_VERSION}":
+        return None
+    activation = []
+    for record in records[1:]:
+        (op, _, kv) = record.partition('\t')
+        (k, _, v) = kv.partition('=')
+        if op not in ('set', 'prepend', 'unset'):
+            return None
+        activation.append((op, k, v))
+    return activation
+
+def conda_activated_environ(proj_dir) -> Union[dict[str,str],None]:
+    "The current environ with the captured activation applied, or None if there is none"
+    activation = read_activation(proj_dir)
+    if activation is None:
+        return None
+    env = dict(os.environ)
+    for (op, k, v) in activation:
+        if op == 'set':
+            env[k] = v
+        elif op == 'prepend':
+            env[k] = v + env.get(k, '')
+        else:
+            env.pop(k, None)
+    return env
+
 #
 # venv operations
 # 
 
-def create_venv(proj_dir, venv_dir, pip_requirements, log_level:Log) -> bool:
+def create_venv(proj_dir, venv_dir, pip_requirements, log_level:Log,
+                pip:Union[PipBackend,None]=None) -> bool:
     "Creates a script project dir for script at script_path"
-    logging.info(f"Creating venv at  {venv_dir}")
+    pip = pip or pip_backend()
+    logging.info(f"Creating venv at  {venv_dir} with {pip.name}")
 
-    success = run_with_logging(["python3", "-m", "venv", venv_dir],
+    # the venv is built by this Python, whose tags are in the dep hash
+    success = run_with_logging(pip.create_venv_command(venv_dir),
                                proj_dir,
                                "create_venv.out","creat_evenv.err",
                                log_level)
@@ -535,10 +1957,1055 @@ def create_venv(proj_dir, venv_dir, pip_requirements, log_level:Log) -> bool:
         interpreter = os.path.join(venv_dir, 'bin','python3')
         return install_pip_requirements(proj_dir,
                                         pip_requirements,
-                                        interpreter,log_level)
+                                        interpreter,log_level,pip)
+    else:
+        return True
+
+
+#
+# bytecode precompilation
+#
+
+# A script's first run in a new environment would otherwise compile each
+# module it imports, which takes seconds for heavy packages, and concurrent
+# first runs race to write the same __pycache__ files. So a build can end by
+# compiling all of site-packages in parallel. The env's own interpreter does
+# this, so the bytecode matches its version, and the optimization level comes
+# from PYTHONOPTIMIZE. The script itself is not compiled, because python3
+# never loads __main__ from bytecode.
+
+def precompile_enabled() -> bool:
+    "True if PYTHONRUNSCRIPT_PRECOMPILE asks to byte-compile new environments"
+    return os.environ.get("PYTHONRUNSCRIPT_PRECOMPILE", "") not in ("", "0")
+
+def precompile_environment(proj:Project) -> None:
+    """
+    Byte-compiles proj's site-packages, logging to precompile.out and recording
+    the time taken in the manifest. Files which do not compile, like Python 2
+    examples shipped in some packages, are logged but do not fail the build.
+    """
+    site_packages = site_packages_dir(proj.interpreter)
+    if site_packages is None:
+        logging.info(f"found no single site-packages for {proj.interpreter}, so not precompiling")
+        return
+    start = time.monotonic()
+    success = run_with_logging([proj.interpreter, "-m", "compileall", "-q", "-j", "0", site_packages],
+                               proj.project_path,
+                               "precompile.out","precompile.err",
+                               Log.VERBOSE if proj.verbose else Log.SILENT)
+    seconds = round(time.monotonic() - start, 3)
+    proj.build_details["precompile_seconds"] = seconds
+    with open(os.path.join(proj.project_path, "logs", "precompile.out"), "a") as f:
+        f.write(f"## compiled {site_packages} in {seconds}s" + ("" if success else ", with errors") + "\n")
+
+#
+# manifests
+#
+
+MANIFEST_NAME = "manifest.json"
+
+def write_manifest(project_path, manifest:dict) -> None:
+    "Atomically writes the manifest which marks project_path as complete"
+    path = os.path.join(project_path, MANIFEST_NAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+def read_manifest(project_path) -> Union[dict,None]:
+    try:
+        with open(os.path.join(project_path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+def legacy_build_completed(project_path) -> bool:
+    "True for a dir built before manifests existed whose last build step finished"
+    if os.path.exists(os.path.join(project_path, 'requirements.txt')):
+        return os.path.exists(os.path.join(project_path, 'piplist.txt'))
+    return os.path.exists(os.path.join(project_path, 'exported-environment.yml'))
+
+def is_project_dir_name(name:str) -> bool:
+    return len(name) == 32 and all(c in '0123456789abcdef' for c in name)
+
+def sweep_incomplete_projects(min_age:float=3600) -> None:
+    """
+    Trashes project dirs left without a manifest by interrupted builds.
+
+    Skips dirs modified in the last min_age seconds and dirs whose build lock
+    is held, which may still be building. Dirs completed before manifests
+    existed are adopted instead. A build writes their marker files before its
+    last steps, so only an unlocked dir is known to be one.
+    """
+    try:
+        names = os.listdir(cache_base())
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(cache_base(), name)
+        if not is_project_dir_name(name) or os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            continue
+        try:
+            if time.time() - os.stat(path).st_mtime < min_age:
+                continue
+        except OSError:
+            continue
+        lock = BuildLock(name, path)
+        os.makedirs(locks_base(), exist_ok=True)
+        if lock.try_acquire():
+            try:
+                if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+                    pass
+                elif legacy_build_completed(path):
+                    kind = 'pip' if os.path.isdir(os.path.join(path, 'venv')) else 'conda'
+                    write_manifest(path, dict(dep_hash=name, kind=kind, adopted=True, created=time.time()))
+                else:
+                    logging.info(f"Trashing incomplete project dir {path}")
+                    pseudo_erase_dir(path)
+            finally:
+                lock.__exit__()
+
+#
+# profiling
+#
+
+class Profiler:
+    "Collects the stages of one invocation as Chrome trace events"
+    def __init__(self, path:str):
+        self.path = path
+        self.start_ns = time.perf_counter_ns()
+        self.wall_start = time.time()
+        self.events:list[dict] = []
+        self.written = False
+    def _ts(self, ns:int) -> float:
+        return (ns - self.start_ns) / 1000
+    def complete(self, name:str, start_ns:int, end_ns:int, args:dict) -> None:
+        self.events.append(dict(name=name, ph="X", ts=self._ts(start_ns), dur=(end_ns - start_ns) / 1000,
+                                pid=os.getpid(), tid=0, args=args))
+    def instant(self, name:str, **args) -> None:
+        self.events.append(dict(name=name, ph="i", s="p", ts=self._ts(time.perf_counter_ns()),
+                                pid=os.getpid(), tid=0, args=args))
+    def write(self) -> None:
+        if self.written:
+            return
+        self.written = True
+        trace = dict(traceEvents=self.events, displayTimeUnit="ms",
+                     otherData=dict(version=version_str, argv=sys.argv, start=self.wall_start,
+                                    python=sys.version.split()[0], platform=sys.platform))
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(trace, f, default=str)
+        except OSError as e:
+            print(f"## Could not write the profile {self.path}: {e}",file=sys.stderr)
+
+profiler:Union[Profiler,None] = None
+
+def start_profile(target:str) -> None:
+    """
+    Starts recording stages. target is a trace file path, a directory to
+    write traces into, or 1 for the cache's profiles directory.
+    """
+    global profiler
+    if target.lower() in ("1", "true", "yes"):
+        target = os.path.join(cache_base(), "profiles", "")
+    if target.endswith(os.sep) or os.path.isdir(target):
+        target = os.path.join(target, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.json")
+    profiler = Profiler(target)
+    atexit.register(profiler.write)
+
+class phase:
+    "Context manager recording a stage of this invocation, when profiling is on"
+    __slots__ = ('name', 'args', 'start_ns')
+    def __init__(self, name:str, **args):
+        self.name = name
+        self.args = args
+    def __enter__(self) -> phase:
+        if profiler is not None:
+            self.start_ns = time.perf_counter_ns()
+        return self
+    def __exit__(self, exc_type, *_) -> None:
+        if profiler is not None:
+            if exc_type is not None:
+                self.args['error'] = exc_type.__name__
+            profiler.complete(self.name, self.start_ns, time.perf_counter_ns(), self.args)
+
+#
+# trash
+#
+
+TRASH_NAME = ".trash"
+
+def trash_rate() -> Union[int,None]:
+    "Bytes per second empty_trash() may delete, from PYTHONRUNSCRIPT_TRASH_RATE. None for no limit"
+    try:
+        rate = parse_size(os.environ.get("PYTHONRUNSCRIPT_TRASH_RATE", "256M"))
+    except ValueError:
+        rate = 256 << 20
+    return rate if rate > 0 else None
+
+def empty_trash(verbose:bool=False) -> None:
+    """
+    Deletes everything in the trash, at no more than trash_rate() bytes a
+    second so it does not starve running scripts of I/O. Returns at once if
+    another process is already emptying the trash.
+    """
+    try:
+        fd = os.open(os.path.join(trash_base(), ".lock"), os.O_RDONLY | os.O_CREAT, 0o644)
+    except OSError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        if verbose:
+            print("## Another process is already emptying the trash")
+        return
+    try:
+        (rate, start, deleted) = (trash_rate(), time.monotonic(), 0)
+        while entries := [n for n in os.listdir(trash_base()) if n != ".lock"]:
+            for name in entries:
+                for (d, dirs, fs) in os.walk(os.path.join(trash_base(), name), topdown=False):
+                    for f in fs:
+                        path = os.path.join(d, f)
+                        try:
+                            st = os.lstat(path)
+                            os.unlink(path)
+                        except OSError:
+                            continue
+                        # unlinking one of several hardlinks frees nothing
+                        deleted += st.st_blocks * 512 if st.st_nlink == 1 else 0
+                        if rate is not None and deleted / rate > time.monotonic() - start:
+                            time.sleep(deleted / rate - (time.monotonic() - start))
+                    for sub in dirs:
+                        sub = os.path.join(d, sub)
+                        os.unlink(sub) if os.path.islink(sub) else shutil.rmtree(sub, ignore_errors=True)
+                shutil.rmtree(os.path.join(trash_base(), name), ignore_errors=True)
+                if os.path.lexists(os.path.join(trash_base(), name)):
+                    logging.info(f"Could not delete {name} from the trash")
+                    return
+        if verbose:
+            print(f"## Emptied the trash, deleting {deleted / (1 << 20):.0f} MiB")
+    finally:
+        os.close(fd)
+
+def schedule_trash_disposal() -> None:
+    "Empties the trash in a detached background process, if it holds anything"
+    try:
+        if not [n for n in os.listdir(trash_base()) if n != ".lock"]:
+            return
+    except OSError:
+        return
+    env = {k: v for (k, v) in os.environ.items() if k != "PYTHONRUNSCRIPT_PROFILE"}
+    # sh backgrounds the emptier and exits, so it is never left a zombie of the exec'd script
+    try:
+        subprocess.run(["/bin/sh", "-c", '"$@" </dev/null >/dev/null 2>&1 &', "sh",
+                        sys.executable, os.path.abspath(__file__), "--empty-trash"],
+                       env=env, start_new_session=True)
+    except OSError as e:
+        logging.info(f"Could not start emptying the trash: {e}")
+
+def select_environments(selectors:list[str], older_than:Union[float,None]) -> Union[list[str],None]:
+    """
+    Names of the project dirs in the cache matched by any selector, which is a
+    dep hash, a unique prefix of one, or a script path. With no selectors, all
+    of them. With older_than, only those unused for that many seconds. None if
+    a selector matched nothing.
+    """
+    try:
+        names = sorted(n for n in os.listdir(cache_base()) if is_project_dir_name(n))
+    except OSError:
+        names = []
+    selected = set() if selectors else set(names)
+    for selector in selectors:
+        if os.path.isfile(selector):
+            script = os.path.abspath(selector)
+            found = {Project.make_project(selector, False, False).dep_hash} & set(names)
+            found |= {e['dep_hash'] for e in catalog_entries() if script in e['scripts']}
+        else:
+            found = {n for n in names if n.startswith(selector.lower())} if len(selector) >= 4 else set()
+            if len(found) > 1 and selector.lower() not in found:
+                print(f"## {selector} is the prefix of more than one environment: {', '.join(sorted(found))}",file=sys.stderr)
+                return None
+        if not found:
+            print(f"## {selector} matches no environment in the cache",file=sys.stderr)
+            return None
+        selected |= found
+    if older_than is not None:
+        now = time.time()
+        selected = {n for n in selected if now - last_use(os.path.join(cache_base(), n)) > older_than}
+    return sorted(selected)
+
+def clean_cache(selectors:list[str], older_than:Union[float,None]) -> bool:
+    """
+    Trashes the selected environments, skipping any in use, being built, or
+    run by a launcher. With neither selectors nor older_than, selects every
+    environment, and also trashes everything else in the cache except the
+    wheelhouse and the locks and launcher stamps of kept environments.
+    False if a selector matched nothing.
+    """
+    names = select_environments(selectors, older_than)
+    if names is None:
+        return False
+    for name in names:
+        if try_evict(os.path.join(cache_base(), name)):
+            print(f"## Removed {name}")
+        else:
+            print(f"## Keeping {name}, which is in use, being built, or run by a launcher")
+    if not selectors and older_than is None:
+        # keeps the wheelhouse, so later rebuilds need not download again
+        for name in os.listdir(cache_base()) if os.path.isdir(cache_base()) else []:
+            if not is_project_dir_name(name) and name not in (WHEELHOUSE_NAME, TRASH_NAME, "locks", "launchers"):
+                pseudo_erase_dir(os.path.join(cache_base(), name))
+    schedule_trash_disposal()
+    return True
+
+#
+# cache eviction
+#
+
+IN_USE_NAME = "in-use.lock"
+
+def parse_size(text:str) -> int:
+    "Bytes in a size like 500M, 20G or 1048576"
+    text = text.strip().upper().rstrip('B')
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse_age(text:str) -> float:
+    "Seconds in an age like 30d, 12h, 45m, or a plain number of days"
+    text = text.strip().lower()
+    units = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text) * 86400
+
+def cache_budget() -> tuple[Union[int,None],Union[float,None]]:
+    "(max size in bytes, max age in seconds) from PYTHONRUNSCRIPT_CACHE_MAX_SIZE and _MAX_AGE"
+    (max_size, max_age) = (None, None)
+    try:
+        if os.environ.get("PYTHONRUNSCRIPT_CACHE_MAX_SIZE"):
+            max_size = parse_size(os.environ["PYTHONRUNSCRIPT_CACHE_MAX_SIZE"])
+        if os.environ.get("PYTHONRUNSCRIPT_CACHE_MAX_AGE"):
+            max_age = parse_age(os.environ["PYTHONRUNSCRIPT_CACHE_MAX_AGE"])
+    except ValueError:
+        print("## Ignoring an unparseable PYTHONRUNSCRIPT_CACHE_MAX_SIZE or PYTHONRUNSCRIPT_CACHE_MAX_AGE",file=sys.stderr)
+    return (max_size, max_age)
+
+def last_use(project_path) -> float:
+    "When the env was last launched, or else built"
+    for name in (IN_USE_NAME, MANIFEST_NAME):
+        try:
+            return os.stat(os.path.join(project_path, name)).st_mtime
+        except OSError:
+            pass
+    return os.stat(project_path).st_mtime
+
+def disk_usage(path, seen:Union[set,None]=None, exclusive:bool=False) -> int:
+    """
+    Bytes allocated under path, counting each inode once across calls sharing seen.
+
+    With exclusive, only counts files no other path hardlinks to, i.e. what removing path frees.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    for (d, _, fs) in os.walk(path):
+        for f in fs:
+            try:
+                st = os.lstat(os.path.join(d, f))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in seen or (exclusive and st.st_nlink > 1):
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_blocks * 512
+    return total
+
+def try_evict(project_path) -> bool:
+    "Trashes the env unless it is being built or run, or a launcher runs it"
+    if runs_launchers(project_path):
+        return False
+    name = os.path.basename(project_path)
+    build_lock = BuildLock(name, project_path)
+    os.makedirs(locks_base(), exist_ok=True)
+    if not build_lock.try_acquire():
+        return False
+    try:
+        try:
+            fd = os.open(os.path.join(project_path, IN_USE_NAME), os.O_RDONLY | os.O_CREAT, 0o644)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            pseudo_erase_dir(project_path)
+        finally:
+            os.close(fd)
+        return True
+    finally:
+        build_lock.__exit__()
+
+def prune_package_store() -> int:
+    "Removes store entries which no env links to any more. Returns bytes freed"
+    freed = 0
+    try:
+        keys = os.listdir(store_base())
+    except OSError:
+        return 0
+    with StoreLock(exclusive=True):
+        for key in keys:
+            entry = os.path.join(store_base(), key)
+            if key.startswith('.tmp-'):
+                continue
+            if all(os.lstat(os.path.join(d, f)).st_nlink == 1 for (d, _, fs) in os.walk(entry) for f in fs):
+                freed += disk_usage(entry)
+                shutil.rmtree(entry, ignore_errors=True)
+    return freed
+
+def collect_garbage(verbose:bool=False, keep=()) -> None:
+    """
+    Evicts envs older than the max age, then least recently used envs until the
+    cache is within its max size. Envs in keep, in use or being built are kept.
+    The wheelhouse does not count towards the size, as evicting envs cannot shrink it.
+    Also folds the launch log into the catalog, as warm launches only append to it.
+    """
+    (max_size, max_age) = cache_budget()
+    if verbose and (max_size, max_age) == (None, None):
+        print("## No cache budget is set, so only unused store entries and interrupted builds are removed.")
+        print("## Set PYTHONRUNSCRIPT_CACHE_MAX_SIZE (like 20G) or PYTHONRUNSCRIPT_CACHE_MAX_AGE (like 30d) to evict environments.")
+    sweep_incomplete_projects()
+    fold_launch_log()
+    try:
+        names = [n for n in os.listdir(cache_base()) if is_project_dir_name(n) and n not in keep]
+    except OSError:
+        names = []
+    envs = sorted((last_use(os.path.join(cache_base(), n)), n) for n in names)
+    total = 0
+    if max_size is not None:
+        seen:set = set()
+        total = sum(disk_usage(os.path.join(cache_base(), n), seen)
+                    for n in os.listdir(cache_base()) if n not in (TRASH_NAME, WHEELHOUSE_NAME))
+    now = time.time()
+    evicted = []
+    for (used, name) in envs:
+        too_old = max_age is not None and now - used > max_age
+        too_big = max_size is not None and total > max_size
+        if not (too_old or too_big):
+            continue
+        path = os.path.join(cache_base(), name)
+        freed = disk_usage(path, exclusive=True) if max_size is not None else 0
+        if try_evict(path):
+            total -= freed
+            evicted.append(name)
+        elif verbose:
+            print(f"## Keeping {path}, which is in use, being built, or run by a launcher")
+    total -= prune_package_store()
+    if verbose:
+        print(f"## Evicted {len(evicted)} environments" + (f". The cache now uses about {total / (1 << 20):.0f} MiB" if max_size is not None else ""))
+        for name in evicted:
+            print(f"\t{name}")
+
+#
+# cache catalog
+#
+
+# catalog.sqlite3 in the cache records each env's origin scripts, size, build
+# time and use. Launches only append a line to launches.log, which is folded
+# into the catalog when it is next opened, or by GC, to keep sqlite off the
+# launch path.
+
+def catalog_path() -> str:
+    return os.path.join(cache_base(), "catalog.sqlite3")
+
+def launches_log_path() -> str:
+    return os.path.join(cache_base(), "launches.log")
+
+def catalog_record_launch(proj:Project) -> None:
+    "Appends one line to the launch log"
+    line = f"{proj.dep_hash}\t{time.time():.3f}\t{os.path.abspath(proj.script)}\n"
+    if line.count('\n') != 1:
+        return
+    try:
+        fd = os.open(launches_log_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    except OSError:
+        return
+    try:
+        os.write(fd, line.encode('utf-8', 'surrogateescape'))
+    finally:
+        os.close(fd)
+
+def open_catalog():
+    "Connects to the catalog, creating it and folding in the launch log"
+    os.makedirs(cache_base(), exist_ok=True)
+    db = sqlite3.connect(catalog_path(), timeout=30)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS envs (
+            dep_hash TEXT PRIMARY KEY, kind TEXT, created REAL, build_seconds REAL,
+            size_bytes INTEGER, last_used REAL, launch_count INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS env_scripts (
+            dep_hash TEXT, script TEXT, PRIMARY KEY (dep_hash, script));
+    """)
+    pending = f"{launches_log_path()}.{os.getpid()}"
+    try:
+        os.rename(launches_log_path(), pending)
+    except OSError:
+        return db
+    with open(pending, encoding='utf-8', errors='surrogateescape') as f, db:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 3:
+                continue
+            (dep_hash, when, script) = fields
+            db.execute("INSERT OR IGNORE INTO envs (dep_hash) VALUES (?)", (dep_hash,))
+            db.execute("UPDATE envs SET launch_count = launch_count + 1, last_used = max(coalesce(last_used, 0), ?) WHERE dep_hash = ?",
+                       (float(when), dep_hash))
+            db.execute("INSERT OR IGNORE INTO env_scripts VALUES (?, ?)", (dep_hash, script))
+    os.unlink(pending)
+    return db
+
+def fold_launch_log() -> None:
+    "Folds the launch log into the catalog, emptying it"
+    if not os.path.exists(launches_log_path()):
+        return
+    try:
+        open_catalog().close()
+    except sqlite3.Error as e:
+        logging.info(f"could not fold the launch log into the catalog: {e}")
+
+def catalog_record_build(proj:Project, build_seconds:float) -> None:
+    try:
+        db = open_catalog()
+        with db:
+            db.execute("INSERT OR REPLACE INTO envs (dep_hash, kind, created, build_seconds, size_bytes, last_used, launch_count) "
+                       "VALUES (?, ?, ?, ?, ?, NULL, 0)",
+                       (proj.dep_hash, proj.kind, time.time(), build_seconds, disk_usage(proj.project_path)))
+            db.execute("INSERT OR IGNORE INTO env_scripts VALUES (?, ?)", (proj.dep_hash, os.path.abspath(proj.script)))
+        db.close()
+    except sqlite3.Error as e:
+        logging.info(f"could not record the build in the catalog: {e}")
+
+def catalog_entries() -> list[dict]:
+    """
+    Catalog rows for the envs in the cache, most recently used first.
+
+    Rows for evicted envs are dropped, and envs built before the catalog
+    existed are added from their manifests.
+    """
+    db = open_catalog()
+    with db:
+        on_disk = {n for n in (os.listdir(cache_base()) if os.path.isdir(cache_base()) else [])
+                   if is_project_dir_name(n) and os.path.exists(os.path.join(cache_base(), n, MANIFEST_NAME))}
+        known = {h for (h,) in db.execute("SELECT dep_hash FROM envs")}
+        for h in known - on_disk:
+            db.execute("DELETE FROM envs WHERE dep_hash = ?", (h,))
+            db.execute("DELETE FROM env_scripts WHERE dep_hash = ?", (h,))
+        for h in on_disk - known:
+            manifest = read_manifest(os.path.join(cache_base(), h)) or {}
+            db.execute("INSERT INTO envs (dep_hash, kind, created, build_seconds) VALUES (?, ?, ?, ?)",
+                       (h, manifest.get('kind'), manifest.get('created'), manifest.get('build_seconds')))
+            if manifest.get('script'):
+                db.execute("INSERT OR IGNORE INTO env_scripts VALUES (?, ?)", (h, manifest['script']))
+        for h in on_disk:
+            db.execute("UPDATE envs SET last_used = ? WHERE dep_hash = ? AND last_used IS NULL",
+                       (last_use(os.path.join(cache_base(), h)), h))
+    db.row_factory = sqlite3.Row
+    entries = []
+    for row in db.execute("SELECT * FROM envs ORDER BY last_used DESC"):
+        entry = dict(row)
+        entry['path'] = os.path.join(cache_base(), row['dep_hash'])
+        entry['scripts'] = [s for (s,) in db.execute("SELECT script FROM env_scripts WHERE dep_hash = ? ORDER BY script", (row['dep_hash'],))]
+        entries.append(entry)
+    db.close()
+    return entries
+
+def human_size(n:Union[int,None]) -> str:
+    if n is None:
+        return "?"
+    for unit in ('B', 'K', 'M', 'G'):
+        if n < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}T"
+
+def human_age(t:Union[float,None]) -> str:
+    if t is None:
+        return "?"
+    secs = time.time() - t
+    for (unit, size) in (('d', 86400), ('h', 3600), ('m', 60)):
+        if secs >= size:
+            return f"{secs / size:.0f}{unit} ago"
+    return "now"
+
+def print_catalog(entries:list[dict]) -> None:
+    if not entries:
+        print("\nThe cache holds no environments.")
+        return
+    print(f"\n{'HASH':12}  {'KIND':5}  {'SIZE':>6}  {'CREATED':>9}  {'LAST USED':>9}  {'LAUNCHES':>8}  {'BUILD':>7}  SCRIPTS")
+    for e in entries:
+        build = f"{e['build_seconds']:.1f}s" if e['build_seconds'] is not None else "?"
+        print(f"{e['dep_hash'][:12]:12}  {e['kind'] or '?':5}  {human_size(e['size_bytes']):>6}  "
+              f"{human_age(e['created']):>9}  {human_age(e['last_used']):>9}  {e['launch_count']:>8}  {build:>7}  "
+              + ", ".join(e['scripts']))
+
+#
+# bulk prepare
+#
+
+def prepare_jobs(kind:str, default:int) -> int:
+    "How many kind envs --prepare builds at once, from PYTHONRUNSCRIPT_PREPARE_<KIND>_JOBS"
+    try:
+        return max(1, int(os.environ.get(f"PYTHONRUNSCRIPT_PREPARE_{kind.upper()}_JOBS", default)))
+    except ValueError:
+        return default
+
+def is_runnable_script(path:str) -> bool:
+    "True for .py files, and for files using pythonrunscript as their interpreter"
+    if path.endswith('.py'):
+        return True
+    try:
+        with open(path, 'rb') as f:
+            first_line = f.readline(256)
+    except OSError:
+        return False
+    return first_line.startswith(b'#!') and b'pythonrunscript' in first_line
+
+def find_scripts(paths:list[str]) -> list[str]:
+    "Scripts named by paths, searching directories recursively, skipping hidden dirs"
+    scripts = []
+    for path in paths:
+        if not os.path.isdir(path):
+            scripts.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            scripts.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                           if is_runnable_script(os.path.join(dirpath, name)))
+    return scripts
+
+def prepare_build(script:str) -> tuple[bool,float]:
+    "Builds script's environment. Runs in a worker process of --prepare"
+    start = time.monotonic()
+    proj = Project.make_project(script, False, False)
+    # build output goes to stderr, keeping stdout for the summary
+    with contextlib.redirect_stdout(sys.stderr):
+        built = ensure_project(proj)
+    return built, round(time.monotonic() - start, 3)
+
+def prepare_scripts(paths:list[str], verbose:bool, as_json:bool) -> bool:
+    """
+    Builds a missing environment for every script under paths, in parallel
+    with separate limits for pip and conda builds, and records each script
+    in the launch index. Prints a summary. False if any script failed.
+    """
+    groups:dict[str,list[Project]] = {}
+    rows = []
+    for script in find_scripts(paths):
+        try:
+            proj = Project.make_project(script, False, False)
+        except Exception as e:
+            rows.append(dict(status="failed", kind="", dep_hash="", scripts=[script], seconds=0, error=str(e)))
+            continue
+        if isinstance(proj, ProjectNoDeps):
+            record_launch_index(proj)
+            rows.append(dict(status="no deps", kind=proj.kind, dep_hash="", scripts=[script], seconds=0))
+        else:
+            groups.setdefault(proj.dep_hash, []).append(proj)
+
+    pools = {"pip": concurrent.futures.ProcessPoolExecutor(prepare_jobs("pip", min(8, os.cpu_count() or 1))),
+             "conda": concurrent.futures.ProcessPoolExecutor(prepare_jobs("conda", 2))}
+    futures = {}
+    try:
+        for dep_hash, projs in groups.items():
+            proj = projs[0]
+            if proj.exists():
+                rows.append(dict(status="cached", kind=proj.kind, dep_hash=dep_hash,
+                                 scripts=[p.script for p in projs], seconds=0))
+            else:
+                if verbose:
+                    print(f"## Building the {proj.kind} environment {dep_hash} for {proj.script}")
+                futures[pools[proj.kind].submit(prepare_build, proj.script)] = projs
+        for future in concurrent.futures.as_completed(futures):
+            projs = futures[future]
+            try:
+                built, seconds = future.result()
+                error = None
+            except Exception as e:
+                built, seconds, error = False, 0, str(e)
+            row = dict(status="built" if built else "failed", kind=projs[0].kind, dep_hash=projs[0].dep_hash,
+                       scripts=[p.script for p in projs], seconds=seconds)
+            if error:
+                row["error"] = error
+            rows.append(row)
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+
+    for row in rows:
+        if row["status"] in ("built", "cached"):
+            for proj in groups[row["dep_hash"]]:
+                record_launch_index(proj)
+    if as_json:
+        print(json.dumps(rows, indent=2))
     else:
+        print_prepare_summary(rows)
+    return all(row["status"] != "failed" for row in rows)
+
+def print_prepare_summary(rows:list[dict]) -> None:
+    counts = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    for row in sorted(rows, key=lambda r: (r["status"], r["scripts"][0])):
+        if row["status"] == "no deps":
+            continue
+        more = f" (+{len(row['scripts']) - 1} more)" if len(row['scripts']) > 1 else ""
+        print(f"{row['status']:<7} {row['seconds']:>8.1f}s  {row['kind']:<6} {row['dep_hash'] or '-':<32}  {row['scripts'][0]}{more}")
+        if "error" in row:
+            print(f"        {row['error']}")
+    print("## " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())) if counts else "## Found no scripts")
+
+
+#
+# build locks
+#
+
+def build_lock_timeout() -> float:
+    "Seconds to wait for another process's build, from PYTHONRUNSCRIPT_BUILD_LOCK_TIMEOUT"
+    try:
+        return float(os.environ.get("PYTHONRUNSCRIPT_BUILD_LOCK_TIMEOUT", 3600))
+    except ValueError:
+        return 3600.0
+
+def locks_base() -> str:
+    return os.path.join(cache_base(), "locks")
+
+def pid_is_alive(pid:int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def lock_host() -> str:
+    "Names this host and pid namespace, within which the pids in lock files mean something"
+    try:
+        namespace = os.readlink("/proc/self/ns/pid")
+    except OSError:
+        namespace = ""
+    return f"{os.uname().nodename}/{namespace}"
+
+class BuildLock:
+    """
+    Exclusive flock on locks/<dep_hash>.lock, held while an environment is built.
+
+    The holder writes its pid and lock_host() into the lock file. If the lock
+    is held but that pid is dead, some orphaned process inherited the lock, so
+    the lock file is unlinked and a fresh one is taken. A holder on another
+    host or in another container sharing the cache cannot be checked, so its
+    lock is only ever released by the kernel.
+    """
+    poll_interval = 0.2
+    report_interval = 10.0
+
+    def __init__(self, dep_hash:str, project_path:str, timeout:Union[float,None]=None):
+        self.path = os.path.join(locks_base(), f"{dep_hash}.lock")
+        self.project_path = project_path
+        self.timeout = build_lock_timeout() if timeout is None else timeout
+        self.fd = -1
+
+    def _holder(self) -> tuple[Union[int,None],bool]:
+        "(pid of the holder, whether it is on this host), or (None, False) if unknown"
+        try:
+            with open(self.path) as f:
+                (pid, _, host) = f.read().strip().partition('\t')
+            return (int(pid or 0) or None, host == lock_host())
+        except (OSError, ValueError):
+            return (None, False)
+
+    def try_acquire(self) -> bool:
+        "Takes the lock if it is free. Does not wait"
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            same_file = os.path.samestat(os.fstat(fd), os.stat(self.path))
+        except FileNotFoundError:
+            same_file = False
+        if not same_file:
+            # the lock file was unlinked as stale after we opened it
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\t{lock_host()}".encode())
+        self.fd = fd
         return True
 
+    def __enter__(self) -> BuildLock:
+        os.makedirs(locks_base(), exist_ok=True)
+        start = last_report = time.monotonic()
+        dead_holder = None
+        while not self.try_acquire():
+            (holder, local) = self._holder()
+            if holder is not None and local and not pid_is_alive(holder):
+                # seen twice in a row, so this is not a new holder yet to write its pid
+                if holder == dead_holder:
+                    logging.info(f"Build lock {self.path} is held for dead pid {holder}. Breaking it")
+                    try:
+                        os.unlink(self.path)
+                    except FileNotFoundError:
+                        pass
+                    dead_holder = None
+                    continue
+                dead_holder = holder
+            else:
+                dead_holder = None
+            now = time.monotonic()
+            if now - start > self.timeout:
+                raise TimeoutError(f"Gave up after {self.timeout:.0f}s waiting for another process (pid {holder}) to build {self.project_path}")
+            if now - last_report >= self.report_interval or last_report == start:
+                print(f"## Waiting for another pythonrunscript process (pid {holder}) to finish building {self.project_path}",file=sys.stderr)
+                last_report = now
+            time.sleep(self.poll_interval)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        os.close(self.fd)
+        self.fd = -1
+
+
+#
+# launch index
+#
+
+# An index entry is a single tab-separated line:
+#   version, realpath, inode, size, mtime_ns, launcher, dep_hash, kind, interpreter
+# It lets an unchanged script skip parse_dependencies() on later launches.
+# launcher is the Python running pythonrunscript, which venvs' dep hashes
+# depend on, so launching with another Python misses.
+LAUNCH_INDEX_VERSION = "2"
+
+def launch_index_dir() -> str:
+    "Directory holding one launch index entry per script"
+    return os.path.join(cache_base(), "launch-index")
+
+def launch_index_path(realpath:str) -> str:
+    "Entry path for a script, named by its escaped realpath to avoid hashing on the warm path"
+    name = realpath.replace('%','%25').replace(os.sep,'%2F')
+    if len(name.encode('utf-8')) > 240:
+        name = hashlib.md5(realpath.encode('utf-8')).hexdigest()
+    return os.path.join(launch_index_dir(), name)
+
+def launch_index_key(script:str) -> Union[tuple[str,str,str,str],None]:
+    "(realpath, inode, size, mtime_ns) for script, or None if it cannot be stat'ed"
+    realpath = os.path.realpath(script)
+    try:
+        st = os.stat(realpath)
+    except OSError:
+        return None
+    return (realpath, str(st.st_ino), str(st.st_size), str(st.st_mtime_ns))
+
+def lookup_launch_index(script:str, verbose:bool) -> Union["Project",None]:
+    "Returns the Project recorded for an unchanged script, or None on any miss"
+    if "PYTHONRUNSCRIPT_NO_LAUNCH_INDEX" in os.environ:
+        return None
+    key = launch_index_key(script)
+    if key is None:
+        return None
+    try:
+        with open(launch_index_path(key[0]), 'r') as f:
+            fields = f.read(4096).rstrip('\n').split('\t')
+    except (OSError, UnicodeDecodeError):
+        return None
+    if len(fields) != 9 or fields[0] != LAUNCH_INDEX_VERSION or tuple(fields[1:6]) != key + (sys.executable,):
+        logging.info(f"Launch index entry for {script} is stale, corrupt, or recorded by another Python")
+        return None
+    (dep_hash, kind, interpreter) = fields[6:9]
+    project_classes = {c.kind: c for c in (ProjectPip, ProjectConda, ProjectNoDeps)}
+    if kind not in project_classes:
+        return None
+    proj = project_classes[kind](script, dep_hash, '', '', '', verbose)
+    if proj.interpreter != interpreter or not proj.exists():
+        logging.info(f"Launch index entry for {script} points to a missing environment")
+        return None
+    return proj
+
+def record_launch_index(proj:"Project") -> None:
+    "Records proj so the next launch of an unchanged script can skip parsing"
+    if "PYTHONRUNSCRIPT_NO_LAUNCH_INDEX" in os.environ:
+        return
+    key = launch_index_key(proj.script)
+    if key is None:
+        return
+    entry = '\t'.join((LAUNCH_INDEX_VERSION,) + key + (sys.executable, proj.dep_hash, proj.kind, proj.interpreter))
+    if '\n' in entry or entry.count('\t') != 8:
+        return
+    path = launch_index_path(key[0])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(launch_index_dir(), exist_ok=True)
+        with open(tmp, 'w') as f:
+            f.write(entry + '\n')
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.info(f"Could not write launch index entry {path}: {e}")
+
+
+#
+# launchers
+#
+
+# A launcher is a small sh script which runs one script in its cached
+# environment without starting pythonrunscript. While the script keeps the
+# mtime it had when the launcher was written, which the launcher checks against
+# a stamp file with the shell's test builtin, a launch costs only the shell and
+# the script's interpreter; the shell records the env's last use itself. Otherwise
+# the launcher runs pythonrunscript, which rewrites it for the script as it is
+# now. A launched script holds no lock on its env, so envs which launchers run
+# are never evicted. The stamp records the launcher, its script and its env.
+LAUNCHER_MARKER = "# pythonrunscript launcher, written by pythonrunscript --install-launcher"
+LAUNCHER_ENV = "PYTHONRUNSCRIPT_LAUNCHER"
+
+def launcher_stamps_dir() -> str:
+    return os.path.join(cache_base(), "launchers")
+
+def launcher_stamp_path(launcher:str) -> str:
+    "Stamp file whose mtime is that of the script when launcher was written"
+    name = hashlib.md5(os.path.abspath(launcher).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(launcher_stamps_dir(), name)
+
+def launcher_destination(script:str, dest:Union[str,None]) -> str:
+    "dest, or a file named after script in the directory dest, or else in ~/.local/bin"
+    name = os.path.splitext(os.path.basename(script))[0]
+    if dest is None:
+        return os.path.join(os.path.expanduser("~"), ".local", "bin", name)
+    if os.path.isdir(dest):
+        return os.path.join(dest, name)
+    return dest
+
+def is_launcher_for(path:str, script:str) -> bool:
+    "True if path is a launcher written for script"
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            head = f.read(4096)
+    except OSError:
+        return False
+    return LAUNCHER_MARKER in head and f"\nscript={shlex.quote(os.path.abspath(script))}\n" in head
+
+def runs_launchers(project_path:str) -> bool:
+    "True if an installed launcher runs the env at project_path"
+    try:
+        stamps = os.listdir(launcher_stamps_dir())
+    except OSError:
+        return False
+    for name in stamps:
+        try:
+            with open(os.path.join(launcher_stamps_dir(), name), encoding='utf-8', errors='surrogateescape') as f:
+                (launcher, script, env) = f.read().split('\0')
+        except (OSError, ValueError):
+            continue
+        if env == project_path and is_launcher_for(launcher, script):
+            return True
+    return False
+
+def activation_shell_lines(activation:list[tuple[str,str,str]]) -> list[str]:
+    "sh commands which apply a captured conda activation"
+    lines = []
+    for (op, k, v) in activation:
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', k):
+            # like bash's exported functions, which sh cannot hold
+            continue
+        if op == 'set':
+            lines.append(f"export {k}={shlex.quote(v)}")
+        elif op == 'prepend':
+            lines.append(f'export {k}={shlex.quote(v)}"${{{k}-}}"')
+        else:
+            lines.append(f"unset {k}")
+    return lines
+
+def write_launcher(proj:Project, path:str) -> bool:
+    """
+    Writes a launcher for proj's script at path, with its stamp. False if path
+    is some other file. A conda env without a captured activation gets a
+    launcher which always runs pythonrunscript.
+    """
+    script = os.path.abspath(proj.script)
+    if os.path.realpath(path) == os.path.realpath(script) or (os.path.exists(path) and not is_launcher_for(path, script)):
+        print(f"## {path} exists and is not a launcher for {script}, so I left it alone",file=sys.stderr)
+        return False
+    path = os.path.abspath(path)
+    stamp = launcher_stamp_path(path)
+    q = shlex.quote
+    fast = [f'[ -x {q(proj.interpreter)} ]', '[ -e "$stamp" ]', '! [ "$script" -nt "$stamp" ]', '! [ "$script" -ot "$stamp" ]']
+    activation:Union[list[tuple[str,str,str]],None] = []
+    if isinstance(proj, ProjectConda):
+        fast.append('[ -z "${PYTHONRUNSCRIPT_CONDA_RUN+set}" ]')
+        activation = read_activation(proj.project_path)
+        if activation is None and not proj.shared and \
+           capture_conda_activation(proj.project_path, proj.envdir, built_with_conda_backend(proj.project_path)):
+            activation = read_activation(proj.project_path)
+    lines = ["#!/bin/sh", LAUNCHER_MARKER,
+             f"# Runs {script} with {proj.interpreter}",
+             f"script={q(script)}", f"stamp={q(stamp)}"]
+    if activation is not None:
+        lines += [f"if {' && '.join(fast)}; then"]
+        if not proj.shared and not isinstance(proj, ProjectNoDeps):
+            # truncating the empty lock file updates its mtime without forking touch;
+            # true, not :, as a failed redirection of a special builtin exits the shell
+            lines += [f"    true 2>/dev/null > {q(os.path.join(proj.project_path, IN_USE_NAME))}"]
+        lines += [f"    {line}" for line in activation_shell_lines(activation)]
+        lines += [f'    exec {q(proj.interpreter)} "$script" "$@"', "fi"]
+    else:
+        logging.info(f"{proj.project_path} has no captured conda activation, so its launcher always runs pythonrunscript")
+    lines += [f"export {LAUNCHER_ENV}={q(path)}",
+              f'exec {q(sys.executable)} {q(os.path.abspath(__file__))} "$script" "$@"']
+
+    st = os.stat(script)
+    os.makedirs(launcher_stamps_dir(), exist_ok=True)
+    with open(stamp, 'w', encoding='utf-8', errors='surrogateescape') as f:
+        f.write('\0'.join([path, script, "" if isinstance(proj, ProjectNoDeps) else proj.project_path]))
+    os.utime(stamp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8', errors='surrogateescape') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.chmod(tmp, 0o755)
+    os.replace(tmp, path)
+    return True
+
+def install_launcher(proj:Project, dest:Union[str,None]) -> bool:
+    "Writes a launcher for proj's script to dest, or by default to ~/.local/bin"
+    path = launcher_destination(proj.script, dest)
+    try:
+        if not write_launcher(proj, path):
+            return False
+    except OSError as e:
+        print(f"## Could not write the launcher {path}: {e}",file=sys.stderr)
+        return False
+    print(f"## Wrote the launcher {path}")
+    if os.path.dirname(os.path.abspath(path)) not in os.environ.get("PATH", "").split(os.pathsep):
+        print(f"## {os.path.dirname(os.path.abspath(path))} is not in your PATH, so run the launcher by its path")
+    return True
+
+def refresh_launcher(proj:Project) -> None:
+    "Rewrites the launcher which fell back to pythonrunscript to run proj, so its next launch is fast"
+    path = os.environ.pop(LAUNCHER_ENV, None)
+    if path is None or not is_launcher_for(path, proj.script):
+        return
+    try:
+        write_launcher(proj, path)
+    except OSError as e:
+        logging.info(f"Could not rewrite the launcher {path}: {e}")
+
 
 #
 # helpers
@@ -550,13 +3017,15 @@ def clean_name_from_path(p):
 
 def print_base_dirs():
     print(f"Cached project directores are in:\n{cache_base()}\n\n")
+    if shared_cache_roots():
+        print(f"Before that cache, these read-only shared caches are searched:\n" + "\n".join(shared_cache_roots()) + "\n\n")
     print(f"Each directory's contains logs and other build artifacts.\n\n")
-    print(f"Trashed and cleaned projects are here, waiting for disposal by the OS:\n{trash_base()}")
+    print(f"Trashed and cleaned projects are here, waiting to be deleted in the background or by --gc:\n{trash_base()}")
 
 
 def trash_base() -> str:
-    "Directory to use for trashing broken project dirs"
-    return os.path.join( tempfile.gettempdir(), "pythonrunscript" )
+    "Directory to use for trashing broken project dirs, on the cache's filesystem"
+    return os.path.join( cache_base(), TRASH_NAME )
 
 def print_python3_path():
     if p := shutil.which('python3'):
@@ -568,17 +3037,35 @@ def cache_base():
     cache_base = None
     if "XDG_CACHE_HOME" in os.environ:
         cache_base = os.environ["XDG_CACHE_HOME"]
-    elif platform.system() == "Darwin":
+    elif sys.platform == "darwin":
         cache_base = os.path.join(os.path.expanduser("~"), "Library", "Caches")
     else:
         cache_base = os.path.join(os.path.expanduser("~"), ".cache")
     cache_base = os.path.join(cache_base, "pythonrunscript")
     return cache_base
 
-def are_dependencies_missing() -> bool:
-    return (platform.system() not in ['Linux','Darwin']
-            and (shutil.which('bash') is None
-                 or shutil.which('tee') is None))
+def shared_cache_roots() -> list[str]:
+    "Read-only caches in PYTHONRUNSCRIPT_CACHE_PATH, searched in order before cache_base()"
+    user = cache_base()
+    return [root for root in os.environ.get("PYTHONRUNSCRIPT_CACHE_PATH", "").split(os.pathsep)
+            if root and os.path.abspath(root) != user]
+
+def find_project_path(dep_hash:str, verbose:bool=False) -> str:
+    """
+    The project dir for dep_hash: in the first shared cache holding a completed
+    env for it, or else in the user cache, which is the only cache ever written to.
+    Costs one stat per shared cache.
+    """
+    for root in shared_cache_roots():
+        path = os.path.join(root, dep_hash)
+        # no logging here: this is on the warm launch path
+        if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            if verbose:
+                print(f"## Found the environment in the shared cache {root}")
+            return path
+        if verbose:
+            print(f"## The environment is not in the shared cache {root}")
+    return os.path.join(cache_base(), dep_hash)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+# Fixtures for hermetic tests of the install paths: a local PEP 503 package
+# index of dummy wheels, a fake conda on PATH, a log of the subprocesses
+# pythonrunscript spawns, and a private cache with envs made to order.
+import os, sys, json, time, hashlib, subprocess
+import pytest
+from tests.dummy_wheels import make_wheel
+from tests.fake_conda import FakeConda
+from pythonrunscript.pythonrunscript import ProjectPip, IN_USE_NAME, cache_base
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# distributions in the local index, as (name, version, requires, source)
+index_wheels = [
+    ("alpha", "1.0", (), ""),
+    ("alpha", "2.0", (), ""),
+    ("beta", "1.0", ("alpha",), ""),
+    ("tqdm", "4.66.4", (), "def tqdm(iterable, *args, **kwargs):\n    return iterable\n"),
+]
+
+class LocalIndex:
+    "A PEP 503 simple index of dummy wheels, served from file:// URLs"
+    def __init__(self, root):
+        self.root = root
+        self.url = f"file://{root}/simple/"
+        files = os.path.join(root, "files")
+        projects = {}
+        for (name, version, requires, source) in index_wheels:
+            projects.setdefault(name, []).append(make_wheel(files, name, version, requires, source=source))
+        for (name, wheels) in projects.items():
+            os.makedirs(os.path.join(root, "simple", name))
+            links = ""
+            for wheel in wheels:
+                with open(wheel, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                links += f'<a href="../../files/{os.path.basename(wheel)}#sha256={digest}">{os.path.basename(wheel)}</a>\n'
+            with open(os.path.join(root, "simple", name, "index.html"), "w") as f:
+                f.write(f"<!DOCTYPE html>\n<html><body>\n{links}</body></html>\n")
+        with open(os.path.join(root, "simple", "index.html"), "w") as f:
+            f.write("<!DOCTYPE html>\n<html><body>\n"
+                    + "".join(f'<a href="{name}/">{name}</a>\n' for name in projects) + "</body></html>\n")
+
+@pytest.fixture(scope="session")
+def local_index(tmp_path_factory) -> LocalIndex:
+    return LocalIndex(str(tmp_path_factory.mktemp("index")))
+
+@pytest.fixture
+def fake_conda(tmp_path, monkeypatch) -> FakeConda:
+    conda = FakeConda(str(tmp_path / "fake-conda"))
+    for (var, value) in conda.environ(os.environ["PATH"]).items():
+        monkeypatch.setenv(var, value)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CONDA_BACKEND", "conda")
+    return conda
+
+# Loaded by every Python process started with it on PYTHONPATH. Logs each
+# subprocess or exec as a JSON line: pid, the event, and the program's argv.
+audit_hook = """\
+import os, sys, json
+def _log_spawns(event, args):
+    if event in ("subprocess.Popen", "os.exec", "os.posix_spawn", "os.system"):
+        argv = [args[0]] if event == "os.system" else args[1]
+        if isinstance(argv, (str, bytes)):
+            argv = [argv]
+        with open(os.environ["SPAWN_LOG"], "a") as f:
+            f.write(json.dumps([os.getpid(), event, [os.fsdecode(a) for a in argv]]) + "\\n")
+if os.environ.get("SPAWN_LOG"):
+    sys.addaudithook(_log_spawns)
+"""
+
+class Launcher:
+    "Runs pythonrunscript's main() in a subprocess, logging the subprocesses it spawns"
+    def __init__(self, root, env):
+        self.root = root
+        self.env = env
+        hooks = os.path.join(root, "hooks")
+        os.makedirs(hooks)
+        with open(os.path.join(hooks, "sitecustomize.py"), "w") as f:
+            f.write(audit_hook)
+        self.env["PYTHONPATH"] = os.pathsep.join([hooks, repo])
+        self.runs = 0
+    def run(self, *args, **env) -> subprocess.CompletedProcess:
+        """
+        Runs pythonrunscript with args. The result's spawned is the argv of each
+        program it started or exec'd, ending with the script when it runs it.
+        """
+        return self.run_program([sys.executable, "-m", "pythonrunscript", *args], **env)
+    def run_program(self, argv:list[str], **env) -> subprocess.CompletedProcess:
+        "Runs argv like run(), logging what its Python processes spawn"
+        self.runs += 1
+        log = os.path.join(self.root, f"spawns-{self.runs}.log")
+        proc = subprocess.Popen(argv, env=dict(self.env, SPAWN_LOG=log, **env),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        (out, err) = proc.communicate(timeout=300)
+        cp = subprocess.CompletedProcess(proc.args, proc.returncode, out, err)
+        with open(log) if os.path.exists(log) else open(os.devnull) as f:
+            spawns = [json.loads(line) for line in f]
+        # programs started by pip and the like log their own pids
+        cp.spawned = [argv for (pid, event, argv) in spawns if pid == proc.pid]
+        return cp
+
+@pytest.fixture
+def launcher(request, tmp_path, local_index) -> Launcher:
+    """
+    A hermetic pythonrunscript, with its own cache, installing pip packages from
+    local_index, and using fake_conda if the test requests it.
+    """
+    env = {k: v for (k, v) in os.environ.items() if not k.startswith(("PYTHONRUNSCRIPT_", "PIP_", "CONDA"))}
+    env.update(XDG_CACHE_HOME=str(tmp_path / "cache"), PIP_INDEX_URL=local_index.url, PIP_CONFIG_FILE=os.devnull,
+               PIP_DISABLE_PIP_VERSION_CHECK="1", PYTHONRUNSCRIPT_PIP_BACKEND="pip")
+    if "fake_conda" in request.fixturenames:
+        conda = request.getfixturevalue("fake_conda")
+        env.update(conda.environ(env["PATH"]), PYTHONRUNSCRIPT_CONDA_BACKEND="conda")
+    return Launcher(str(tmp_path / "launcher"), env)
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    "A private cache under tmp_path, with none of the user's cache settings"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    for var in ("PYTHONRUNSCRIPT_CACHE_MAX_SIZE", "PYTHONRUNSCRIPT_CACHE_MAX_AGE",
+                "PYTHONRUNSCRIPT_TRASH_RATE", "PYTHONRUNSCRIPT_NO_LAUNCH_INDEX"):
+        monkeypatch.delenv(var, raising=False)
+    return tmp_path
+
+def make_env(c:str, mib:int=1, days_ago:float=0) -> ProjectPip:
+    "A published pip env keyed by c * 32, holding mib MiB, last used days_ago"
+    proj = ProjectPip("script.py", c * 32, "tqdm\n", "", "", False)
+    os.makedirs(os.path.join(proj.envdir, "lib"))
+    with open(os.path.join(proj.envdir, "lib", "payload"), "wb") as f:
+        f.write(os.urandom(mib << 20))
+    os.symlink("lib", os.path.join(proj.envdir, "lib64"))
+    proj.publish()
+    open(os.path.join(proj.project_path, IN_USE_NAME), "w").close()
+    t = time.time() - days_ago * 86400
+    os.utime(os.path.join(proj.project_path, IN_USE_NAME), (t, t))
+    return proj
+
+def remaining() -> list[str]:
+    "The first character of the key of each env left in the cache"
+    return sorted(n[0] for n in os.listdir(cache_base()) if len(n) == 32)
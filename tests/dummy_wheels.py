@@ -0,0 +1,38 @@
+# Builds tiny pure-Python wheels on disk, so install paths can be tested offline.
+import os, base64, hashlib, zipfile
+
+def record_hash(data:bytes) -> str:
+    return "sha256=" + base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=").decode()
+
+def make_wheel(wheel_dir, name, version, requires=(), console_scripts=None, payload_bytes=0, source="") -> str:
+    """
+    Writes NAME-VERSION-py3-none-any.whl into wheel_dir and returns its path.
+
+    The wheel has a package NAME with main() printing "NAME VERSION", optional
+    console scripts {script name: 'module:function'}, and optionally a data file
+    of payload_bytes random bytes to make it heavy. source is appended to the
+    package's __init__.py, to stand in for a real package's API.
+    """
+    dist = name.replace("-", "_")
+    dist_info = f"{dist}-{version}.dist-info"
+    files = {
+        f"{dist}/__init__.py": (f"def main():\n    print('{name} {version}')\n" + source).encode(),
+        f"{dist_info}/METADATA": ("Metadata-Version: 2.1\n"
+                                  f"Name: {name}\nVersion: {version}\n"
+                                  + "".join(f"Requires-Dist: {r}\n" for r in requires)).encode(),
+        f"{dist_info}/WHEEL": (b"Wheel-Version: 1.0\nGenerator: dummy_wheels\n"
+                               b"Root-Is-Purelib: true\nTag: py3-none-any\n"),
+    }
+    if payload_bytes:
+        files[f"{dist}/payload.bin"] = os.urandom(payload_bytes)
+    if console_scripts:
+        files[f"{dist_info}/entry_points.txt"] = ("[console_scripts]\n" + "".join(
+            f"{k} = {v}\n" for (k, v) in console_scripts.items())).encode()
+    record = "".join(f"{path},{record_hash(data)},{len(data)}\n" for (path, data) in files.items())
+    files[f"{dist_info}/RECORD"] = (record + f"{dist_info}/RECORD,,\n").encode()
+    os.makedirs(wheel_dir, exist_ok=True)
+    path = os.path.join(wheel_dir, f"{dist}-{version}-py3-none-any.whl")
+    with zipfile.ZipFile(path, "w") as z:
+        for (p, data) in files.items():
+            z.writestr(p, data)
+    return path
@@ -0,0 +1,51 @@
+# A scripted conda, so conda install paths can be tested and benchmarked
+# without conda.
+import os, sys
+
+# Logs its argv, sleeps FAKE_CONDA_STARTUP seconds if set, then fakes each command:
+# - `create ... --prefix P` and `env create ... --prefix P` make P a venv of
+#   FAKE_CONDA_PYTHON which sees its packages, including pip, with one conda-meta record
+# - `install ... --prefix P` and other `env` commands do nothing
+# - `run -p P --no-capture-output CMD...` runs CMD, activated, sourcing the
+#   scripts in P/etc/conda/activate.d
+fake_conda_script = """\
+#!/bin/sh
+echo "$*" >> "$FAKE_CONDA_LOG"
+[ -n "$FAKE_CONDA_STARTUP" ] && sleep "$FAKE_CONDA_STARTUP"
+case "$1" in
+    create|env)
+        [ "$1" = env ] && [ "$2" != create ] && exit 0
+        for prefix; do :; done
+        "$FAKE_CONDA_PYTHON" -m venv --without-pip --system-site-packages "$prefix" || exit 1
+        mkdir -p "$prefix/conda-meta"
+        echo '{"name": "zlib", "version": "1.3", "build": "h0_1", "subdir": "linux-64",
+               "channel": "https://conda.anaconda.org/conda-forge/linux-64"}' > "$prefix/conda-meta/zlib-1.3-h0_1.json"
+        ;;
+    run)
+        export CONDA_PREFIX="$3"; export PATH="$3/bin:$PATH"
+        for script in "$3"/etc/conda/activate.d/*.sh; do
+            [ -e "$script" ] && . "$script"
+        done
+        shift 4; exec "$@" ;;
+esac
+exit 0
+"""
+
+class FakeConda:
+    "A scripted conda in root/bin which records how it was called"
+    def __init__(self, root):
+        self.log = os.path.join(root, "conda.log")
+        self.bindir = os.path.join(root, "bin")
+        os.makedirs(self.bindir)
+        with open(os.path.join(self.bindir, "conda"), "w") as f:
+            f.write(fake_conda_script)
+        os.chmod(os.path.join(self.bindir, "conda"), 0o755)
+    def environ(self, path:str) -> dict:
+        "The variables which put this conda ahead of path and configure it"
+        return dict(PATH=f"{self.bindir}{os.pathsep}{path}", FAKE_CONDA_LOG=self.log, FAKE_CONDA_PYTHON=sys.executable)
+    def calls(self) -> list[list[str]]:
+        "argv of each call, without the program name"
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return [line.split() for line in f.read().splitlines()]
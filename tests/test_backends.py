@@ -0,0 +1,72 @@
+import os, sys
+import pytest
+from pythonrunscript.pythonrunscript import (ProjectConda, ProjectPip, activation_path,
+                                             conda_activated_environ, ensure_project, read_manifest)
+from tests.dummy_wheels import make_wheel
+
+# stubs which log their argv, then do the job with the venv module and pip
+fake_uv = """\
+#!/bin/sh
+echo "uv $*" >> "$STUB_LOG"
+if [ "$1" = venv ]; then
+    exec "$5" -m venv "$6"
+fi
+interpreter=$4
+shift 4
+exec "$interpreter" -m pip install "$@"
+"""
+
+# a prefix whose python3 is this test's interpreter
+fake_micromamba = """\
+#!/bin/sh
+echo "micromamba $*" >> "$STUB_LOG"
+case "$1" in
+    create) eval prefix=\\${$#}; mkdir -p "$prefix/bin"; ln -s "$STUB_PYTHON" "$prefix/bin/python3" ;;
+    env) echo "name: stub" ;;
+    run) export CONDA_PREFIX="$3"; shift 3; exec "$@" ;;
+esac
+"""
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    bindir = tmp_path / "stubs"
+    bindir.mkdir()
+    for (name, text) in (("uv", fake_uv), ("micromamba", fake_micromamba)):
+        (bindir / name).write_text(text)
+        (bindir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("STUB_LOG", str(tmp_path / "stub.log"))
+    monkeypatch.setenv("STUB_PYTHON", sys.executable)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("PYTHONRUNSCRIPT_NO_WHEELHOUSE", "1")
+    for var in ("PYTHONRUNSCRIPT_PIP_BACKEND", "PYTHONRUNSCRIPT_CONDA_BACKEND"):
+        monkeypatch.delenv(var, raising=False)
+    make_wheel(tmp_path / "index", "alpha", "1.0")
+    return tmp_path
+
+def stub_calls(tmp_path):
+    log = tmp_path / "stub.log"
+    return [line.split()[:3] for line in log.read_text().splitlines()] if log.exists() else []
+
+def pip_project(tmp_path):
+    return ProjectPip("script.py", "a" * 32, f"--no-index\n--find-links {tmp_path / 'index'}\nalpha\n", "", "", False)
+
+def test_uv_is_preferred(stubs):
+    proj = pip_project(stubs)
+    assert ensure_project(proj)
+    assert read_manifest(proj.project_path)["backends"] == {"pip": "uv"}
+    assert stub_calls(stubs) == [["uv", "venv", "--quiet"], ["uv", "pip", "install"]]
+
+def test_backend_override(stubs, monkeypatch):
+    monkeypatch.setenv("PYTHONRUNSCRIPT_PIP_BACKEND", "pip")
+    proj = pip_project(stubs)
+    assert ensure_project(proj)
+    assert read_manifest(proj.project_path)["backends"] == {"pip": "pip"}
+    assert stub_calls(stubs) == []
+
+def test_micromamba_builds_and_activates(stubs):
+    proj = ProjectConda("script.py", "c" * 32, "", "python=3.11\n", "", False)
+    assert ensure_project(proj)
+    assert read_manifest(proj.project_path)["backends"] == {"conda": "micromamba"}
+    assert [c[:2] for c in stub_calls(stubs)] == [["micromamba", "create"], ["micromamba", "run"]]
+    assert conda_activated_environ(proj.project_path)["CONDA_PREFIX"] == proj.envdir
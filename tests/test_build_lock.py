@@ -0,0 +1,97 @@
+import os, sys, subprocess, textwrap, time
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a ProjectPip whose create() just records that it ran
+fake_build = """
+import os, sys, time
+from pythonrunscript.pythonrunscript import ProjectPip, ensure_project
+class FakeBuild(ProjectPip):
+    def create(self):
+        with open(os.environ["BUILD_LOG"], "a") as f:
+            f.write(f"{os.getpid()}\\n")
+        time.sleep(float(os.environ.get("BUILD_SECONDS", "0.5")))
+        os.makedirs(self.project_path)
+        return True
+proj = FakeBuild("script.py", "stresshash", "tqdm\\n", "", "", False)
+"""
+
+@pytest.fixture
+def env(tmp_path):
+    return dict(os.environ, PYTHONPATH=repo, XDG_CACHE_HOME=str(tmp_path / "cache"),
+                BUILD_LOG=str(tmp_path / "builds.log"))
+
+def spawn(code, env):
+    return subprocess.Popen([sys.executable, "-c", fake_build + textwrap.dedent(code)], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def builds(env):
+    with open(env["BUILD_LOG"]) as f:
+        return f.read().split()
+
+def test_concurrent_launches_build_once(env):
+    procs = [spawn("sys.exit(0 if ensure_project(proj) else 1)", env) for _ in range(16)]
+    assert [p.wait(timeout=60) for p in procs] == [0] * 16
+    assert len(builds(env)) == 1
+    waited = [p for p in procs if "Waiting for another pythonrunscript process" in p.stderr.read()]
+    assert len(waited) >= 1
+
+def test_timeout(env):
+    holder = spawn("ensure_project(proj)", dict(env, BUILD_SECONDS="30"))
+    while not os.path.exists(env["BUILD_LOG"]):
+        time.sleep(0.05)
+    waiter = spawn("sys.exit(0 if ensure_project(proj) else 1)", dict(env, PYTHONRUNSCRIPT_BUILD_LOCK_TIMEOUT="0.5"))
+    try:
+        assert waiter.wait(timeout=30) == 1
+        assert "Gave up after" in waiter.stderr.read()
+    finally:
+        holder.kill()
+
+def test_crashed_builder_releases_lock(env):
+    crasher = spawn("ensure_project(proj)", dict(env, BUILD_SECONDS="30"))
+    while not os.path.exists(env["BUILD_LOG"]) or not builds(env):
+        time.sleep(0.05)
+    crasher.kill()
+    crasher.wait()
+    assert spawn("sys.exit(0 if ensure_project(proj) else 1)", env).wait(timeout=30) == 0
+    assert len(builds(env)) == 2
+
+def test_stale_lock_held_by_orphan(env):
+    # the lock's owner exits, leaving the lock fd to a surviving child process
+    orphaner = spawn("""
+        from pythonrunscript.pythonrunscript import BuildLock
+        lock = BuildLock(proj.dep_hash, proj.project_path).__enter__()
+        import subprocess
+        print(subprocess.Popen(["sleep", "30"], pass_fds=[lock.fd]).pid, flush=True)
+        os._exit(0)
+    """, env)
+    orphan = int(orphaner.stdout.readline())
+    orphaner.wait(timeout=30)
+    try:
+        start = time.monotonic()
+        assert spawn("sys.exit(0 if ensure_project(proj) else 1)", env).wait(timeout=30) == 0
+        assert time.monotonic() - start < 10
+        assert len(builds(env)) == 1
+    finally:
+        os.kill(orphan, 9)
+
+@pytest.mark.parametrize("record", [r"999999999", r"999999999\tother-host/pid:[1]"])
+def test_lock_held_on_another_host_is_not_broken(env, record):
+    # the pid recorded by a holder in another container means nothing here
+    holder = spawn(f"""
+        from pythonrunscript.pythonrunscript import BuildLock
+        lock = BuildLock(proj.dep_hash, proj.project_path).__enter__()
+        os.ftruncate(lock.fd, 0)
+        os.pwrite(lock.fd, b"{record}", 0)
+        print("locked", flush=True)
+        time.sleep(30)
+    """, env)
+    assert holder.stdout.readline() == "locked\n"
+    try:
+        waiter = spawn("sys.exit(0 if ensure_project(proj) else 1)", dict(env, PYTHONRUNSCRIPT_BUILD_LOCK_TIMEOUT="2"))
+        assert waiter.wait(timeout=30) == 1
+        assert "Gave up after" in waiter.stderr.read()
+        assert not os.path.exists(env["BUILD_LOG"])
+    finally:
+        holder.kill()
@@ -0,0 +1,57 @@
+import os, json, subprocess, sys
+from pythonrunscript.pythonrunscript import ProjectPip, ensure_project, catalog_entries, collect_garbage
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class FakeBuild(ProjectPip):
+    def create(self):
+        os.makedirs(self.envdir)
+        with open(os.path.join(self.envdir, "payload"), "wb") as f:
+            f.write(b"x" * 100_000)
+        return True
+
+def test_build_and_launches_are_recorded(cache):
+    a = FakeBuild(str(cache / "a.py"), "a" * 32, "tqdm\n", "", "", False)
+    b = FakeBuild(str(cache / "b.py"), "a" * 32, "tqdm\n", "", "", False)
+    assert ensure_project(a)
+    [entry] = catalog_entries()
+    assert (entry["dep_hash"], entry["kind"], entry["launch_count"]) == (a.dep_hash, "pip", 0)
+    assert entry["size_bytes"] >= 100_000 and entry["build_seconds"] >= 0
+    for p in (a, b, b):
+        p.mark_in_use()
+    [entry] = catalog_entries()
+    assert entry["launch_count"] == 3
+    assert entry["scripts"] == [str(cache / "a.py"), str(cache / "b.py")]
+
+def test_catalog_follows_the_cache(cache, monkeypatch):
+    old = FakeBuild("old.py", "b" * 32, "tqdm\n", "", "", False)
+    ensure_project(old)
+    os.unlink(os.path.join(cache, "cache", "pythonrunscript", "catalog.sqlite3"))
+    # envs built before the catalog existed are picked up from their manifests
+    [entry] = catalog_entries()
+    assert (entry["dep_hash"], entry["scripts"]) == (old.dep_hash, [os.path.abspath("old.py")])
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_MAX_AGE", "0s")
+    collect_garbage()
+    assert catalog_entries() == []
+
+def test_gc_folds_the_launch_log(cache):
+    a = FakeBuild("a.py", "a" * 32, "tqdm\n", "", "", False)
+    ensure_project(a)
+    for _ in range(3):
+        a.mark_in_use()
+    log = os.path.join(cache, "cache", "pythonrunscript", "launches.log")
+    assert os.path.getsize(log) > 0
+    collect_garbage()
+    assert not os.path.exists(log)
+    [entry] = catalog_entries()
+    assert entry["launch_count"] == 3
+
+def test_show_cache_json(cache):
+    ensure_project(FakeBuild("c.py", "c" * 32, "tqdm\n", "", "", False))
+    env = dict(os.environ, PYTHONPATH=repo)
+    out = subprocess.run([sys.executable, "-m", "pythonrunscript", "--show-cache", "--json"], env=env,
+                         capture_output=True, text=True, check=True).stdout
+    assert [e["dep_hash"] for e in json.loads(out)] == ["c" * 32]
+    table = subprocess.run([sys.executable, "-m", "pythonrunscript", "--show-cache"], env=env,
+                           capture_output=True, text=True, check=True).stdout
+    assert "cccccccccccc  pip" in table
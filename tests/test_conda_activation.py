@@ -0,0 +1,65 @@
+import os, sys, subprocess, textwrap
+import pytest
+from pythonrunscript.pythonrunscript import (ProjectConda, activation_path,
+                                             capture_conda_activation, conda_activated_environ)
+
+@pytest.fixture
+def conda_project(tmp_path, monkeypatch, cache, fake_conda):
+    monkeypatch.setenv("UNSET_BY_ACTIVATE", "1")
+    monkeypatch.delenv("PYTHONRUNSCRIPT_CONDA_RUN", raising=False)
+    script = tmp_path / "script.py"
+    script.write_text("import os, sys\nprint(os.environ['CONDA_PREFIX'], os.environ.get('FROM_ACTIVATE_D'), sys.argv[1:])\n")
+    proj = ProjectConda(str(script), "abc", "", "python=3.11\n", "", False)
+    os.makedirs(os.path.join(proj.envdir, "bin"))
+    os.symlink(sys.executable, proj.interpreter)
+    activate_d = os.path.join(proj.envdir, "etc", "conda", "activate.d")
+    os.makedirs(activate_d)
+    with open(os.path.join(activate_d, "test.sh"), "w") as f:
+        f.write("export FROM_ACTIVATE_D=1\nunset UNSET_BY_ACTIVATE\n")
+    return proj
+
+def test_capture_and_apply(conda_project, fake_conda):
+    assert capture_conda_activation(conda_project.project_path, conda_project.envdir)
+    env = conda_activated_environ(conda_project.project_path)
+    assert env["CONDA_PREFIX"] == conda_project.envdir
+    assert env["FROM_ACTIVATE_D"] == "1"
+    assert env["PATH"] == f"{conda_project.envdir}/bin{os.pathsep}{os.environ['PATH']}"
+    assert "UNSET_BY_ACTIVATE" not in env
+    assert len(fake_conda.calls()) == 1
+
+def test_prepend_follows_current_path(conda_project, monkeypatch):
+    capture_conda_activation(conda_project.project_path, conda_project.envdir)
+    monkeypatch.setenv("PATH", "/somewhere/else")
+    assert conda_activated_environ(conda_project.project_path)["PATH"] == f"{conda_project.envdir}/bin{os.pathsep}/somewhere/else"
+
+@pytest.mark.parametrize("content", ["", "version\t0", "version\t1\0bogus\tX=1"])
+def test_bad_activation_file(conda_project, content):
+    with open(activation_path(conda_project.project_path), 'w') as f:
+        f.write(content)
+    assert conda_activated_environ(conda_project.project_path) is None
+
+def run_project(proj, *args):
+    code = textwrap.dedent(f"""
+        from pythonrunscript.pythonrunscript import ProjectConda
+        ProjectConda({proj.script!r}, "abc", "", "python=3.11\\n", "", False).run({list(args)!r})
+    """)
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+def test_run_execs_directly(conda_project, fake_conda):
+    capture_conda_activation(conda_project.project_path, conda_project.envdir)
+    calls = len(fake_conda.calls())
+    out = run_project(conda_project, "-version", "a b")
+    assert out.strip() == f"{conda_project.envdir} 1 ['-version', 'a b']"
+    assert len(fake_conda.calls()) == calls
+
+def test_run_captures_once_for_existing_envs(conda_project, fake_conda):
+    run_project(conda_project)
+    run_project(conda_project)
+    assert len(fake_conda.calls()) == 1
+
+def test_conda_run_fallback(conda_project, fake_conda, monkeypatch):
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CONDA_RUN", "1")
+    out = run_project(conda_project, "-version", "a b")
+    assert out.strip() == f"{conda_project.envdir} 1 ['-version', 'a b']"
+    assert [c[:4] for c in fake_conda.calls()] == [["run", "-p", conda_project.envdir, "--no-capture-output"]]
+    assert [f for f in os.listdir(conda_project.envdir) if f.startswith("exec_script")] == []
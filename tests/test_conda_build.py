@@ -0,0 +1,15 @@
+import pytest
+from pythonrunscript.pythonrunscript import setup_conda_prefix, Log
+
+@pytest.mark.parametrize("envyml,specs,first_call", [
+    ("", "zlib\n", ["create", "--quiet"]),
+    ("dependencies:\n  - zlib\n", "", ["env", "create"]),
+])
+def test_one_conda_solve_per_build(tmp_path, fake_conda, envyml, specs, first_call):
+    proj = tmp_path / "proj"
+    proj.mkdir()
+    assert setup_conda_prefix(str(proj), str(proj / "condaenv"), envyml, specs, "", Log.SILENT)
+    assert [c[:2] for c in fake_conda.calls()] == [first_call, ["run", "-p"]]
+    exported = (proj / "exported-environment.yml").read_text()
+    assert exported == ("name: condaenv\nchannels:\n  - conda-forge\ndependencies:\n  - zlib=1.3=h0_1\n"
+                        f"prefix: {proj / 'condaenv'}\n")
@@ -0,0 +1,70 @@
+import os, sys
+import pytest
+from pythonrunscript.pythonrunscript import (Project, ProjectPip, dep_hash, legacy_dep_hash,
+                                             parse_dependencies, read_manifest, write_manifest)
+
+def hash_of(tmp_path, text):
+    script = tmp_path / "script.py"
+    script.write_text(text)
+    return parse_dependencies(str(script))[0]
+
+def reqs_block(*lines):
+    return "# /// pythonrunscript-requirements-txt\n" + "".join(f"# {l}\n" for l in lines) + "# ///\n"
+
+equivalent = [
+    reqs_block("requests<3", "rich"),
+    reqs_block("rich", "requests<3"),
+    reqs_block("Rich   ", "# the http client", "requests <3 # pinned", "rich"),
+    '# /// script\n# dependencies = ["requests<3", "rich"]\n# ///\n',
+]
+
+def test_equivalent_blocks_share_a_hash(tmp_path):
+    assert len({hash_of(tmp_path, text) for text in equivalent}) == 1
+
+@pytest.mark.parametrize("a,b", [
+    (["foo_bar>=1,<2"], ["Foo-Bar <2, >=1"]),
+    (["foo[b,a]"], ["foo[A, B]"]),
+])
+def test_pip_names_and_specifiers_are_canonical(a, b):
+    assert dep_hash("\n".join(a), "", "") == dep_hash("\n".join(b), "", "")
+
+@pytest.mark.parametrize("a,b", [
+    (["requests<3"], ["requests<4"]),
+    (["requests"], ["requests[socks]"]),
+    (["--index-url https://a"], ["--index-url https://b"]),
+])
+def test_different_requirements_differ(a, b):
+    assert dep_hash("\n".join(a), "", "") != dep_hash("\n".join(b), "", "")
+
+def test_conda_specs_keep_underscores():
+    assert dep_hash("", "", "typing_extensions\n") != dep_hash("", "", "typing-extensions\n")
+    assert dep_hash("", "", "NumPy=1.26\nscipy\n") == dep_hash("", "", "scipy\nnumpy=1.26\n")
+
+def test_interpreter_is_part_of_pip_keys(monkeypatch):
+    before = dep_hash("rich\n", "", "")
+    monkeypatch.setattr(sys.implementation, "cache_tag", "cpython-399")
+    assert dep_hash("rich\n", "", "") != before
+
+def legacy_env(cache, reqs, **manifest):
+    "A built venv keyed by the legacy hash, using this interpreter"
+    proj = ProjectPip("script.py", legacy_dep_hash(reqs, "", ""), reqs, "", "", False)
+    os.makedirs(os.path.dirname(proj.interpreter))
+    os.symlink(sys.executable, proj.interpreter)
+    proj.publish()
+    write_manifest(proj.project_path, dict(read_manifest(proj.project_path), **manifest))
+    return proj
+
+def test_legacy_environment_is_used_until_evicted(cache):
+    text = reqs_block("rich")
+    legacy = legacy_env(cache, "rich\n")
+    script = cache / "script.py"
+    script.write_text(text)
+    assert Project.make_project(str(script), False, False).dep_hash == legacy.dep_hash
+    os.rename(legacy.project_path, legacy.project_path + ".evicted")
+    assert Project.make_project(str(script), False, False).dep_hash == hash_of(cache, text)
+
+def test_legacy_environment_for_other_platform_is_ignored(cache):
+    legacy = legacy_env(cache, "rich\n", platform="plan9-mips")
+    script = cache / "script.py"
+    script.write_text(reqs_block("rich"))
+    assert Project.make_project(str(script), False, False).dep_hash != legacy.dep_hash
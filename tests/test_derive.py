@@ -0,0 +1,57 @@
+import os, shutil, subprocess
+import pytest
+from pythonrunscript.pythonrunscript import ProjectPip, ensure_project, read_manifest
+from tests.dummy_wheels import make_wheel
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("PYTHONRUNSCRIPT_NO_WHEELHOUSE", "1")
+    monkeypatch.delenv("PYTHONRUNSCRIPT_NO_DERIVE", raising=False)
+    wh = tmp_path / "index"
+    make_wheel(wh, "alpha", "1.0", payload_bytes=1 << 20)
+    make_wheel(wh, "delta", "1.0")
+    make_wheel(wh, "beta", "2.0", requires=["delta"], console_scripts={"beta-cli": "beta:main"})
+    make_wheel(wh, "beta", "3.0")
+    make_wheel(wh, "gamma", "1.0")
+    return wh
+
+def build(index, name, *reqs):
+    proj = ProjectPip("script.py", name * 32, "\n".join(["--no-index", f"--find-links {index}", *reqs]) + "\n", "", "", False)
+    assert ensure_project(proj)
+    return proj
+
+def freeze(proj):
+    out = subprocess.run([proj.interpreter, "-m", "pip", "freeze"], capture_output=True, text=True, check=True).stdout
+    return out.split()
+
+def payload(proj):
+    [sp] = (os.path.join(proj.envdir, "lib", d, "site-packages") for d in os.listdir(os.path.join(proj.envdir, "lib")))
+    return os.stat(os.path.join(sp, "alpha", "payload.bin"))
+
+def test_derive_adds_and_removes_only_the_difference(index):
+    a = build(index, "a", "alpha", "beta==2.0")
+    b = build(index, "b", "alpha", "beta==3.0", "gamma")
+    assert read_manifest(b.project_path)["derived_from"] == a.dep_hash
+    assert freeze(b) == ["alpha==1.0", "beta==3.0", "gamma==1.0"]
+    assert payload(b).st_ino == payload(a).st_ino
+    # the source env is untouched
+    assert freeze(a) == ["alpha==1.0", "beta==2.0", "delta==1.0"]
+    out = subprocess.run([os.path.join(a.envdir, "bin", "beta-cli")], capture_output=True, text=True).stdout
+    assert out == "beta 2.0\n"
+    with open(os.path.join(b.envdir, "pyvenv.cfg")) as f:
+        assert a.envdir not in f.read()
+
+def test_unrelated_requirements_build_from_scratch(index):
+    build(index, "a", "alpha")
+    c = build(index, "c", "gamma")
+    assert "derived_from" not in read_manifest(c.project_path)
+
+def test_failed_derive_falls_back_to_clean_build(index):
+    a = build(index, "a", "alpha")
+    # a source env without pip makes the derived build fail
+    [pip] = (os.path.join(a.envdir, "lib", d, "site-packages", "pip") for d in os.listdir(os.path.join(a.envdir, "lib")))
+    shutil.rmtree(pip)
+    b = build(index, "b", "alpha", "gamma")
+    assert "derived_from" not in read_manifest(b.project_path)
+    assert freeze(b) == ["alpha==1.0", "gamma==1.0"]
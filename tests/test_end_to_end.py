@@ -0,0 +1,125 @@
+import os
+import pytest
+
+pip_script = """\
+# /// pythonrunscript-requirements-txt
+# beta
+# ///
+import alpha, beta, sys
+print(alpha.__file__.startswith(sys.prefix))
+"""
+
+conda_specs_script = """\
+# /// pythonrunscript-conda-install-specs-txt
+# python=3.11
+# ///
+# /// pythonrunscript-requirements-txt
+# alpha==1.0
+# ///
+import alpha, os, sys
+print(os.environ["CONDA_PREFIX"] == sys.prefix)
+"""
+
+conda_yml_script = """\
+# /// pythonrunscript-environment-yml
+# dependencies:
+#   - python=3.11
+# ///
+import os, sys
+print(os.environ["CONDA_PREFIX"] == sys.prefix)
+"""
+
+def steps(cp, script) -> list[str]:
+    "The programs pythonrunscript ran, named briefly"
+    names = []
+    for argv in cp.spawned:
+        if argv[-1] == str(script):
+            names.append("script")
+        elif os.path.basename(argv[0]) == "conda":
+            names.append(f"conda {argv[1]}")
+        elif argv[1:3] == ["-m", "venv"]:
+            names.append("venv")
+        elif argv[1:3] == ["-m", "pip"]:
+            names.append(f"pip {argv[3]}")
+        elif argv[-1] == "--empty-trash":
+            names.append("empty trash")
+        else:
+            names.append(os.path.basename(argv[0]))
+    return names
+
+def write(tmp_path, text):
+    script = tmp_path / "script.py"
+    script.write_text(text)
+    return script
+
+def test_nodeps_script_is_execed(tmp_path, launcher):
+    script = write(tmp_path, "print(True)\n")
+    cp = launcher.run(str(script))
+    assert (cp.returncode, cp.stdout) == (0, "True\n")
+    assert steps(cp, script) == ["script"]
+
+def test_pip_script(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    cp = launcher.run(str(script))
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert steps(cp, script) == ["venv", "pip install", "pip wheel", "pip list", "script"]
+    cp = launcher.run(str(script))
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert steps(cp, script) == ["script"]
+
+@pytest.mark.parametrize("text,build", [
+    (conda_specs_script, ["conda create", "pip install", "pip wheel", "pip list", "conda run", "script"]),
+    (conda_yml_script, ["conda env", "conda run", "script"]),
+])
+def test_conda_script(tmp_path, fake_conda, launcher, text, build):
+    script = write(tmp_path, text)
+    cp = launcher.run(str(script))
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert steps(cp, script) == build
+    assert [c[0] for c in fake_conda.calls()] == [build[0].split()[1], "run"]
+    cp = launcher.run(str(script))
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert steps(cp, script) == ["script"]
+
+def test_conda_run(tmp_path, fake_conda, launcher):
+    script = write(tmp_path, conda_specs_script)
+    assert launcher.run(str(script)).returncode == 0
+    cp = launcher.run(str(script), PYTHONRUNSCRIPT_CONDA_RUN="1")
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert [argv[:2] for argv in cp.spawned] == [["conda", "run"]]
+
+def test_failed_install(tmp_path, launcher):
+    script = write(tmp_path, pip_script.replace("# beta", "# gamma"))
+    cp = launcher.run(str(script))
+    assert cp.returncode == 1
+    assert "Creating a managed environment failed" in cp.stderr
+    assert steps(cp, script) == ["venv", "pip install", "empty trash"]
+    cache = tmp_path / "cache" / "pythonrunscript"
+    assert [n for n in os.listdir(cache) if len(n) == 32] == []
+
+def test_dry_run_spawns_nothing(tmp_path, fake_conda, launcher):
+    script = write(tmp_path, conda_specs_script)
+    cp = launcher.run("--dry-run", str(script))
+    assert cp.returncode == 0, cp.stderr
+    assert cp.spawned == []
+    assert fake_conda.calls() == []
+
+settings_script = """\
+import os
+print(sorted((k, v) for (k, v) in os.environ.items() if k.startswith("PYTHONRUNSCRIPT_")))
+"""
+
+@pytest.mark.parametrize("header", ["", conda_yml_script.split("import")[0]], ids=["nodeps", "conda"])
+@pytest.mark.parametrize("flags,environ", [
+    (["--offline"], {}),
+    (["--offline"], dict(PYTHONRUNSCRIPT_OFFLINE="0")),
+    (["--offline"], dict(PYTHONRUNSCRIPT_CONDA_RUN="1")),
+    (["--pip-backend", "uv", "--conda-backend", "micromamba"], {}),
+    (["--in-process"], {}),
+])
+def test_command_line_settings_stay_out_of_the_script(tmp_path, fake_conda, launcher, header, flags, environ):
+    script = write(tmp_path, header + settings_script)
+    expected = launcher.run(str(script), **environ)
+    assert expected.returncode == 0, expected.stderr
+    cp = launcher.run(*flags, str(script), **environ)
+    assert (cp.returncode, cp.stdout) == (0, expected.stdout), cp.stderr
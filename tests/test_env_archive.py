@@ -0,0 +1,106 @@
+import io, json, os, shutil, subprocess, sys, tarfile
+import pytest
+from tests.dummy_wheels import make_wheel
+from pythonrunscript.pythonrunscript import replace_prefix_in_file
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def script(tmp_path):
+    make_wheel(tmp_path / "index", "alpha", "1.0", console_scripts={"alpha-cli": "alpha:main"})
+    path = tmp_path / "script.py"
+    path.write_text("# /// pythonrunscript-requirements-txt\n# --no-index\n"
+                    f"# --find-links {tmp_path / 'index'}\n# alpha\n# ///\nimport alpha\nalpha.main()\n")
+    return path
+
+def cli(cache, *args):
+    env = dict(os.environ, PYTHONPATH=repo, XDG_CACHE_HOME=str(cache), PYTHONRUNSCRIPT_NO_WHEELHOUSE="1")
+    return subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", *map(str, args)],
+                          env=env, capture_output=True, text=True)
+
+@pytest.mark.parametrize("suffix", [".tar.gz", ".tar",
+    pytest.param(".tar.zst", marks=pytest.mark.skipif(not shutil.which("zstd"), reason="needs zstd"))])
+def test_export_then_import_elsewhere(tmp_path, script, suffix):
+    archive = tmp_path / f"env{suffix}"
+    assert cli(tmp_path / "node1", "--export-env", "-o", archive, script).returncode == 0
+    other = tmp_path / "second-node-with-a-longer-path"
+    cp = cli(other, "--import-env", archive)
+    assert cp.returncode == 0, cp.stderr
+    [dep_hash] = [n for n in os.listdir(other / "pythonrunscript") if len(n) == 32]
+    venv = other / "pythonrunscript" / dep_hash / "venv"
+    assert str(tmp_path / "node1") not in (venv / "pyvenv.cfg").read_text()
+    out = subprocess.run([str(venv / "bin" / "alpha-cli")], capture_output=True, text=True).stdout
+    assert out == "alpha 1.0\n"
+    # the imported env is used without building
+    cp = cli(other, script)
+    assert cp.stdout == "alpha 1.0\n"
+    with open(other / "pythonrunscript" / dep_hash / "manifest.json") as f:
+        assert "imported" in json.load(f)
+
+def test_import_refuses_other_platform(tmp_path, script):
+    archive = tmp_path / "env.tar"
+    assert cli(tmp_path / "node1", "--export-env", "-o", archive, script).returncode == 0
+    tampered = tmp_path / "tampered.tar"
+    with tarfile.open(archive) as src, tarfile.open(tampered, "w") as dst:
+        for member in src:
+            data = src.extractfile(member) if member.isreg() else None
+            if member.name == "pythonrunscript-archive.json":
+                header = json.load(data)
+                header["platform"] = "plan9-mips"
+                data = io.BytesIO(json.dumps(header).encode())
+                member.size = len(data.getvalue())
+            dst.addfile(member, data)
+    cp = cli(tmp_path / "node2", "--import-env", tampered)
+    assert cp.returncode == 1
+    assert "built for plan9-mips" in cp.stderr
+    assert [n for n in os.listdir(tmp_path / "node2" / "pythonrunscript") if not n.startswith(".")] == []
+
+def test_binary_prefix_is_padded(tmp_path):
+    path = tmp_path / "lib.so"
+    path.write_bytes(b"\x7fELF\0/old/long/prefix/lib\0-I/old/long/prefix/a -I/old/long/prefix/b\0rest")
+    replace_prefix_in_file(str(path), b"/old/long/prefix", b"/new/p", binary=True)
+    assert path.read_bytes() == (b"\x7fELF\0/new/p/lib" + b"\0" * 10 + b"\0-I/new/p/a -I/new/p/b"
+                                 + b"\0" * 20 + b"\0rest")
+    with pytest.raises(ValueError):
+        replace_prefix_in_file(str(path), b"/new/p", b"/much/longer/prefix", binary=True)
+
+@pytest.mark.parametrize("members", [
+    [("esc", "symlink", "{outside}"), ("esc/file", "file", "")],
+    [("esc", "symlink", "{outside}"), ("esc", "file", "")],
+    [("up", "symlink", "../../.."), ("up2", "file", "")],
+    [("esc", "symlink", "{outside}/.."), ("stolen", "hardlink", "esc/secret")],
+])
+def test_import_refuses_writing_through_symlinks(tmp_path, monkeypatch, capsys, members):
+    from pythonrunscript.pythonrunscript import ARCHIVE_VERSION, environment_tags, import_environment
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    # as on Pythons without extraction filters
+    monkeypatch.delattr(tarfile, "tar_filter", raising=False)
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (tmp_path / "secret").write_text("secret\n")
+    dep_hash = "e" * 32
+    archive = tmp_path / "evil.tar"
+    with tarfile.open(archive, "w") as tar:
+        header = json.dumps(dict(version=ARCHIVE_VERSION, dep_hash=dep_hash, kind="conda",
+                                 project_path="/old", platform=environment_tags(False)[0])).encode()
+        info = tarfile.TarInfo("pythonrunscript-archive.json")
+        info.size = len(header)
+        tar.addfile(info, io.BytesIO(header))
+        info = tarfile.TarInfo(dep_hash)
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+        for (name, kind, target) in members:
+            info = tarfile.TarInfo(f"{dep_hash}/{name}")
+            if kind == "symlink":
+                info.type, info.linkname = tarfile.SYMTYPE, target.format(outside=outside)
+                tar.addfile(info)
+            elif kind == "hardlink":
+                info.type, info.linkname = tarfile.LNKTYPE, f"{dep_hash}/{target}"
+                tar.addfile(info)
+            else:
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"evil"))
+    assert not import_environment(str(archive), False)
+    assert "has the unexpected member" in capsys.readouterr().err
+    assert os.listdir(outside) == []
+    assert os.stat(tmp_path / "secret").st_nlink == 1
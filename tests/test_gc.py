@@ -0,0 +1,75 @@
+import os, time, fcntl
+from pythonrunscript.pythonrunscript import (BuildLock, IN_USE_NAME, WHEELHOUSE_NAME, cache_base,
+                                             collect_garbage, parse_age, parse_size)
+from tests.conftest import make_env, remaining
+
+def test_parse():
+    assert parse_size("20G") == 20 << 30 and parse_size("512m") == 512 << 20 and parse_size("1000") == 1000
+    assert parse_age("30d") == parse_age("30") == 30 * 86400 and parse_age("12h") == 12 * 3600
+
+def test_evicts_least_recently_used_until_under_budget(cache, monkeypatch):
+    for (c, days) in zip("abcd", (4, 1, 3, 2)):
+        make_env(c, 2, days)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_MAX_SIZE", "5M")
+    collect_garbage()
+    assert remaining() == ["b", "d"]
+
+def test_wheelhouse_does_not_count(cache, monkeypatch):
+    for (c, days) in zip("ab", (2, 1)):
+        make_env(c, 2, days)
+    os.makedirs(os.path.join(cache_base(), WHEELHOUSE_NAME))
+    with open(os.path.join(cache_base(), WHEELHOUSE_NAME, "big-1.0-py3-none-any.whl"), "wb") as f:
+        f.write(os.urandom(10 << 20))
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_MAX_SIZE", "5M")
+    collect_garbage()
+    assert remaining() == ["a", "b"]
+
+def test_evicts_by_age(cache, monkeypatch):
+    for (c, days) in zip("abc", (40, 1, 31)):
+        make_env(c, 0, days)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_MAX_AGE", "30d")
+    collect_garbage()
+    assert remaining() == ["b"]
+
+def test_keeps_envs_in_use_or_being_built(cache, monkeypatch):
+    running, building = make_env("a", 0, 9), make_env("b", 0, 9)
+    make_env("c", 0, 9)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_MAX_AGE", "1d")
+    fd = os.open(os.path.join(running.project_path, IN_USE_NAME), os.O_RDONLY)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        with BuildLock(building.dep_hash, building.project_path):
+            collect_garbage()
+    finally:
+        os.close(fd)
+    assert remaining() == ["a", "b"]
+
+def test_no_budget_evicts_nothing(cache):
+    make_env("a", 0, 1000)
+    collect_garbage()
+    assert remaining() == ["a"]
+
+def test_running_script_holds_its_env(cache, monkeypatch):
+    import subprocess, sys
+    proj = make_env("a", 0, 9)
+    os.makedirs(os.path.dirname(proj.interpreter), exist_ok=True)
+    os.symlink(sys.executable, proj.interpreter)
+    script = cache / "script.py"
+    script.write_text("import time\nprint('started', flush=True)\ntime.sleep(30)\n")
+    code = f"from pythonrunscript.pythonrunscript import ProjectPip\nProjectPip({str(script)!r}, {proj.dep_hash!r}, 'x', '', '', False).run([])"
+    p = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True)
+    try:
+        assert p.stdout.readline() == "started\n"
+        monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_MAX_AGE", "1d")
+        collect_garbage()
+        assert remaining() == ["a"]
+    finally:
+        p.kill()
+        p.wait()
+    # the launch counted as a use, so it is no longer stale
+    collect_garbage()
+    assert remaining() == ["a"]
+    t = time.time() - 9 * 86400
+    os.utime(os.path.join(proj.project_path, IN_USE_NAME), (t, t))
+    collect_garbage()
+    assert remaining() == []
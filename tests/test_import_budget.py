@@ -0,0 +1,71 @@
+import os, sys, subprocess
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules the warm launch path (script unchanged, env cached, exec) must not import
+heavy_modules = ["argparse", "logging", "subprocess", "hashlib", "tempfile", "shutil",
+                 "uuid", "textwrap", "shlex", "typing", "enum", "platform", "re"]
+
+def run_python(code, tmp_path, *flags, **extra):
+    env = dict(os.environ, PYTHONPATH=repo, XDG_CACHE_HOME=str(tmp_path / "cache"),
+               PYTHONPYCACHEPREFIX=str(tmp_path / "pycache"))
+    env.update(extra)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env.pop("PYTHONRUNSCRIPT_NO_LAUNCH_INDEX", None)
+    return subprocess.run([sys.executable, *flags, "-c", code], env=env, cwd=str(tmp_path),
+                          capture_output=True, text=True, check=True)
+
+def test_warm_path_imports(tmp_path):
+    script = tmp_path / "plain.py"
+    script.write_text("print('hi')\n")
+    run_python(f"""
+from pythonrunscript.pythonrunscript import Project, record_launch_index
+record_launch_index(Project.make_project({str(script)!r}, False, False))
+""", tmp_path)
+    out = run_python(f"""
+import sys
+from pythonrunscript.pythonrunscript import lookup_launch_index
+assert lookup_launch_index({str(script)!r}, False) is not None
+print(' '.join(sys.modules))
+""", tmp_path).stdout.split()
+    assert [m for m in heavy_modules if m in out] == []
+
+@pytest.mark.parametrize("shared_hit", [False, True])
+def test_warm_path_imports_with_shared_caches(tmp_path, shared_hit):
+    script = tmp_path / "deps.py"
+    script.write_text("# /// pythonrunscript-requirements-txt\n# tqdm\n# ///\nprint('hi')\n")
+    shared = tmp_path / "shared" / "pythonrunscript"
+    # the env is built in the shared cache for a hit, else in the user cache
+    run_python(f"""
+import os
+from pythonrunscript.pythonrunscript import Project
+proj = Project.make_project({str(script)!r}, False, False)
+os.makedirs(proj.envdir)
+proj.publish()
+""", tmp_path, XDG_CACHE_HOME=str(shared.parent if shared_hit else tmp_path / "cache"))
+    run_python(f"""
+from pythonrunscript.pythonrunscript import Project, record_launch_index
+record_launch_index(Project.make_project({str(script)!r}, False, False))
+""", tmp_path, PYTHONRUNSCRIPT_CACHE_PATH=str(shared))
+    out = run_python(f"""
+import sys
+from pythonrunscript.pythonrunscript import lookup_launch_index
+assert lookup_launch_index({str(script)!r}, False) is not None
+print(' '.join(sys.modules))
+""", tmp_path, PYTHONRUNSCRIPT_CACHE_PATH=str(shared)).stdout.split()
+    assert [m for m in heavy_modules if m in out] == []
+
+def test_import_time_budget(tmp_path):
+    budget_us = int(os.environ.get("PYTHONRUNSCRIPT_IMPORT_BUDGET_US", 10_000))
+    code = "import pythonrunscript.pythonrunscript"
+    run_python(code, tmp_path)  # populate the bytecode cache
+    best = None
+    for _ in range(3):
+        err = run_python(code, tmp_path, "-X", "importtime").stderr
+        # "import time: self [us] | cumulative | imported package", top level entries are unindented
+        total = sum(int(line.split('|')[1])
+                    for line in err.splitlines()
+                    if line.startswith("import time:") and line.split('|')[2].startswith(" pythonrunscript"))
+        best = total if best is None else min(best, total)
+    assert best <= budget_us, f"importing pythonrunscript took {best} us, over the {budget_us} us budget"
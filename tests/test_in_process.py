@@ -0,0 +1,45 @@
+import os, sys, signal, subprocess
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+scripts = {
+    "state": """\
+import os, sys, helper
+print(sys.argv, sys.path[0] == os.path.dirname(os.path.abspath(__file__)), __name__, helper.NAME)
+""",
+    "exit": "import sys\nprint('leaving')\nsys.exit(3)\n",
+    "exit message": "raise SystemExit('bye')\n",
+    "exception": "import helper\ndef f():\n    helper.fail()\nf()\n",
+    "syntax error": "print('never'\n",
+    "logging": "import logging\nlogging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')\nlogging.info('hello')\n",
+    "atexit": "import atexit\natexit.register(print, 'at exit')\nprint('body')\n",
+}
+
+helper = "NAME = 'helper'\ndef fail():\n    raise ValueError('nope')\n"
+
+def run_both(tmp_path, text, args=()):
+    "(python3 script.py, pythonrunscript --in-process script.py) results"
+    (tmp_path / "helper.py").write_text(helper)
+    script = tmp_path / "script.py"
+    script.write_text(text)
+    env = dict(os.environ, PYTHONPATH=repo, XDG_CACHE_HOME=str(tmp_path / "cache"), PYTHONRUNSCRIPT_IN_PROCESS="1")
+    direct = subprocess.run([sys.executable, str(script), *args], env=env, capture_output=True, text=True, cwd=tmp_path)
+    in_process = subprocess.run([sys.executable, "-m", "pythonrunscript", str(script), *args],
+                                env=env, capture_output=True, text=True, cwd=tmp_path)
+    return (direct, in_process)
+
+@pytest.mark.parametrize("name", scripts)
+def test_matches_python3(tmp_path, name):
+    (direct, in_process) = run_both(tmp_path, scripts[name], ["a", "--b"])
+    assert (in_process.returncode, in_process.stdout, in_process.stderr) == \
+           (direct.returncode, direct.stdout, direct.stderr)
+
+def test_runs_in_process(tmp_path):
+    (direct, in_process) = run_both(tmp_path, "import sys\nprint('pythonrunscript' in sys.modules)\n")
+    assert (direct.stdout, in_process.stdout) == ("False\n", "True\n")
+
+def test_keyboard_interrupt_kills_with_sigint(tmp_path):
+    (direct, in_process) = run_both(tmp_path, "raise KeyboardInterrupt\n")
+    assert in_process.returncode == direct.returncode == -signal.SIGINT
+    assert in_process.stderr == direct.stderr
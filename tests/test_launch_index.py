@@ -0,0 +1,72 @@
+import os, sys, shutil
+import pytest
+from pythonrunscript.pythonrunscript import (Project, ProjectNoDeps, ProjectPip,
+                                             lookup_launch_index, record_launch_index,
+                                             launch_index_key, launch_index_path)
+
+pip_script = """\
+# /// pythonrunscript-requirements-txt
+# tqdm==4.66.4
+# ///
+print("hello")
+"""
+
+def make_pip_project(cache):
+    script = cache / "script.py"
+    script.write_text(pip_script)
+    proj = Project.make_project(str(script), False, False)
+    os.makedirs(proj.project_path)
+    proj.publish()
+    return proj
+
+def test_hit_after_record(cache):
+    proj = make_pip_project(cache)
+    assert lookup_launch_index(proj.script, False) is None
+    record_launch_index(proj)
+    hit = lookup_launch_index(proj.script, False)
+    assert isinstance(hit, ProjectPip)
+    assert hit.dep_hash == proj.dep_hash
+    assert hit.interpreter == proj.interpreter
+
+def test_nodeps_hit(cache):
+    script = cache / "plain.py"
+    script.write_text("print('hi')\n")
+    record_launch_index(Project.make_project(str(script), False, False))
+    assert isinstance(lookup_launch_index(str(script), False), ProjectNoDeps)
+
+def test_modified_script_misses(cache):
+    proj = make_pip_project(cache)
+    record_launch_index(proj)
+    st = os.stat(proj.script)
+    with open(proj.script, 'a') as f:
+        f.write("print('more')\n")
+    os.utime(proj.script, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert lookup_launch_index(proj.script, False) is None
+
+def test_missing_env_misses(cache):
+    proj = make_pip_project(cache)
+    record_launch_index(proj)
+    shutil.rmtree(proj.project_path)
+    assert lookup_launch_index(proj.script, False) is None
+
+def test_another_python_misses(cache, monkeypatch):
+    proj = make_pip_project(cache)
+    record_launch_index(proj)
+    monkeypatch.setattr(sys, "executable", "/usr/bin/python3.99")
+    assert lookup_launch_index(proj.script, False) is None
+
+@pytest.mark.parametrize("garbage", [b"", b"\xff\xfe\x00", b"1\tonly\tthree\n", b"9\ta\tb\tc\td\te\tf\tg\th\n"])
+def test_corrupt_entry_misses(cache, garbage):
+    proj = make_pip_project(cache)
+    record_launch_index(proj)
+    with open(launch_index_path(launch_index_key(proj.script)[0]), 'wb') as f:
+        f.write(garbage)
+    assert lookup_launch_index(proj.script, False) is None
+    record_launch_index(proj)
+    assert lookup_launch_index(proj.script, False) is not None
+
+def test_disabled_by_env(cache, monkeypatch):
+    proj = make_pip_project(cache)
+    record_launch_index(proj)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_NO_LAUNCH_INDEX", "1")
+    assert lookup_launch_index(proj.script, False) is None
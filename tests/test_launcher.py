@@ -0,0 +1,110 @@
+import os, time, shutil
+from pythonrunscript.pythonrunscript import parse_dependencies
+from tests.test_end_to_end import pip_script, conda_specs_script, write
+
+def install(launcher, script, *dest, **env):
+    for d in dest:
+        os.makedirs(d, exist_ok=True)
+    cp = launcher.run("--install-launcher", str(script), *map(str, dest), **env)
+    assert cp.returncode == 0, cp.stderr
+    return cp
+
+def edit(script, text):
+    "Rewrites script, making sure its mtime changes"
+    mtime = os.stat(script).st_mtime_ns
+    script.write_text(text)
+    os.utime(script, ns=(mtime + 10**9, mtime + 10**9))
+
+def env_dir(tmp_path) -> str:
+    cache = tmp_path / "cache" / "pythonrunscript"
+    [name] = [n for n in os.listdir(cache) if len(n) == 32]
+    return str(cache / name)
+
+def test_launcher_runs_the_env_directly(tmp_path, launcher):
+    script = write(tmp_path, pip_script.replace("print(", "print(sys.argv[1:], "))
+    install(launcher, script, tmp_path / "bin")
+    cp = launcher.run_program([str(tmp_path / "bin" / "script"), "a", "b c"])
+    assert (cp.returncode, cp.stdout) == (0, "['a', 'b c'] True\n"), cp.stderr
+    # no pythonrunscript ran, so nothing exec'd the script
+    assert cp.spawned == []
+
+def test_default_destination(tmp_path, launcher):
+    script = write(tmp_path, "print(True)\n")
+    cp = install(launcher, script, HOME=str(tmp_path / "home"))
+    path = tmp_path / "home" / ".local" / "bin" / "script"
+    assert f"Wrote the launcher {path}" in cp.stdout
+    cp = launcher.run_program([str(path)])
+    assert (cp.returncode, cp.stdout, cp.spawned) == (0, "True\n", [])
+
+def test_edited_script_falls_back_and_rewrites_the_launcher(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    install(launcher, script, tmp_path / "bin")
+    path = str(tmp_path / "bin" / "script")
+    edit(script, pip_script.replace("# beta", "# alpha==1.0").replace("alpha, beta,", "alpha,"))
+    cp = launcher.run_program([path])
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert ["-m", "pip"] in [argv[1:3] for argv in cp.spawned]
+    with open(path) as f:
+        assert parse_dependencies(str(script))[0] in f.read()
+    cp = launcher.run_program([path])
+    assert (cp.returncode, cp.stdout, cp.spawned) == (0, "True\n", [])
+
+def test_removed_env_falls_back(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    install(launcher, script, tmp_path / "bin")
+    shutil.rmtree(env_dir(tmp_path))
+    cp = launcher.run_program([str(tmp_path / "bin" / "script")])
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert cp.spawned[-1] == [cp.spawned[-1][0], str(script)]
+
+def test_conda_launcher_applies_the_activation(tmp_path, fake_conda, launcher):
+    script = write(tmp_path, conda_specs_script)
+    install(launcher, script, tmp_path / "bin")
+    calls = len(fake_conda.calls())
+    cp = launcher.run_program([str(tmp_path / "bin" / "script")])
+    assert (cp.returncode, cp.stdout, cp.spawned) == (0, "True\n", []), cp.stderr
+    assert len(fake_conda.calls()) == calls
+
+def test_leaves_other_files_alone(tmp_path, launcher):
+    script = write(tmp_path, "print(True)\n")
+    other = tmp_path / "other"
+    other.write_text("precious\n")
+    cp = launcher.run("--install-launcher", str(script), str(other))
+    assert cp.returncode == 1
+    assert "is not a launcher for" in cp.stderr
+    assert other.read_text() == "precious\n"
+    # a script without an extension would be its own launcher
+    bare = tmp_path / "bare"
+    bare.write_text("print(True)\n")
+    assert launcher.run("--install-launcher", str(bare), str(tmp_path)).returncode == 1
+    assert bare.read_text() == "print(True)\n"
+
+def test_launches_count_as_uses(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    install(launcher, script, tmp_path / "bin")
+    in_use = os.path.join(env_dir(tmp_path), "in-use.lock")
+    if os.path.exists(in_use):
+        os.utime(in_use, (0, 0))
+    assert launcher.run_program([str(tmp_path / "bin" / "script")]).returncode == 0
+    assert time.time() - os.stat(in_use).st_mtime < 60
+
+def test_unwritable_in_use_lock_does_not_stop_launches(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    install(launcher, script, tmp_path / "bin")
+    in_use = os.path.join(env_dir(tmp_path), "in-use.lock")
+    if os.path.exists(in_use):
+        os.remove(in_use)
+    os.mkdir(in_use)
+    cp = launcher.run_program([str(tmp_path / "bin" / "script")])
+    assert (cp.returncode, cp.stdout, cp.stderr, cp.spawned) == (0, "True\n", "", [])
+
+def test_envs_run_by_launchers_are_kept(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    install(launcher, script, tmp_path / "bin")
+    env = env_dir(tmp_path)
+    cp = launcher.run("--clean-cache", os.path.basename(env))
+    assert "run by a launcher" in cp.stdout
+    assert os.path.exists(env)
+    os.remove(tmp_path / "bin" / "script")
+    launcher.run("--clean-cache", os.path.basename(env))
+    assert not os.path.exists(env)
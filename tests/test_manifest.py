@@ -0,0 +1,73 @@
+import os, time
+import pytest
+from pythonrunscript.pythonrunscript import (BuildLock, ProjectPip, ensure_project, read_manifest,
+                                             sweep_incomplete_projects, cache_base, locks_base,
+                                             is_project_dir_name)
+
+class FakeBuild(ProjectPip):
+    builds = 0
+    def create(self):
+        FakeBuild.builds += 1
+        os.makedirs(self.envdir)
+        return True
+
+@pytest.fixture
+def cache(cache):
+    FakeBuild.builds = 0
+    return cache
+
+def project(h="0" * 32):
+    return FakeBuild("script.py", h, "tqdm\n", "", "", False)
+
+def test_manifest_marks_completion(cache):
+    proj = project()
+    assert not proj.exists()
+    assert ensure_project(proj)
+    assert proj.exists()
+    manifest = read_manifest(proj.project_path)
+    assert (manifest["dep_hash"], manifest["kind"], manifest["interpreter"]) == (proj.dep_hash, "pip", proj.interpreter)
+    assert manifest["build_seconds"] >= 0
+    assert ensure_project(proj) and FakeBuild.builds == 1
+
+def test_interrupted_build_is_rebuilt(cache):
+    proj = project()
+    os.makedirs(os.path.join(proj.project_path, "venv", "half-installed"))
+    assert not proj.exists()
+    assert ensure_project(proj)
+    assert FakeBuild.builds == 1
+    assert not os.path.exists(os.path.join(proj.envdir, "half-installed"))
+
+def test_legacy_env_is_adopted(cache):
+    proj = project()
+    os.makedirs(proj.envdir)
+    for f in ("requirements.txt", "piplist.txt"):
+        open(os.path.join(proj.project_path, f), "w").close()
+    assert ensure_project(proj)
+    assert FakeBuild.builds == 0
+    assert read_manifest(proj.project_path)["adopted"]
+
+def test_sweep(cache):
+    old, fresh, locked, done = (project(c * 32) for c in "abcd")
+    for p in (old, fresh, locked):
+        os.makedirs(p.envdir)
+    ensure_project(done)
+    for p in (old, locked, done):
+        os.utime(p.project_path, (time.time() - 7200,) * 2)
+    os.makedirs(locks_base(), exist_ok=True)
+    with BuildLock(locked.dep_hash, locked.project_path):
+        sweep_incomplete_projects()
+    assert sorted(n for n in os.listdir(cache_base()) if is_project_dir_name(n)) == sorted([fresh.dep_hash, locked.dep_hash, done.dep_hash])
+
+def test_sweep_adopts_only_unlocked_legacy_dirs(cache):
+    legacy, building = (project(c * 32) for c in "ab")
+    for p in (legacy, building):
+        os.makedirs(p.envdir)
+        # a build writes these before its last steps, like pip check or precompiling
+        for f in ("requirements.txt", "piplist.txt"):
+            open(os.path.join(p.project_path, f), "w").close()
+        os.utime(p.project_path, (time.time() - 7200,) * 2)
+    os.makedirs(locks_base(), exist_ok=True)
+    with BuildLock(building.dep_hash, building.project_path):
+        sweep_incomplete_projects()
+    assert read_manifest(legacy.project_path)["adopted"]
+    assert read_manifest(building.project_path) is None
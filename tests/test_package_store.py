@@ -0,0 +1,70 @@
+import os, shutil, subprocess, threading
+import pytest
+import pythonrunscript.pythonrunscript as prs
+from pythonrunscript.pythonrunscript import Log, StoreLock, create_venv, prune_package_store, store_base
+from tests.dummy_wheels import make_wheel
+
+@pytest.fixture
+def wheelhouse(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("PYTHONRUNSCRIPT_PACKAGE_STORE", "1")
+    wh = tmp_path / "wheels"
+    make_wheel(wh, "alpha", "1.0", console_scripts={"alpha-cli": "alpha:main"})
+    make_wheel(wh, "beta", "2.0", requires=["alpha"])
+    return wh
+
+def build(tmp_path, wheelhouse, name, reqs):
+    proj = tmp_path / name
+    venv = proj / "venv"
+    assert create_venv(str(proj), str(venv), f"--no-index\n--find-links {wheelhouse}\n{reqs}\n", Log.SILENT)
+    return venv
+
+def site_file(venv, path):
+    [sp] = (venv / "lib").glob("python*/site-packages")
+    return sp / path
+
+def test_envs_share_stored_files(tmp_path, wheelhouse):
+    v1 = build(tmp_path, wheelhouse, "p1", "beta")
+    assert sorted(os.listdir(store_base())) == ["alpha-1.0-py3-none-any", "beta-2.0-py3-none-any"]
+    v2 = build(tmp_path, wheelhouse, "p2", "alpha")
+    stored = os.path.join(store_base(), "alpha-1.0-py3-none-any", "alpha", "__init__.py")
+    assert os.stat(stored).st_ino == site_file(v1, "alpha/__init__.py").stat().st_ino
+    assert os.stat(stored).st_ino == site_file(v2, "alpha/__init__.py").stat().st_ino
+    assert subprocess.run([str(v2 / "bin" / "alpha-cli")], capture_output=True, text=True).stdout == "alpha 1.0\n"
+    freeze = subprocess.run([str(v2 / "bin" / "python3"), "-m", "pip", "freeze"], capture_output=True, text=True).stdout
+    assert freeze.split() == ["alpha==1.0"]
+    # removing an env, or the whole store, leaves the other envs working
+    shutil.rmtree(v1)
+    shutil.rmtree(store_base())
+    out = subprocess.run([str(v2 / "bin" / "python3"), "-c", "import alpha; alpha.main()"],
+                         capture_output=True, text=True).stdout
+    assert out == "alpha 1.0\n"
+
+def test_store_disabled(tmp_path, wheelhouse, monkeypatch):
+    monkeypatch.delenv("PYTHONRUNSCRIPT_PACKAGE_STORE")
+    build(tmp_path, wheelhouse, "p1", "alpha")
+    assert not os.path.exists(store_base())
+
+def test_entry_vanishing_while_linking_falls_back_to_pip(tmp_path, wheelhouse, monkeypatch):
+    build(tmp_path, wheelhouse, "p1", "alpha")
+    def vanished(src, dst):
+        raise FileNotFoundError(src)
+    monkeypatch.setattr(prs, "link_or_copy", vanished)
+    v2 = build(tmp_path, wheelhouse, "p2", "alpha")
+    stored = os.path.join(store_base(), "alpha-1.0-py3-none-any", "alpha", "__init__.py")
+    assert os.stat(stored).st_ino != site_file(v2, "alpha/__init__.py").stat().st_ino
+    out = subprocess.run([str(v2 / "bin" / "python3"), "-c", "import alpha; alpha.main()"],
+                         capture_output=True, text=True).stdout
+    assert out == "alpha 1.0\n"
+
+def test_pruning_waits_for_linking(tmp_path, wheelhouse):
+    v1 = build(tmp_path, wheelhouse, "p1", "alpha")
+    shutil.rmtree(v1)
+    with StoreLock(exclusive=False):
+        pruner = threading.Thread(target=prune_package_store)
+        pruner.start()
+        pruner.join(0.5)
+        assert pruner.is_alive()
+        assert os.listdir(store_base()) == ["alpha-1.0-py3-none-any"]
+    pruner.join(10)
+    assert os.listdir(store_base()) == []
@@ -158,3 +158,45 @@ rich
 """
     assert exp_pip == out_pip, "unexpected requirements generated from script TOML"
     assert exp_conda_specs == out_conda, "unexpected conda install specs generated from script TOML"
+
+def regex_blocks(text:str) -> dict:
+    "Reference: the per-pair multiline regex search parse_dependencies used before the streaming scanner"
+    import re
+    from pythonrunscript.pythonrunscript import block_type_delimiters
+    found = {}
+    for (_, pairs) in block_type_delimiters:
+        for (beg, end) in pairs:
+            pattern = rf"(?m:^{re.escape(beg)}$\s(?P<content>(^#(| .*)$\s)+?)^{re.escape(end)}$(?:\s)?)"
+            if (m := re.search(pattern, text)):
+                found[(beg, end)] = m.group('content')
+    return found
+
+scanner_vocabulary = ["# /// script", "# /// pythonrunscript-requirements-txt",
+                      "# /// pythonrunscript-conda-install-specs-txt", "# /// pythonrunscript-environment-yml",
+                      "# ///", "# ```requirements.txt", "# ```conda_install_specs.txt",
+                      "# ```environment.yml", "# ```", "# dep==1.0", "#", "#bad", "", "# ",
+                      'dependencies = ["x"]']
+
+@pytest.mark.parametrize("seed", list(range(300)))
+def test_scanner_matches_regex(seed, tmp_path):
+    import random
+    from pythonrunscript.pythonrunscript import scan_dependency_blocks
+    rng = random.Random(seed)
+    lines = [rng.choice(scanner_vocabulary[:-1]) for _ in range(rng.randint(1, 30))]
+    text = '\n'.join(lines) + rng.choice(['', '\n'])
+    p = tmp_path / "s.py"
+    p.write_text(text)
+    assert scan_dependency_blocks(str(p)) == regex_blocks(text)
+
+def test_scanner_stops_at_code(tmp_path):
+    from pythonrunscript.pythonrunscript import scan_dependency_blocks
+    p = tmp_path / "s.py"
+    p.write_text("import os\n# ```requirements.txt\n# tqdm\n# ```\n")
+    assert scan_dependency_blocks(str(p)) == {}
+
+def test_scanner_byte_cap(tmp_path):
+    from pythonrunscript.pythonrunscript import scan_dependency_blocks
+    p = tmp_path / "s.py"
+    p.write_text("#\n" * 1000 + "# ```requirements.txt\n# tqdm\n# ```\n")
+    assert scan_dependency_blocks(str(p), max_bytes=1000) == {}
+    assert scan_dependency_blocks(str(p)) == {("# ```requirements.txt", "# ```"): "# tqdm\n"}
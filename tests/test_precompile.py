@@ -0,0 +1,48 @@
+import os, sys, json, subprocess
+import pytest
+from pythonrunscript.pythonrunscript import ProjectPip, MANIFEST_NAME, precompile_environment, site_packages_dir
+from tests.test_end_to_end import pip_script, write
+
+tag = sys.implementation.cache_tag
+
+@pytest.fixture
+def proj(tmp_path, monkeypatch):
+    "A pip project whose venv has one module in site-packages"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.delenv("PYTHONOPTIMIZE", raising=False)
+    proj = ProjectPip("script.py", "a" * 32, "mod\n", "", "", False)
+    subprocess.run([sys.executable, "-m", "venv", "--without-pip", proj.envdir], check=True)
+    with open(os.path.join(site_packages_dir(proj.interpreter), "mod.py"), "w") as f:
+        f.write("x = 1\n")
+    return proj
+
+def log(proj) -> str:
+    with open(os.path.join(proj.project_path, "logs", "precompile.out")) as f:
+        return f.read()
+
+@pytest.mark.parametrize("optimize,pyc", [(None, f"mod.{tag}.pyc"), ("1", f"mod.{tag}.opt-1.pyc")])
+def test_compiles_site_packages(proj, monkeypatch, optimize, pyc):
+    if optimize:
+        monkeypatch.setenv("PYTHONOPTIMIZE", optimize)
+    precompile_environment(proj)
+    assert os.listdir(os.path.join(site_packages_dir(proj.interpreter), "__pycache__")) == [pyc]
+    assert proj.build_details["precompile_seconds"] >= 0
+    assert log(proj).startswith("## compiled ")
+
+def test_files_which_do_not_compile_are_only_logged(proj):
+    with open(os.path.join(site_packages_dir(proj.interpreter), "py2.py"), "w") as f:
+        f.write("print 'hello'\n")
+    precompile_environment(proj)
+    assert os.path.exists(os.path.join(site_packages_dir(proj.interpreter), "__pycache__", f"mod.{tag}.pyc"))
+    assert "py2.py" in log(proj)
+    assert log(proj).rstrip().endswith(", with errors")
+
+def test_build_precompiles(tmp_path, launcher):
+    script = write(tmp_path, pip_script)
+    cp = launcher.run(str(script), PYTHONRUNSCRIPT_PRECOMPILE="1")
+    assert (cp.returncode, cp.stdout) == (0, "True\n"), cp.stderr
+    assert ["-m", "compileall"] in [argv[1:3] for argv in cp.spawned]
+    cache = tmp_path / "cache" / "pythonrunscript"
+    [env] = [n for n in os.listdir(cache) if len(n) == 32]
+    with open(cache / env / MANIFEST_NAME) as f:
+        assert "precompile_seconds" in json.load(f)
@@ -0,0 +1,47 @@
+import json, os, subprocess, sys
+import pytest
+from tests.dummy_wheels import make_wheel
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def script(deps):
+    block = "".join(f"# {line}\n" for line in deps)
+    return f"# /// pythonrunscript-requirements-txt\n{block}# ///\nimport alpha\nalpha.main()\n"
+
+@pytest.fixture
+def tree(tmp_path):
+    wh = tmp_path / "wheels"
+    make_wheel(wh, "alpha", "1.0")
+    index = ["--no-index", f"--find-links {wh}"]
+    root = tmp_path / "scripts"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.py").write_text(script(index + ["alpha"]))
+    (root / "sub" / "b.py").write_text(script(index + ["alpha"]))
+    (root / "plain.py").write_text('print("plain")\n')
+    (root / "broken.py").write_text(script(index + ["zeta-does-not-exist"]))
+    (root / "notes.txt").write_text("not a script\n")
+    return root
+
+def prepare(tmp_path, *paths):
+    env = dict(os.environ, PYTHONPATH=repo, XDG_CACHE_HOME=str(tmp_path / "cache"),
+               PYTHONRUNSCRIPT_PREPARE_PIP_JOBS="2")
+    cp = subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", "--prepare", "--json", *map(str, paths)],
+                        env=env, capture_output=True, text=True)
+    return cp.returncode, {os.path.basename(r["scripts"][0]): r for r in json.loads(cp.stdout)}, env
+
+def test_prepare_tree(tmp_path, tree):
+    code, rows, env = prepare(tmp_path, tree)
+    assert code == 1
+    assert sorted(rows) == ["a.py", "broken.py", "plain.py"]
+    assert rows["a.py"]["status"] == "built"
+    assert len(rows["a.py"]["scripts"]) == 2
+    assert rows["broken.py"]["status"] == "failed"
+    assert rows["plain.py"]["status"] == "no deps"
+
+    code, rows, env = prepare(tmp_path, tree / "a.py", tree / "sub")
+    assert code == 0
+    assert [r["status"] for r in rows.values()] == ["cached"]
+    # prepared scripts launch from the launch index
+    out = subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", str(tree / "sub" / "b.py")],
+                         env=env, capture_output=True, text=True).stdout
+    assert out == "alpha 1.0\n"
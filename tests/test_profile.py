@@ -0,0 +1,49 @@
+import json, os, subprocess, sys
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def env(tmp_path):
+    env = dict(os.environ, PYTHONPATH=repo, XDG_CACHE_HOME=str(tmp_path / "cache"))
+    env.pop("PYTHONRUNSCRIPT_PROFILE", None)
+    return env
+
+def run(args, env, cwd=None):
+    return subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", *args],
+                          env=env, cwd=cwd, capture_output=True, text=True, check=True)
+
+def test_trace_written_before_exec(tmp_path, env):
+    script = tmp_path / "hello.py"
+    script.write_text('print("hello")\n')
+    trace = tmp_path / "trace.json"
+    cp = run([str(script)], dict(env, PYTHONRUNSCRIPT_PROFILE=str(trace)))
+    assert cp.stdout == "hello\n"
+    data = json.loads(trace.read_text())
+    names = [e["name"] for e in data["traceEvents"]]
+    assert "lookup_launch_index" in names
+    assert "make_project" in names
+    assert names[-1] == "exec"
+    assert all(e["dur"] >= 0 for e in data["traceEvents"] if e["ph"] == "X")
+
+def test_profile_flag_writes_to_cache(tmp_path, env):
+    script = tmp_path / "hello.py"
+    script.write_text('print("hello")\n')
+    run(["--profile", str(script)], env)
+    profiles = os.listdir(tmp_path / "cache" / "pythonrunscript" / "profiles")
+    assert len(profiles) == 1
+
+def test_trace_written_on_exit_without_exec(tmp_path, env):
+    trace = tmp_path / "trace.json"
+    run(["--show-cache"], dict(env, PYTHONRUNSCRIPT_PROFILE=str(trace)))
+    assert json.loads(trace.read_text())["otherData"]["argv"]
+
+@pytest.mark.parametrize("off", ["", "0"])
+def test_off_values_write_nothing(tmp_path, env, off):
+    script = tmp_path / "hello.py"
+    script.write_text('print("hello")\n')
+    work = tmp_path / "work"
+    work.mkdir()
+    run([str(script)], dict(env, PYTHONRUNSCRIPT_PROFILE=off), cwd=work)
+    assert os.listdir(work) == []
+    assert not os.path.exists(tmp_path / "cache" / "pythonrunscript" / "profiles")
@@ -0,0 +1,49 @@
+import gzip, os, sys
+import pytest
+from pythonrunscript.pythonrunscript import Log, run_with_logging
+
+emit = """
+import sys
+for i in range(3):
+    print(f"out {i}", flush=True)
+    print(f"err {i}", file=sys.stderr, flush=True)
+sys.exit(int(sys.argv[1]))
+"""
+
+def step(tmp_path, verbosity, code=0):
+    return run_with_logging([sys.executable, "-c", emit, str(code)], str(tmp_path),
+                            "step.out", "step.err", verbosity)
+
+def log(tmp_path, name):
+    return (tmp_path / "logs" / name).read_text()
+
+@pytest.mark.parametrize("verbosity", [Log.SILENT, Log.ERRORS, Log.VERBOSE])
+def test_logs_both_streams(tmp_path, capfd, verbosity):
+    assert step(tmp_path, verbosity)
+    assert log(tmp_path, "step.out") == "out 0\nout 1\nout 2\n"
+    assert log(tmp_path, "step.err") == "err 0\nerr 1\nerr 2\n"
+    out, err = capfd.readouterr()
+    assert ("err 1" in err) == (verbosity != Log.SILENT)
+    assert ("out 1" in out) == (verbosity == Log.VERBOSE)
+
+def test_silent_failure_prints_nothing(tmp_path, capfd):
+    assert not step(tmp_path, Log.SILENT, 3)
+    assert capfd.readouterr() == ("", "")
+
+def test_errors_failure_reports_stderr(tmp_path, capfd):
+    assert not step(tmp_path, Log.ERRORS, 3)
+    out, err = capfd.readouterr()
+    assert "Error encountered" in err
+    assert "err 2" in out
+
+def test_missing_command_fails(tmp_path):
+    assert not run_with_logging(["/nonexistent/command"], str(tmp_path), "x.out", "x.err", Log.SILENT)
+    assert "nonexistent" in log(tmp_path, "x.err")
+
+def test_logs_rotate_past_cap(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYTHONRUNSCRIPT_LOG_MAX_BYTES", "20")
+    for _ in range(3):
+        assert step(tmp_path, Log.SILENT)
+    assert os.path.getsize(tmp_path / "logs" / "step.out") <= 20
+    with gzip.open(tmp_path / "logs" / "step.out.1.gz", "rt") as f:
+        assert f.read().startswith("out")
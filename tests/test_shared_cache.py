@@ -0,0 +1,72 @@
+import os, sys, subprocess
+import pytest
+from pythonrunscript.pythonrunscript import Project, ProjectPip, lookup_launch_index, record_launch_index
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pip_script = """\
+# /// pythonrunscript-requirements-txt
+# tqdm==4.66.4
+# ///
+import sys
+print(sys.prefix)
+"""
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "user"))
+    monkeypatch.setenv("PYTHONRUNSCRIPT_CACHE_PATH", os.pathsep.join([str(tmp_path / "empty"), str(tmp_path / "shared")]))
+    monkeypatch.delenv("PYTHONRUNSCRIPT_NO_LAUNCH_INDEX", raising=False)
+    script = tmp_path / "script.py"
+    script.write_text(pip_script)
+    return tmp_path
+
+def publish_shared_env(caches):
+    "Fakes an admin-built venv in the shared cache, using this interpreter"
+    proj = ProjectPip(str(caches / "script.py"), Project.make_project(str(caches / "script.py"), False, False).dep_hash,
+                      '', '', '', False)
+    proj._project_path = str(caches / "shared" / proj.dep_hash)
+    subprocess.run([sys.executable, "-m", "venv", "--without-pip", proj.envdir], check=True)
+    proj.publish()
+    return proj
+
+def listing(path):
+    return sorted(os.path.join(d, f) for (d, _, fs) in os.walk(path) for f in fs)
+
+def test_shared_hit(caches):
+    proj = publish_shared_env(caches)
+    found = Project.make_project(str(caches / "script.py"), False, False)
+    assert found.project_path == proj.project_path
+    assert found.shared and found.exists()
+
+def test_miss_falls_back_to_user_cache(caches):
+    found = Project.make_project(str(caches / "script.py"), False, False)
+    assert found.project_path == str(caches / "user" / "pythonrunscript" / found.dep_hash)
+    assert not found.shared
+
+def test_run_never_writes_shared_cache(caches):
+    proj = publish_shared_env(caches)
+    before = listing(caches / "shared")
+    for _ in range(2):
+        cp = subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", "--verbose", str(caches / "script.py")],
+                            env=dict(os.environ, PYTHONPATH=repo), capture_output=True, text=True)
+        assert cp.returncode == 0, cp.stderr
+        assert cp.stdout.splitlines()[-1] == proj.envdir
+    assert "## Found the environment in the shared cache" in cp.stdout
+    assert listing(caches / "shared") == before
+    assert not os.path.exists(caches / "user" / "pythonrunscript" / proj.dep_hash)
+
+def test_launch_index_lookup_stats(caches, monkeypatch):
+    proj = publish_shared_env(caches)
+    record_launch_index(proj)
+    stats = []
+    real_stat = os.stat
+    def counting_stat(path, *args, **kwargs):
+        stats.append(str(path))
+        return real_stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, "stat", counting_stat)
+    hit = lookup_launch_index(proj.script, False)
+    monkeypatch.undo()
+    assert hit is not None and hit.shared
+    # the script itself, then one per shared cache searched, then the manifest found
+    assert len(stats) == 4
@@ -0,0 +1,96 @@
+import os, sys, time, fcntl, subprocess
+import pytest
+from pythonrunscript.pythonrunscript import (Project, ProjectPip, IN_USE_NAME, WHEELHOUSE_NAME, cache_base, trash_base,
+                                             pseudo_erase_dir, empty_trash, schedule_trash_disposal, clean_cache)
+from tests.conftest import make_env, remaining
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def trashed():
+    return [n for n in os.listdir(trash_base()) if n != ".lock"] if os.path.isdir(trash_base()) else []
+
+def test_trashing_renames_within_the_cache(cache):
+    proj = make_env("a")
+    inode = os.stat(proj.project_path).st_ino
+    dst = pseudo_erase_dir(proj.project_path)
+    assert os.path.dirname(dst) == trash_base() == os.path.join(cache_base(), ".trash")
+    assert os.stat(dst).st_ino == inode
+
+def test_empty_trash(cache):
+    for c in "ab":
+        pseudo_erase_dir(make_env(c).project_path)
+    empty_trash()
+    assert trashed() == []
+
+def test_empty_trash_is_rate_limited(cache, monkeypatch):
+    pseudo_erase_dir(make_env("a").project_path)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_TRASH_RATE", "1M")
+    start = time.monotonic()
+    empty_trash()
+    assert time.monotonic() - start > 0.9
+    assert trashed() == []
+
+def test_one_emptier_at_a_time(cache):
+    pseudo_erase_dir(make_env("a").project_path)
+    with open(os.path.join(trash_base(), ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        empty_trash()
+        assert len(trashed()) == 1
+
+def test_background_disposal(cache):
+    pseudo_erase_dir(make_env("a").project_path)
+    schedule_trash_disposal()
+    deadline = time.monotonic() + 30
+    while trashed() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert trashed() == []
+
+def test_clean_everything_but_the_wheelhouse(cache):
+    for c in "ab":
+        make_env(c)
+    os.makedirs(os.path.join(cache_base(), WHEELHOUSE_NAME))
+    assert clean_cache([], None)
+    assert sorted(os.listdir(cache_base())) == [".trash", "locks", WHEELHOUSE_NAME]
+
+def test_clean_by_hash_prefix(cache):
+    for c in "abc":
+        make_env(c)
+    assert clean_cache(["aaaaaa", "c" * 32], None)
+    assert remaining() == ["b"]
+
+def test_clean_by_script(cache):
+    script = cache / "script.py"
+    script.write_text("# /// pythonrunscript-requirements-txt\n# tqdm\n# ///\n")
+    dep_hash = Project.make_project(str(script), False, False).dep_hash
+    make_env("a")
+    proj = ProjectPip(str(script), dep_hash, "tqdm\n", "", "", False)
+    os.makedirs(proj.envdir)
+    proj.publish()
+    assert clean_cache([str(script)], None)
+    assert remaining() == ["a"]
+
+def test_clean_older_than(cache):
+    for (c, days) in zip("abc", (40, 1, 31)):
+        make_env(c, days_ago=days)
+    cp = subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", "--clean-cache", "--older-than", "30d"],
+                        env=dict(os.environ, PYTHONPATH=repo), capture_output=True, text=True)
+    assert cp.returncode == 0, cp.stderr
+    assert remaining() == ["b"]
+
+def test_clean_refuses_unmatched_or_ambiguous_selectors(cache):
+    make_env("a")
+    os.makedirs(os.path.join(cache_base(), "a" * 31 + "b"))
+    assert not clean_cache(["aaaa"], None)
+    assert not clean_cache(["ffff"], None)
+    assert len(os.listdir(cache_base())) == 2
+
+@pytest.mark.parametrize("selectors", [["aaaa"], []])
+def test_clean_keeps_envs_in_use(cache, selectors):
+    proj = make_env("a")
+    make_env("b")
+    with open(os.path.join(proj.project_path, IN_USE_NAME)) as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        assert clean_cache(selectors, None)
+        assert remaining() == (["a", "b"] if selectors else ["a"])
+        empty_trash()
+        assert os.path.exists(os.path.join(proj.envdir, "lib", "payload"))
@@ -0,0 +1,38 @@
+import os, shutil, subprocess, sys
+import pytest
+from pythonrunscript.pythonrunscript import Log, create_venv, wheelhouse_dir
+from tests.dummy_wheels import make_wheel
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.delenv("PYTHONRUNSCRIPT_OFFLINE", raising=False)
+    monkeypatch.delenv("PYTHONRUNSCRIPT_NO_WHEELHOUSE", raising=False)
+    wh = tmp_path / "index"
+    make_wheel(wh, "alpha", "1.0")
+    make_wheel(wh, "beta", "2.0", requires=["alpha"])
+    return wh
+
+def build(tmp_path, name, reqs):
+    proj = tmp_path / name
+    return create_venv(str(proj), str(proj / "venv"), reqs, Log.SILENT)
+
+def test_builds_fill_wheelhouse_for_offline_rebuilds(tmp_path, index, monkeypatch):
+    assert build(tmp_path, "p1", f"--no-index\n--find-links {index}\nbeta\n")
+    assert sorted(os.listdir(wheelhouse_dir())) == ["alpha-1.0-py3-none-any.whl", "beta-2.0-py3-none-any.whl"]
+    shutil.rmtree(index)
+    monkeypatch.setenv("PYTHONRUNSCRIPT_OFFLINE", "1")
+    assert build(tmp_path, "p2", "beta\n")
+    assert not build(tmp_path, "p3", "gamma\n")
+
+def test_seed_wheelhouse(tmp_path, index):
+    reqs = tmp_path / "requirements.txt"
+    reqs.write_text(f"--no-index\n--find-links {index}\nbeta\n")
+    env = dict(os.environ, PYTHONPATH=repo)
+    cp = subprocess.run([sys.executable, "-m", "pythonrunscript.pythonrunscript", "--seed-wheelhouse", str(reqs)],
+                        env=env, capture_output=True, text=True)
+    assert cp.returncode == 0, cp.stderr
+    assert "Added 2 wheels" in cp.stdout
+    assert sorted(os.listdir(wheelhouse_dir())) == ["alpha-1.0-py3-none-any.whl", "beta-2.0-py3-none-any.whl"]